@@ -65,25 +65,56 @@ function initDamageMap() {
     // Variable to store the tile bounds data
     let tileBoundsData = [];
     
+    // Precomputed heatmap points need no polygon geometry, so show them as soon as they arrive
+    const heatmapPointsPromise = loadHeatmapPoints('data/damage_heatmap_points.bin')
+        .then(points => {
+            if (points.length > 0 && !map._loaded) {
+                map.fitBounds(L.latLngBounds(points.map(point => [point[0], point[1]])), {
+                    padding: [20, 20],
+                    maxZoom: 16
+                });
+            }
+            createHeatmapLayer(map, points);
+            return points;
+        })
+        .catch(error => {
+            console.warn('Precomputed heatmap points unavailable, deriving them from polygons:', error);
+            return null;
+        });
+    
     // Load data for buildings, craters, dataset perimeter, and tile bounds
     Promise.all([
-        loadBuildingPolygonData('data/building-polygons-labeled/'),
+        loadBuildingBundle('data/buildings_bundle.bin')
+            .catch(error => {
+                // Fall back to the per-tile files if the bundle has not been built
+                console.warn('Building bundle unavailable, loading per-tile files:', error);
+                return loadBuildingPolygonData('data/building-polygons-labeled/');
+            }),
         loadCraterData('data/all_craters.json'),
         loadDatasetPerimeter('data/tile_perimeter.geojson'),
-        loadTileBoundsData('data/tile_bounds_coords_adj.csv')
+        loadTileBoundsData('data/tile_bounds_coords_adj.csv'),
+        heatmapPointsPromise,
+        loadCraterDensityOverlay('data/crater_density.json')
+            .catch(error => {
+                // Without the raster, craters stay circle markers at every zoom
+                console.warn('Crater density overlay unavailable:', error);
+                return null;
+            })
     ])
-    .then(([buildingData, craterData, perimeterData, tileData]) => {
+    .then(([buildingData, craterData, perimeterData, tileData, heatmapPoints, craterDensityOverlay]) => {
         // Store the tile data for later use
         tileBoundsData = tileData;
         
         // Display the buildings data
         const buildingPoints = displayBuildingDamageData(map, buildingData, buildingsLayer);
         
-        // Create heatmap layer with building data
-        createHeatmapLayer(map, buildingPoints);
+        // Create heatmap layer with building data unless the precomputed points were loaded
+        if (!heatmapPoints) {
+            createHeatmapLayer(map, buildingPoints);
+        }
         
         // Display the craters data
-        displayCraterData(map, craterData, cratersLayer);
+        displayCraterData(map, craterData, cratersLayer, craterDensityOverlay);
         
         // Display the dataset perimeter
         displayDatasetPerimeter(map, perimeterData, perimeterLayer);
@@ -114,8 +145,8 @@ function initDamageMap() {
                 const satelliteLegendItem = window.legendItems['Satellite Imagery'];
                 const zoomLevel = map.getZoom();
                 
-                // If zoom level is below threshold, make legend item appear lighter
-                if (zoomLevel < ZOOM_THRESHOLD) {
+                // If zoom level is below threshold and there is no overview imagery, make legend item appear lighter
+                if (zoomLevel < ZOOM_THRESHOLD && !window.satelliteOverviewAvailable) {
                     const textLabel = satelliteLegendItem.querySelector('span');
                     const icon = satelliteLegendItem.querySelector('i');
                     
@@ -311,7 +342,10 @@ function loadBuildingPolygonData(dirPath) {
                 
                 validBuildingData.forEach(data => {
                     if (data.features && Array.isArray(data.features)) {
-                        combinedData.features = combinedData.features.concat(data.features);
+                        // Append in place rather than re-copying the array with concat
+                        for (let i = 0; i < data.features.length; i++) {
+                            combinedData.features.push(data.features[i]);
+                        }
                     }
                 });
                 
@@ -325,6 +359,147 @@ function loadBuildingPolygonData(dirPath) {
     });
 }
 
+/**
+ * Load all building polygons from the consolidated binary bundle
+ * written by python/build_building_bundle.py (one request instead of one per tile)
+ */
+function loadBuildingBundle(url) {
+    return fetch(url)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Network response was not ok');
+            }
+            return response.arrayBuffer();
+        })
+        .then(buffer => {
+            const buildingData = decodeBuildingBundle(buffer);
+            console.log(`Decoded ${buildingData.features.length} building features from bundle`);
+            return buildingData;
+        });
+}
+
+/**
+ * Decode a building bundle into a GeoJSON FeatureCollection
+ * Layout: "BLDB" magic, uint32 header length, JSON header, then little-endian typed arrays
+ */
+function decodeBuildingBundle(buffer) {
+    const textDecoder = new TextDecoder();
+    if (textDecoder.decode(new Uint8Array(buffer, 0, 4)) !== 'BLDB') {
+        throw new Error('Not a building bundle');
+    }
+    const headerLength = new DataView(buffer).getUint32(4, true);
+    const header = JSON.parse(textDecoder.decode(new Uint8Array(buffer, 8, headerLength)));
+    
+    // Typed-array views straight onto the buffer, no copying or parsing
+    const arrayTypes = {
+        int32: Int32Array,
+        uint32: Uint32Array,
+        uint16: Uint16Array,
+        uint8: Uint8Array,
+        float64: Float64Array
+    };
+    const arrays = {};
+    Object.entries(header.arrays).forEach(([name, info]) => {
+        arrays[name] = new arrayTypes[info.dtype](buffer, info.offset, info.length);
+    });
+    
+    const coords = arrays.coords;
+    const ringOffsets = arrays.ring_offsets;
+    const polygonOffsets = arrays.polygon_offsets;
+    const featureOffsets = arrays.feature_offsets;
+    const [originLon, originLat] = header.origin;
+    const scale = header.scale;
+    const ids = arrays.id;
+    const idDictionary = header.id.encoding === 'dictionary' ? header.id.dictionary : null;
+    const attributes = Object.entries(header.dictionaries).map(([name, dictionary]) => [name, dictionary, arrays[name]]);
+    
+    const features = new Array(header.feature_count);
+    for (let f = 0; f < header.feature_count; f++) {
+        const polygons = [];
+        for (let p = featureOffsets[f]; p < featureOffsets[f + 1]; p++) {
+            const rings = [];
+            for (let r = polygonOffsets[p]; r < polygonOffsets[p + 1]; r++) {
+                const ring = new Array(ringOffsets[r + 1] - ringOffsets[r]);
+                for (let v = ringOffsets[r], i = 0; v < ringOffsets[r + 1]; v++, i++) {
+                    ring[i] = [originLon + coords[2 * v] * scale, originLat + coords[2 * v + 1] * scale];
+                }
+                rings.push(ring);
+            }
+            polygons.push(rings);
+        }
+        
+        const properties = {id: idDictionary ? idDictionary[ids[f]] : String(ids[f])};
+        for (const [name, dictionary, codes] of attributes) {
+            const value = dictionary[codes[f]];
+            if (value !== null) properties[name] = value;
+        }
+        
+        features[f] = {
+            type: 'Feature',
+            properties: properties,
+            geometry: polygons.length === 1
+                ? {type: 'Polygon', coordinates: polygons[0]}
+                : {type: 'MultiPolygon', coordinates: polygons}
+        };
+    }
+    
+    return {type: 'FeatureCollection', features: features};
+}
+
+/**
+ * Load precomputed damaged-building heatmap points
+ * written by python/build_heatmap_points.py as packed little-endian Float32 [lat, lon, weight]
+ */
+function loadHeatmapPoints(url) {
+    return fetch(url)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Network response was not ok');
+            }
+            return response.arrayBuffer();
+        })
+        .then(buffer => {
+            const values = new Float32Array(buffer);
+            const points = new Array(values.length / 3);
+            for (let i = 0; i < points.length; i++) {
+                points[i] = [values[3 * i], values[3 * i + 1], values[3 * i + 2]];
+            }
+            console.log(`Loaded ${points.length} precomputed heatmap points`);
+            return points;
+        });
+}
+
+/**
+ * Load the crater density overlay written by python/build_crater_density.py
+ * as an image overlay covering the bounds recorded in its metadata
+ */
+function loadCraterDensityOverlay(url) {
+    return fetch(url)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Network response was not ok');
+            }
+            return response.json();
+        })
+        .then(metadata => {
+            const overlay = metadata.overlay;
+            if (!overlay || !overlay.png) {
+                throw new Error('Crater density metadata has no PNG overlay');
+            }
+            const baseUrl = url.substring(0, url.lastIndexOf('/') + 1);
+            const bounds = overlay.bounds;
+            console.log(`Loaded crater density overlay of ${metadata.craters} craters`);
+            return L.imageOverlay(baseUrl + overlay.png, [
+                [bounds.lat_min, bounds.lon_min],
+                [bounds.lat_max, bounds.lon_max]
+            ], {
+                opacity: 1,
+                interactive: false,
+                pane: 'dataPane'
+            });
+        });
+}
+
 /**
  * Load building damage data from GeoJSON file
  */
@@ -541,11 +716,13 @@ function calculateCentroid(coords) {
 /**
  * Process and display crater data on the map
  */
-function displayCraterData(map, data, layerGroup) {
+function displayCraterData(map, data, layerGroup, densityOverlay) {
     // Clear any existing data
     layerGroup.clearLayers();
     
     let craterCount = 0;
+    // Circle markers, kept here so they can be swapped for the density overlay when zoomed out
+    const markers = [];
     const FIXED_RADIUS = 5; // Fixed radius to use when zoomed out
     const ZOOM_THRESHOLD = 16; // Match the main map's threshold
     const CRATER_COLOR = '#ffbd00'; // Crater color
@@ -557,6 +734,21 @@ function displayCraterData(map, data, layerGroup) {
     
     // Function to update crater sizes based on zoom level
     function updateCraterSizes(zoomLevel) {
+        // With a density overlay, zoomed-out views show one image instead of every marker
+        if (densityOverlay) {
+            const showOverlay = zoomLevel < ZOOM_THRESHOLD;
+            if (showOverlay && !layerGroup.hasLayer(densityOverlay)) {
+                markers.forEach(marker => layerGroup.removeLayer(marker));
+                layerGroup.addLayer(densityOverlay);
+            } else if (!showOverlay && layerGroup.hasLayer(densityOverlay)) {
+                layerGroup.removeLayer(densityOverlay);
+                markers.forEach(marker => layerGroup.addLayer(marker));
+            }
+            if (showOverlay) {
+                return;
+            }
+        }
+        
         layerGroup.eachLayer(function(layer) {
             if (layer.craterRadius) {
                 if (zoomLevel >= ZOOM_THRESHOLD) {
@@ -632,11 +824,13 @@ function displayCraterData(map, data, layerGroup) {
                             <h3>Crater</h3>
                             <p><strong>Location:</strong> ${lat.toFixed(5)}, ${lng.toFixed(5)}</p>
                             <p><strong>Radius:</strong> ${crater.radius.toFixed(2)} m</p>
+                            ${crater.count > 1 ? `<p><strong>Detections:</strong> ${crater.count}</p>` : ''}
                             <p><strong>Tile:</strong> Row ${tileData.row}, Col ${tileData.col}</p>
                         </div>
                     `);
                     
                     layerGroup.addLayer(marker);
+                    markers.push(marker);
                     craterCount++;
                 }
             });
@@ -801,8 +995,8 @@ function addInteractiveLegend(map, layers, buildingsLayer, heatmapLayer, satelli
                         // Show satellite layer
                         map.addLayer(satelliteLayer);
                         
-                        // Check if we're zoomed in enough for tiles to be visible
-                        if (currentZoom >= zoomThreshold) {
+                        // Check if we're zoomed in enough for tiles, or overview imagery covers this zoom
+                        if (currentZoom >= zoomThreshold || window.satelliteOverviewAvailable) {
                             // Restore normal appearance
                             circleIcon.style.opacity = '1';
                             textLabel.style.color = '#333'; // Normal text color when active
@@ -906,137 +1100,144 @@ function initSatelliteImagery(map, tileBoundsData, satelliteLayer, zoomThreshold
     console.log(`Satellite layer is on map: ${map.hasLayer(satelliteLayer)}`);
     console.log(`Number of tile bounds loaded: ${tileBoundsData.length}`);
     
+    // Overview pyramid index (images/overview/index.json), used below the zoom threshold
+    let overviewIndex = null;
+    // Which imagery is on the layer: 'full' or 'overview_<level>'
+    let currentMode = null;
+    
+    // Pick the coarsest overview level that is still sharp at this zoom
+    function overviewLevelForZoom(zoom) {
+        const levels = overviewIndex.levels;
+        const sharp = levels.filter(level => level.max_zoom >= zoom);
+        return sharp.length > 0 ? sharp[sharp.length - 1] : levels[levels.length - 1];
+    }
+    
+    // Add one image overlay once the image is known to exist
+    function addImageOverlay(tileId, imageUrl, imageBounds, mode) {
+        try {
+            const testImg = new Image();
+            testImg.onload = function() {
+                // Skip if the zoom changed to other imagery while loading
+                if (mode !== currentMode || loadedTiles.has(tileId)) {
+                    return;
+                }
+                
+                // Create image overlay in the satellite pane
+                const imageOverlay = L.imageOverlay(imageUrl, imageBounds, {
+                    opacity: 1.0,
+                    interactive: false,
+                    pane: 'satellitePane',
+                    className: 'satellite-tile',
+                });
+                
+                // Add to layer and tracking set
+                satelliteLayer.addLayer(imageOverlay);
+                loadedTiles.add(tileId);
+            };
+            testImg.onerror = function() {
+                console.error(`❌ Cannot load image for tile ${tileId}`);
+            };
+            testImg.src = imageUrl;
+        } catch (error) {
+            console.error(`Error adding tile ${tileId}:`, error);
+        }
+    }
+    
     // Function to update visible satellite tiles based on current view
     function updateVisibleTiles() {
         const currentZoom = map.getZoom();
+        const showOverview = currentZoom < zoomThreshold && overviewIndex !== null;
         
-        // Only process if the layer is on the map and zoom level is sufficient
-        if (!map.hasLayer(satelliteLayer) || currentZoom < zoomThreshold) {
+        // Only process if the layer is on the map and there is imagery for this zoom
+        if (!map.hasLayer(satelliteLayer) || (currentZoom < zoomThreshold && !showOverview)) {
             // Clear all tiles if zoom is below threshold or layer is hidden
             satelliteLayer.clearLayers();
             loadedTiles.clear();
+            currentMode = null;
             console.log(`Not showing satellite - Layer visible: ${map.hasLayer(satelliteLayer)}, Current zoom: ${currentZoom}, Threshold: ${zoomThreshold}`);
             return;
         }
         
+        // Candidate images for this zoom: full-resolution crops or one overview level
+        let mode;
+        let candidates;
+        if (showOverview) {
+            const level = overviewLevelForZoom(currentZoom);
+            mode = `overview_${level.level}`;
+            candidates = level.tiles.map(tile => ({
+                id: `L${level.level}_${tile.x}_${tile.y}`,
+                url: `images/overview/${tile.file}`,
+                lat_min: tile.bounds[0],
+                lon_min: tile.bounds[1],
+                lat_max: tile.bounds[2],
+                lon_max: tile.bounds[3]
+            }));
+        } else {
+            mode = 'full';
+            candidates = tileBoundsData.map(tile => ({
+                id: `${tile.row}_${tile.col}`,
+                url: `images/tiles/cropped_row_${tile.row}_col_${tile.col}.webp`,
+                lat_min: tile.lat_min,
+                lon_min: tile.lon_min,
+                lat_max: tile.lat_max,
+                lon_max: tile.lon_max
+            }));
+        }
+        
+        // Switching between crops and overview levels replaces all images
+        if (mode !== currentMode) {
+            satelliteLayer.clearLayers();
+            loadedTiles.clear();
+            currentMode = mode;
+            console.log(`Satellite imagery mode: ${mode}`);
+        }
+        
         // Get current map bounds
         const bounds = map.getBounds();
-        console.log("Current map bounds:", bounds.toBBoxString());
         
-        // Find tiles that have any corner within the current view
-        const visibleTiles = tileBoundsData.filter(tile => {
-            // Create LatLng objects for all four corners of the tile
-            const corners = [
-                L.latLng(tile.lat_min, tile.lon_min), // Southwest
-                L.latLng(tile.lat_min, tile.lon_max), // Southeast
-                L.latLng(tile.lat_max, tile.lon_max), // Northeast
-                L.latLng(tile.lat_max, tile.lon_min)  // Northwest
-            ];
-            
-            // Check if any corner is within the current view
-            const isVisible = corners.some(corner => bounds.contains(corner)) || 
-                              // Also check if the tile completely contains the current view
-                              (tile.lat_min <= bounds.getSouth() && 
-                               tile.lat_max >= bounds.getNorth() && 
-                               tile.lon_min <= bounds.getWest() && 
-                               tile.lon_max >= bounds.getEast());
-            
-            if (isVisible) {
-                console.log(`Tile ${tile.row}_${tile.col} has at least one corner within view`);
-            }
-            
-            return isVisible;
-        });
+        // Find images that overlap the current view
+        const visibleTiles = candidates.filter(tile => bounds.intersects(L.latLngBounds(
+            [tile.lat_min, tile.lon_min],
+            [tile.lat_max, tile.lon_max]
+        )));
         
-        console.log(`Found ${visibleTiles.length} satellite tiles in current view`);
+        console.log(`Found ${visibleTiles.length} satellite images in current view (${mode})`);
         
-        // Add new visible tiles
+        // Add new visible tiles, using the bounds from the CSV or the overview index
         visibleTiles.forEach(tile => {
-            const tileId = `${tile.row}_${tile.col}`;
-            
-            // Only add if not already loaded
-            if (!loadedTiles.has(tileId)) {
-                try {
-                    // Create image URL
-                    const imageUrl = `images/tiles/cropped_row_${tile.row}_col_${tile.col}.webp`;
-                    
-                    // Output raw tile bounds data for debugging
-                    console.log(`Raw tile bounds for ${tileId}:`, {
-                        lat_min: tile.lat_min,
-                        lat_max: tile.lat_max,
-                        lon_min: tile.lon_min,
-                        lon_max: tile.lon_max
-                    });
-                    
-                    // Define the image bounds using the correct lat/lon values from CSV
-                    const imageBounds = [
-                        [tile.lat_min, tile.lon_min], // Southwest corner
-                        [tile.lat_max, tile.lon_max]  // Northeast corner
-                    ];
-                    
-                    // Log image information
-                    console.log(`Adding satellite tile ${tileId} at ${imageUrl}`);
-                    console.log(`Bounds formatted for Leaflet: ${JSON.stringify(imageBounds)}`);
-                    
-                    // Test image loading separately from overlay
-                    const testImg = new Image();
-                    testImg.onload = function() { 
-                        console.log(`✅ Image exists for tile ${tileId}`);
-                        
-                        // Create image overlay in the satellite pane with 80% opacity
-                        const imageOverlay = L.imageOverlay(imageUrl, imageBounds, {
-                            opacity: 1.0,  // Set to 80% opacity as requested
-                            interactive: false,
-                            pane: 'satellitePane',
-                            className: 'satellite-tile',
-                        });
-                        
-                        // Add to layer and tracking set
-                        satelliteLayer.addLayer(imageOverlay);
-                        loadedTiles.add(tileId);
-                        
-                        console.log(`Added satellite tile overlay for: row ${tile.row}, col ${tile.col}`);
-                    };
-                    testImg.onerror = function() { 
-                        console.error(`❌ Cannot load image for tile ${tileId}`); 
-                    };
-                    testImg.src = imageUrl;
-                } catch (error) {
-                    console.error(`Error adding tile ${tileId}:`, error);
-                }
+            if (!loadedTiles.has(tile.id)) {
+                addImageOverlay(tile.id, tile.url, [
+                    [tile.lat_min, tile.lon_min], // Southwest corner
+                    [tile.lat_max, tile.lon_max]  // Northeast corner
+                ], mode);
             }
         });
     }
     
     // Add event listeners to update visible tiles on map move or zoom
     map.on('moveend', updateVisibleTiles);
+    map.on('zoomend', updateVisibleTiles);
     
-    // Handle zoom changes
-    map.on('zoomend', function() {
-        const currentZoom = map.getZoom();
-        console.log(`Zoom changed to ${currentZoom}, threshold is ${zoomThreshold}`);
-        
-        // When crossing the threshold, clear all tiles or load new ones as appropriate
-        if (currentZoom < zoomThreshold) {
-            // Clear all tiles when zoomed out
-            satelliteLayer.clearLayers();
-            loadedTiles.clear();
-            console.log('Cleared all satellite tiles - zoom below threshold');
-        } else if (map.hasLayer(satelliteLayer)) {
-            // Reload visible tiles when zoomed in
-            console.log('Updating satellite tiles after zoom change');
+    // Load the overview pyramid; without it imagery is only shown above the threshold
+    fetch('images/overview/index.json')
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP error ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(index => {
+            overviewIndex = index;
+            window.satelliteOverviewAvailable = true;
+            console.log(`Loaded satellite overview pyramid with ${index.levels.length} levels`);
             updateVisibleTiles();
-        }
-    });
+        })
+        .catch(error => {
+            console.warn('Satellite overview pyramid unavailable, imagery only shown when zoomed in:', error);
+        });
     
     // Initial update to load any tiles that should be visible
-    const currentZoom = map.getZoom();
-    if (currentZoom >= zoomThreshold && map.hasLayer(satelliteLayer)) {
-        console.log('Initial update of satellite tiles');
-        updateVisibleTiles();
-    } else {
-        console.log(`Not loading satellite tiles initially - zoom level ${currentZoom} is below threshold ${zoomThreshold}`);
-    }
+    updateVisibleTiles();
     
     // Verify that satelliteLayer is properly added to the map
     console.log('Satellite layer added to map:', map.hasLayer(satelliteLayer));
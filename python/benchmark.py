@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+benchmark.py
+
+Benchmark suite for the perimeter and geometry-stripping scripts on synthetic
+data, with a comparison mode that gates on regressions.
+
+Synthetic inputs:
+    tile grids      rect, staggered (odd rows shifted half a tile, like the
+                    real grid), row_offset (every row shifted by its own
+                    fraction of a tile), concave (a notch cut into one
+                    side), holed (a hole in the middle), and saddle and
+                    saddle_staggered (holes of two cells touching only at
+                    a corner), written as tile bounds CSVs
+    buildings       FeatureCollections of small rectangular footprints with
+                    the properties of the labeled building tiles
+
+Stages:
+    extract_perimeter         occupancy-grid tracer of extract_perimeter.py
+    extract_perimeter_2_fast  lattice-snapped parallel union (--fast)
+    extract_perimeter_2       buffered union, up to MAX_BUFFERED_TILES tiles
+    strip_geojson             in-memory strip_geometry, up to MAX_IN_MEMORY_BUILDINGS
+    strip_geojson_streaming   strip_geometry_streaming
+
+Every stage runs in a fresh spawned process, so the reported peak RSS is that
+of the stage alone (including any pool workers it starts). Wall time covers
+the stage call only, not interpreter start-up. After each grid, every perimeter
+output must be valid and agree within FAST_MODE_TOLERANCE, and both strip modes
+must write identical files. The REGRESSION_GRIDS cases (corner-touching tiles
+and holes) are traced first and must give valid perimeters equal to the union
+of their tiles.
+
+Usage:
+    python benchmark.py run [--profile quick|full] [--output FILE] [--compare BASELINE] [--threshold 0.25]
+    python benchmark.py compare BASELINE CURRENT [--threshold 0.25]
+
+Both commands exit with status 1 when a check fails or a stage regresses.
+"""
+
+import argparse
+import contextlib
+import filecmp
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Tuple, Any
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+from extract_perimeter import create_geojson, extract_perimeter_rings, perimeter_geometry
+from extract_perimeter_2 import (FAST_MODE_TOLERANCE, create_geojson_from_csv_overall_perimeter,
+                                 create_geojson_from_csv_overall_perimeter_fast)
+from strip_geojson import strip_geometry, strip_geometry_streaming
+from tile_index import compile_tile_index, load_tile_index
+
+RESULTS_VERSION = 1
+PROFILES = {
+    'quick': {'tiles': [10 ** 2, 10 ** 3, 10 ** 4], 'buildings': [10 ** 3, 10 ** 4, 10 ** 5]},
+    'full': {'tiles': [10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6],
+             'buildings': [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]},
+}
+GRID_SHAPES = ('rect', 'staggered', 'row_offset', 'concave', 'holed', 'saddle', 'saddle_staggered')
+# The buffered union and the in-memory stripper are skipped above these sizes
+MAX_BUFFERED_TILES = 10 ** 4
+MAX_IN_MEMORY_BUILDINGS = 10 ** 6
+# Synthetic tile size in degrees, close to the real crops
+TILE_WIDTH = 0.0063
+TILE_HEIGHT = 0.00273
+# Lon offset of each row of the row_offset grid, in tiles (mod 1)
+ROW_OFFSET_STEP = (np.sqrt(5) - 1) / 2
+ORIGIN_LON, ORIGIN_LAT = 34.4, 31.6
+BUILDINGS_PER_CHUNK = 100000
+DEFAULT_THRESHOLD = 0.25
+# Differences below these are treated as noise in compare mode
+MIN_SECONDS_DELTA = 0.05
+MIN_RSS_DELTA_MB = 16.0
+# Small occupancy grids (rows top to bottom) that once traced to invalid rings
+REGRESSION_GRIDS = {
+    # Hole touching the outer ring at a corner (a saddle on one ring)
+    'saddle_hole': [[0, 1, 1], [1, 0, 1], [1, 1, 1]],
+    # Two tiles touching only at a corner
+    'saddle_pair': [[1, 0], [0, 1]],
+    # Diagonal on the lattice, but sharing part of an edge once rows are staggered
+    'diagonal_pair': [[0, 1], [1, 0]],
+}
+
+def grid_arrays(count: int, grid_shape: str) -> Dict[str, np.ndarray]:
+    """
+    Tile columns of a synthetic grid of about count tiles.
+
+    Neighbouring tiles share exact edge coordinates, like a grid cut from one
+    image, so both perimeter implementations should trace the same outline.
+    The saddle shapes remove the diagonal of every 2x2 block at rows and cols
+    1-2 mod 4, so the remaining diagonal cells meet only at a corner. The
+    row_offset shape gives every row a distinct lon offset, so the grid has
+    about as many distinct lon edges as tiles.
+    """
+    side = max(3, int(round(np.sqrt(count))))
+    rows, cols = np.divmod(np.arange(side * side, dtype=np.int64), side)
+    keep = np.ones(rows.size, dtype=bool)
+    third = side // 3
+    if grid_shape == 'concave':
+        keep &= ~((rows < side // 2) & (cols >= third) & (cols < side - third))
+    elif grid_shape == 'holed':
+        keep &= ~((rows >= third) & (rows < side - third) & (cols >= third) & (cols < side - third))
+    elif grid_shape.startswith('saddle'):
+        in_block = (rows % 4 >= 1) & (rows % 4 <= 2) & (cols % 4 >= 1) & (cols % 4 <= 2)
+        keep &= ~(in_block & ((rows % 4 == 1) == (cols % 4 == 1)))
+    rows, cols = rows[keep], cols[keep]
+
+    if grid_shape.endswith('staggered'):
+        shift = (rows % 2) * 0.5
+    elif grid_shape == 'row_offset':
+        shift = (rows * ROW_OFFSET_STEP) % 1.0
+    else:
+        shift = np.zeros(rows.size)
+    arrays = {
+        'row': rows,
+        'col': cols,
+        'lat_min': ORIGIN_LAT - (rows + 1) * TILE_HEIGHT,
+        'lat_max': ORIGIN_LAT - rows * TILE_HEIGHT,
+        'lon_min': ORIGIN_LON + (cols + shift) * TILE_WIDTH,
+        'lon_max': ORIGIN_LON + (cols + shift + 1) * TILE_WIDTH,
+    }
+    arrays['lat_center'] = (arrays['lat_min'] + arrays['lat_max']) / 2
+    arrays['lon_center'] = (arrays['lon_min'] + arrays['lon_max']) / 2
+    return arrays
+
+def occupancy_arrays(occupied: List[List[int]], staggered: bool = False) -> Dict[str, np.ndarray]:
+    """Tile columns of the occupied cells of a small grid, optionally staggered."""
+    rows, cols = np.nonzero(np.asarray(occupied, dtype=bool))
+    shift = (rows % 2) * 0.5 if staggered else np.zeros(rows.size)
+    return {
+        'row': rows,
+        'col': cols,
+        'lat_min': ORIGIN_LAT - (rows + 1) * TILE_HEIGHT,
+        'lat_max': ORIGIN_LAT - rows * TILE_HEIGHT,
+        'lon_min': ORIGIN_LON + (cols + shift) * TILE_WIDTH,
+        'lon_max': ORIGIN_LON + (cols + shift + 1) * TILE_WIDTH,
+    }
+
+def check_regression_grids() -> List[Dict[str, Any]]:
+    """
+    Trace every REGRESSION_GRIDS case, plain and staggered, and check that the
+    perimeter is valid and covers exactly the union of the tiles.
+    """
+    checks = []
+    for name, occupied in REGRESSION_GRIDS.items():
+        for staggered in (False, True):
+            arrays = occupancy_arrays(occupied, staggered)
+            geometry = shape(perimeter_geometry(extract_perimeter_rings(arrays)))
+            union = shapely.union_all(shapely.box(arrays['lon_min'], arrays['lat_min'],
+                                                  arrays['lon_max'], arrays['lat_max']))
+            valid = bool(geometry.is_valid)
+            # Overlay operations raise on invalid input, which fails the check anyway
+            difference = float(geometry.symmetric_difference(union).area / union.area) if valid else 1.0
+            checks.append({
+                'dataset': f"regression_{name}{'_staggered' if staggered else ''}",
+                'stages': ['extract_perimeter'], 'valid': valid, 'area_difference': difference,
+                'agree': valid and difference < 1e-9,
+            })
+    return checks
+
+def write_tile_csv(arrays: Dict[str, np.ndarray], path: str) -> None:
+    """Write grid columns as a tile bounds CSV with the real file's headers."""
+    names = ('row', 'col', 'lat_center', 'lon_center', 'lat_min', 'lat_max', 'lon_min', 'lon_max')
+    table = np.column_stack([arrays[name] for name in names])
+    np.savetxt(path, table, fmt=['%d', '%d'] + ['%.15f'] * 6, delimiter=',', header=','.join(names), comments='')
+
+def write_buildings(path: str, count: int, seed: int = 0) -> None:
+    """
+    Write a FeatureCollection of count rectangular footprints, one feature per
+    line, in chunks so memory stays flat for any count.
+    """
+    rng = np.random.default_rng(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"type":"FeatureCollection","features":[\n')
+        for start in range(0, count, BUILDINGS_PER_CHUNK):
+            n = min(BUILDINGS_PER_CHUNK, count - start)
+            lon = rng.uniform(ORIGIN_LON, ORIGIN_LON + 0.1, n).round(7)
+            lat = rng.uniform(ORIGIN_LAT - 0.1, ORIGIN_LAT, n).round(7)
+            dlon = rng.uniform(0.0001, 0.0003, n).round(7)
+            dlat = rng.uniform(0.0001, 0.0003, n).round(7)
+            damaged = rng.random(n) < 0.2
+            lines = []
+            for i, (x, y, w, h, d) in enumerate(zip(lon.tolist(), lat.tolist(), dlon.tolist(), dlat.tolist(),
+                                                   damaged.tolist()), start=start):
+                x2, y2 = round(x + w, 7), round(y + h, 7)
+                lines.append(
+                    f'{{"type":"Feature","id":"way/{i}","properties":{{"@id":"way/{i}","building":"yes",'
+                    f'"is_damaged":"{d}"}},"geometry":{{"type":"Polygon","coordinates":'
+                    f'[[[{x},{y}],[{x2},{y}],[{x2},{y2}],[{x},{y2}],[{x},{y}]]]}}}}'
+                )
+            if start:
+                f.write(',\n')
+            f.write(',\n'.join(lines))
+        f.write('\n]}\n')
+
+def _occupancy_perimeter(csv_file: str, output_file: str) -> None:
+    polygons = extract_perimeter_rings(load_tile_index(csv_file).arrays())
+    create_geojson(perimeter_geometry(polygons), output_file)
+
+# name -> (function(input, output), kind of input, largest input size or None)
+STAGES: Dict[str, Tuple[Callable[[str, str], None], str, int]] = {
+    'extract_perimeter': (_occupancy_perimeter, 'tiles', None),
+    'extract_perimeter_2_fast': (create_geojson_from_csv_overall_perimeter_fast, 'tiles', None),
+    'extract_perimeter_2': (create_geojson_from_csv_overall_perimeter, 'tiles', MAX_BUFFERED_TILES),
+    'strip_geojson': (strip_geometry, 'buildings', MAX_IN_MEMORY_BUILDINGS),
+    'strip_geojson_streaming': (strip_geometry_streaming, 'buildings', None),
+}
+
+def _peak_rss_mb() -> float:
+    """
+    Peak RSS of this process and its finished children in MB.
+
+    On Linux ru_maxrss survives exec, so a spawned process would report its
+    parent's peak; VmHWM in /proc is reset by exec and is used instead.
+    """
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    try:
+        with open('/proc/self/status', 'r') as f:
+            own = next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+    except (OSError, StopIteration):
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    peak = max(own, children)
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def _run_stage(name: str, input_path: str, output_path: str) -> Tuple[float, float]:
+    """Run one stage quietly in a fresh process; returns (seconds, peak RSS in MB)."""
+    logging.disable(logging.CRITICAL)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        STAGES[name][0](input_path, output_path)
+        seconds = time.perf_counter() - start
+    return seconds, _peak_rss_mb()
+
+def measure_stage(name: str, input_path: str, output_path: str) -> Tuple[float, float]:
+    """Run a stage in its own spawned process so its peak RSS is its own."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(_run_stage, name, input_path, output_path).result()
+
+def compare_perimeters(paths: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Check that every perimeter output is a valid geometry and lies within
+    FAST_MODE_TOLERANCE of the fast one.
+    """
+    geometries = {}
+    for name, path in paths.items():
+        with open(path, 'r', encoding='utf-8') as f:
+            geometries[name] = shape(json.load(f)['features'][0]['geometry'])
+    invalid = sorted(name for name, geometry in geometries.items() if not geometry.is_valid)
+    reference = geometries.pop('extract_perimeter_2_fast')
+    check = {'stages': sorted(paths), 'agree': True, 'valid': not invalid, 'invalid_stages': invalid,
+             'hausdorff': 0.0, 'area_difference': 0.0}
+    for name, geometry in geometries.items():
+        # Overlay operations raise on invalid input; those are already failed
+        if name in invalid or not reference.is_valid:
+            continue
+        check['hausdorff'] = max(check['hausdorff'], float(shapely.hausdorff_distance(geometry, reference)))
+        check['area_difference'] = max(check['area_difference'],
+                                       float(geometry.symmetric_difference(reference).area / reference.area))
+    check['agree'] = check['valid'] and check['hausdorff'] <= FAST_MODE_TOLERANCE
+    return check
+
+def run_benchmarks(profile: str, work_dir: str) -> Dict[str, Any]:
+    """Run every stage on every synthetic input of a profile and return the results."""
+    sizes = PROFILES[profile]
+    report = {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'profile': profile,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': [],
+        'checks': [],
+    }
+
+    def run(stage: str, dataset: str, items: int, input_path: str) -> str:
+        output_path = os.path.join(work_dir, f"{dataset}.{stage}.out")
+        seconds, peak_rss = measure_stage(stage, input_path, output_path)
+        report['results'].append({
+            'stage': stage, 'dataset': dataset, 'items': items, 'seconds': round(seconds, 6),
+            'throughput': round(items / seconds, 1) if seconds else None, 'peak_rss_mb': round(peak_rss, 1),
+        })
+        print(f"  {stage:<25} {dataset:<28} {seconds:9.3f}s {items / max(seconds, 1e-9):13.0f}/s {peak_rss:8.1f} MB")
+        return output_path
+
+    for check in check_regression_grids():
+        report['checks'].append(check)
+        if not check['agree']:
+            print(f"  MISMATCH {check['dataset']}: valid {check['valid']}, area difference {check['area_difference']:.3g}")
+
+    print(f"{'stage':<27} {'dataset':<28} {'time':>10} {'throughput':>15} {'peak RSS':>11}")
+    for count in sizes['tiles']:
+        for grid_shape in GRID_SHAPES:
+            dataset = f"tiles_{grid_shape}_{count}"
+            arrays = grid_arrays(count, grid_shape)
+            csv_file = os.path.join(work_dir, f"{dataset}.csv")
+            write_tile_csv(arrays, csv_file)
+            # Compile the index up front so every stage measures a mapped load
+            compile_tile_index(csv_file)
+            items = len(arrays['row'])
+
+            outputs = {}
+            for stage, (_, kind, limit) in STAGES.items():
+                if kind == 'tiles' and (limit is None or items <= limit):
+                    outputs[stage] = run(stage, dataset, items, csv_file)
+            check = compare_perimeters(outputs)
+            check['dataset'] = dataset
+            report['checks'].append(check)
+            if not check['agree']:
+                print(f"  MISMATCH {dataset}: invalid {check['invalid_stages']}, "
+                      f"Hausdorff distance {check['hausdorff']:.3g}")
+            for path in list(outputs.values()) + [csv_file]:
+                os.remove(path)
+
+    for count in sizes['buildings']:
+        dataset = f"buildings_{count}"
+        input_path = os.path.join(work_dir, f"{dataset}.geojson")
+        write_buildings(input_path, count)
+        outputs = {}
+        for stage, (_, kind, limit) in STAGES.items():
+            if kind == 'buildings' and (limit is None or count <= limit):
+                outputs[stage] = run(stage, dataset, count, input_path)
+        if len(outputs) > 1:
+            first, *rest = outputs.values()
+            agree = all(filecmp.cmp(first, path, shallow=False) for path in rest)
+            report['checks'].append({'dataset': dataset, 'stages': sorted(outputs), 'agree': agree})
+            if not agree:
+                print(f"  MISMATCH {dataset}: strip outputs differ")
+        for path in list(outputs.values()) + [input_path]:
+            os.remove(path)
+    return report
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any],
+                    threshold: float = DEFAULT_THRESHOLD) -> List[str]:
+    """
+    Print a comparison of two result files and return the regressed stages.
+
+    A stage regresses when its time or peak RSS grew by more than threshold
+    (a fraction) and by more than the noise floor.
+    """
+    base = {(r['stage'], r['dataset']): r for r in baseline['results']}
+    regressions = []
+    print(f"{'stage':<25} {'dataset':<28} {'base s':>9} {'new s':>9} {'ratio':>6} {'base MB':>8} {'new MB':>8}")
+    for result in current['results']:
+        key = (result['stage'], result['dataset'])
+        old = base.get(key)
+        if old is None:
+            continue
+        time_ratio = result['seconds'] / old['seconds'] if old['seconds'] else 1.0
+        slower = time_ratio > 1 + threshold and result['seconds'] - old['seconds'] > MIN_SECONDS_DELTA
+        larger = (result['peak_rss_mb'] > old['peak_rss_mb'] * (1 + threshold)
+                  and result['peak_rss_mb'] - old['peak_rss_mb'] > MIN_RSS_DELTA_MB)
+        status = ' '.join(flag for flag, hit in (('SLOWER', slower), ('LARGER', larger)) if hit)
+        print(f"{key[0]:<25} {key[1]:<28} {old['seconds']:9.3f} {result['seconds']:9.3f} {time_ratio:6.2f} "
+              f"{old['peak_rss_mb']:8.1f} {result['peak_rss_mb']:8.1f} {status}")
+        if status:
+            regressions.append(f"{key[0]}/{key[1]}: {status.lower()}")
+    return regressions
+
+def _load_results(path: str) -> Dict[str, Any]:
+    with open(path, 'r', encoding='utf-8') as f:
+        results = json.load(f)
+    if results.get('version') != RESULTS_VERSION:
+        raise ValueError(f"{path} is not a version {RESULTS_VERSION} benchmark result file")
+    return results
+
+def main() -> None:
+    """Main function to run or compare benchmarks."""
+    parser = argparse.ArgumentParser(description='Benchmark the perimeter and stripping scripts.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='run the benchmarks and write a result file')
+    run_parser.add_argument('--profile', choices=sorted(PROFILES), default='quick')
+    run_parser.add_argument('--output', default='benchmark_results.json')
+    run_parser.add_argument('--work-dir', help='directory for synthetic inputs (default: a temporary one)')
+    run_parser.add_argument('--compare', metavar='BASELINE', help='compare against a baseline result file')
+    run_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='allowed fractional growth of time and peak RSS')
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                                help='allowed fractional growth of time and peak RSS')
+    args = parser.parse_args()
+
+    failures = []
+    if args.command == 'run':
+        work_dir = args.work_dir or tempfile.mkdtemp(prefix='benchmark-')
+        os.makedirs(work_dir, exist_ok=True)
+        try:
+            current = run_benchmarks(args.profile, work_dir)
+        finally:
+            if not args.work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+        print(f"Wrote {len(current['results'])} results to {args.output}")
+        failures += [f"{check['dataset']}: outputs disagree" for check in current['checks'] if not check['agree']]
+        baseline_file = args.compare
+    else:
+        current = _load_results(args.current)
+        baseline_file = args.baseline
+
+    if baseline_file:
+        print(f"\nComparing against {baseline_file} (threshold {args.threshold:.0%})")
+        failures += compare_results(_load_results(baseline_file), current, args.threshold)
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+build_building_bundle.py
+
+This script merges all per-tile labeled building files into a single compact,
+columnar binary bundle that the damage map can load with one request.
+
+The input directory holds files named buildings_row_{r}_col_{c}.geojson.
+
+The output bundle is laid out as:
+    bytes 0-3   magic b"BLDB"
+    bytes 4-7   uint32 length of the JSON header
+    header      UTF-8 JSON describing the arrays below
+    arrays      little-endian typed arrays, each aligned to 8 bytes
+
+Coordinates are quantized to int32 offsets from an origin at COORD_SCALE degrees
+per unit. Rings are stored flat with offset arrays (feature -> polygon -> ring ->
+vertex), and the 'building' / 'is_damaged' style attributes are dictionary
+encoded. Precompressed .gz (and .br, when the brotli package is installed)
+sidecars are written next to the bundle for static servers that support them.
+"""
+
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+from typing import Dict, List, Tuple, Any
+
+import numpy as np
+
+try:
+    import brotli
+except ImportError:  # Optional, only needed for the .br sidecar
+    brotli = None
+
+BUNDLE_MAGIC = b"BLDB"
+BUNDLE_VERSION = 1
+# Degrees per quantization unit; OSM footprints carry 7 decimals so this is lossless
+COORD_SCALE = 1e-7
+# Properties stored as dictionary-encoded columns when present
+DICTIONARY_PROPERTIES = ("building", "is_damaged", "is_damaged_labeled")
+ARRAY_ALIGNMENT = 8
+
+TILE_FILE_PATTERN = re.compile(r"buildings_row_(\d+)_col_(\d+)\.geojson$")
+HASH_CHUNK_SIZE = 1 << 20
+
+def find_tile_files(input_dir: str) -> List[Tuple[int, int, str]]:
+    """
+    Find all labeled building tile files, sorted by (row, col).
+    """
+    tile_files = []
+    for path in glob.glob(os.path.join(input_dir, 'buildings_row_*_col_*.geojson')):
+        match = TILE_FILE_PATTERN.search(os.path.basename(path))
+        if match:
+            tile_files.append((int(match.group(1)), int(match.group(2)), path))
+    tile_files.sort()
+    return tile_files
+
+def file_digest(path: str) -> str:
+    """Return the SHA-256 of a file, or None if it does not exist."""
+    if not os.path.exists(path):
+        return None
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def iter_polygons(geometry: Dict[str, Any]) -> List[List[List[List[float]]]]:
+    """
+    Return the polygons of a Polygon or MultiPolygon geometry (empty otherwise).
+    """
+    if not geometry:
+        return []
+    if geometry.get('type') == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry.get('type') == 'MultiPolygon':
+        return geometry['coordinates']
+    return []
+
+def collect_tile_columns(row: int, col: int, path: str) -> Dict[str, Any]:
+    """
+    Read one tile file and flatten its features into columns. Numeric columns
+    are numpy arrays; ids and properties stay lists.
+    """
+    coords: List[List[float]] = []
+    ring_lengths: List[int] = []
+    polygon_ring_counts: List[int] = []
+    feature_polygon_counts: List[int] = []
+    ids: List[Any] = []
+    properties: Dict[str, List[Any]] = {name: [] for name in DICTIONARY_PROPERTIES}
+
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    for feature in data.get('features', []):
+        feature_properties = feature.get('properties') or {}
+        polygons = iter_polygons(feature.get('geometry'))
+
+        for polygon in polygons:
+            for ring in polygon:
+                coords.extend(ring)
+                ring_lengths.append(len(ring))
+            polygon_ring_counts.append(len(polygon))
+        feature_polygon_counts.append(len(polygons))
+
+        ids.append(feature_properties.get('id', feature.get('id')))
+        for name in DICTIONARY_PROPERTIES:
+            properties[name].append(feature_properties.get(name))
+
+    feature_count = len(feature_polygon_counts)
+    return {
+        'coords': np.asarray(coords, dtype=np.float64).reshape(-1, 2),
+        'ring_lengths': np.asarray(ring_lengths, dtype=np.int64),
+        'polygon_ring_counts': np.asarray(polygon_ring_counts, dtype=np.int64),
+        'feature_polygon_counts': np.asarray(feature_polygon_counts, dtype=np.int64),
+        'tile_row': np.full(feature_count, row, dtype=np.int64),
+        'tile_col': np.full(feature_count, col, dtype=np.int64),
+        'id': ids,
+        'properties': properties,
+    }
+
+def merge_columns(tile_columns: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Concatenate per-tile columns, in order, into one set of columns.
+    """
+    merged: Dict[str, Any] = {'id': [], 'properties': {name: [] for name in DICTIONARY_PROPERTIES}}
+    for name in ('coords', 'ring_lengths', 'polygon_ring_counts', 'feature_polygon_counts', 'tile_row', 'tile_col'):
+        parts = [columns[name] for columns in tile_columns]
+        merged[name] = np.concatenate(parts) if parts else np.zeros((0, 2) if name == 'coords' else 0)
+    for columns in tile_columns:
+        merged['id'].extend(columns['id'])
+        for name in DICTIONARY_PROPERTIES:
+            merged['properties'][name].extend(columns['properties'][name])
+    return merged
+
+def collect_features(tile_files: List[Tuple[int, int, str]]) -> Dict[str, Any]:
+    """
+    Read every tile file and flatten its features into columns.
+    """
+    return merge_columns([collect_tile_columns(row, col, path) for row, col, path in tile_files])
+
+def counts_to_offsets(counts: List[int]) -> np.ndarray:
+    """
+    Turn per-item counts into a uint32 offsets array of length len(counts) + 1.
+    """
+    offsets = np.zeros(len(counts) + 1, dtype=np.uint32)
+    offsets[1:] = np.cumsum(counts, dtype=np.uint64)
+    return offsets
+
+def dictionary_encode(values: List[Any]) -> Tuple[List[Any], np.ndarray]:
+    """
+    Dictionary-encode a column, using the smallest unsigned code width that fits.
+    Missing values are stored as null in the dictionary.
+    """
+    dictionary: Dict[Any, int] = {}
+    codes = [dictionary.setdefault(value, len(dictionary)) for value in values]
+    dtype = np.uint8 if len(dictionary) <= 0xFF else np.uint16 if len(dictionary) <= 0xFFFF else np.uint32
+    return list(dictionary), np.asarray(codes, dtype=dtype)
+
+def encode_ids(ids: List[Any]) -> Tuple[Dict[str, Any], np.ndarray]:
+    """
+    Encode feature ids as float64 when they are all integer strings below 2^53,
+    which covers OSM ids, and fall back to dictionary encoding otherwise.
+    """
+    if ids and all(isinstance(value, str) and value.isdigit() and len(value) < 16 for value in ids):
+        return {'encoding': 'numeric'}, np.asarray([int(value) for value in ids], dtype=np.float64)
+    dictionary, codes = dictionary_encode(ids)
+    return {'encoding': 'dictionary', 'dictionary': dictionary}, codes
+
+def build_bundle(tile_files: List[Tuple[int, int, str]]) -> bytes:
+    """
+    Build the binary bundle for the given tile files.
+    """
+    return bundle_from_columns(collect_features(tile_files))
+
+def bundle_from_columns(columns: Dict[str, Any]) -> bytes:
+    """
+    Build the binary bundle from columns produced by collect_features.
+    """
+    coords = np.asarray(columns['coords'], dtype=np.float64).reshape(-1, 2)
+    origin = coords.min(axis=0) if len(coords) else np.zeros(2)
+    quantized = np.rint((coords - origin) / COORD_SCALE).astype(np.int32)
+
+    arrays: Dict[str, np.ndarray] = {
+        'coords': quantized.ravel(),
+        'ring_offsets': counts_to_offsets(columns['ring_lengths']),
+        'polygon_offsets': counts_to_offsets(columns['polygon_ring_counts']),
+        'feature_offsets': counts_to_offsets(columns['feature_polygon_counts']),
+        'tile_row': np.asarray(columns['tile_row'], dtype=np.uint16),
+        'tile_col': np.asarray(columns['tile_col'], dtype=np.uint16),
+    }
+
+    id_info, arrays['id'] = encode_ids(columns['id'])
+    dictionaries = {}
+    for name, values in columns['properties'].items():
+        if any(value is not None for value in values):
+            dictionaries[name], arrays[name] = dictionary_encode(values)
+
+    # Lay the arrays out after the header, each aligned for its typed-array view
+    header: Dict[str, Any] = {
+        'version': BUNDLE_VERSION,
+        'feature_count': len(columns['feature_polygon_counts']),
+        'vertex_count': int(len(coords)),
+        'origin': [float(origin[0]), float(origin[1])],
+        'scale': COORD_SCALE,
+        'id': id_info,
+        'dictionaries': dictionaries,
+        'arrays': {},
+    }
+
+    def header_bytes() -> bytes:
+        return json.dumps(header, separators=(',', ':')).encode('utf-8')
+
+    # The header size depends on the offsets it records, so iterate until stable
+    data_start = -1
+    while data_start != _align(8 + len(header_bytes())):
+        data_start = _align(8 + len(header_bytes()))
+        offset = data_start
+        for name, array in arrays.items():
+            header['arrays'][name] = {'offset': offset, 'length': int(array.size), 'dtype': array.dtype.name}
+            offset = _align(offset + array.nbytes)
+
+    encoded_header = header_bytes()
+    output = bytearray(offset)
+    output[0:4] = BUNDLE_MAGIC
+    output[4:8] = len(encoded_header).to_bytes(4, 'little')
+    output[8:8 + len(encoded_header)] = encoded_header
+    output[8 + len(encoded_header):data_start] = b' ' * (data_start - 8 - len(encoded_header))
+    for name, array in arrays.items():
+        start = header['arrays'][name]['offset']
+        output[start:start + array.nbytes] = array.astype(array.dtype.newbyteorder('<')).tobytes()
+    return bytes(output)
+
+def _align(offset: int) -> int:
+    """Round offset up to the next multiple of ARRAY_ALIGNMENT."""
+    return (offset + ARRAY_ALIGNMENT - 1) // ARRAY_ALIGNMENT * ARRAY_ALIGNMENT
+
+def write_bundle(bundle: bytes, output_file: str) -> List[str]:
+    """
+    Write the bundle plus its precompressed .gz/.br sidecars.
+    Returns the list of files written.
+    """
+    written = [output_file]
+    with open(output_file, 'wb') as f:
+        f.write(bundle)
+
+    with open(output_file + '.gz', 'wb') as f:
+        f.write(gzip.compress(bundle, compresslevel=9, mtime=0))
+    written.append(output_file + '.gz')
+
+    if brotli is not None:
+        with open(output_file + '.br', 'wb') as f:
+            f.write(brotli.compress(bundle, quality=11))
+        written.append(output_file + '.br')
+    else:
+        print("brotli is not installed, skipping the .br sidecar.")
+    return written
+
+def main() -> None:
+    """Main function to run the script."""
+
+    # Determine file paths
+    if len(sys.argv) > 2:
+        input_dir = sys.argv[1]
+        output_file = sys.argv[2]
+    else:
+        # Default paths
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        data_dir = os.path.join(os.path.dirname(script_dir), 'data')
+        input_dir = os.path.join(data_dir, 'building-polygons-labeled')
+        output_file = os.path.join(data_dir, 'buildings_bundle.bin')
+
+    print(f"Reading building tiles from {input_dir}...")
+    tile_files = find_tile_files(input_dir)
+    print(f"Found {len(tile_files)} tile files.")
+
+    if not tile_files:
+        print("ERROR: No building tile files found!")
+        return
+
+    bundle = build_bundle(tile_files)
+    for path in write_bundle(bundle, output_file):
+        print(f"Wrote {path} ({os.path.getsize(path)} bytes)")
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
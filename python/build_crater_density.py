@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+build_crater_density.py
+
+This script rasterizes the craters in all_craters.json into a crater density
+grid, so damage likelihood at any point is an array lookup and the map can show
+one image instead of a circle marker per crater.
+
+The grid covers the bounds of the tile grid at RESOLUTION metres per cell, in
+an equirectangular projection around the middle latitude; row 0 is the
+northern edge. Every crater adds a stamp with reach DAMAGE_RADIUS_FACTOR x its
+radius:
+    disc        1 inside the reach, so a cell counts the craters whose reach
+                covers it, the rule label_damage applies to footprints
+    gaussian    exp(-d^2 / 2 sigma^2) with sigma = the reach, truncated at
+                GAUSSIAN_SIGMAS sigma
+
+Rows are split into bands that are stamped in parallel in a process pool, each
+worker writing its own rows of the shared memory-mapped output. Within a band
+the cells under every intersecting stamp are enumerated with NumPy and summed
+with one bincount.
+
+Outputs, next to all_craters.json:
+    crater_density.npy              float32 grid, load with np.load(mmap_mode='r')
+    crater_density.json             grid shape, bounds and kernel, plus the overlay's
+    crater_density_overlay.f32      OVERLAY_SCALE x OVERLAY_SCALE block means as
+                                    packed little-endian Float32, north row first
+    crater_density_overlay.png      the overlay as a transparent colour ramp, for
+                                    L.imageOverlay (only when Pillow is installed)
+
+Usage:
+    python build_crater_density.py [all_craters.json tiles.csv output_dir] [disc|gaussian] [resolution]
+"""
+
+import json
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple, Any
+
+import numpy as np
+
+try:
+    from PIL import Image
+except ImportError:  # Optional, only needed for the PNG overlay
+    Image = None
+
+from craters import METRES_PER_DEGREE, load_craters
+from label_damage import DAMAGE_RADIUS_FACTOR
+from tile_index import load_tile_index
+
+DENSITY_VERSION = 1
+# Metres per grid cell
+RESOLUTION = 1.0
+KERNELS = ('disc', 'gaussian')
+GAUSSIAN_SIGMAS = 3.0
+# Grid rows per parallel band
+BAND_ROWS = 256
+# Stamp cells enumerated at once within a band
+MAX_STAMP_CELLS = 1 << 22
+# Grid cells per overlay pixel along each axis
+OVERLAY_SCALE = 8
+# Crater colour of the map, and the overlay's opacity at the highest density
+OVERLAY_COLOR = (0xff, 0xbd, 0x00)
+OVERLAY_MAX_ALPHA = 200
+
+# Worker state, filled in once per process by _init_worker
+_worker: Dict[str, Any] = {}
+
+def grid_geometry(index, resolution: float = RESOLUTION) -> Dict[str, Any]:
+    """
+    Shape and exact bounds of a grid at the given resolution covering every tile.
+    """
+    lat_min, lat_max = float(index.lat_min.min()), float(index.lat_max.max())
+    lon_min, lon_max = float(index.lon_min.min()), float(index.lon_max.max())
+    origin_lat = (lat_min + lat_max) / 2
+    scale_x = METRES_PER_DEGREE * math.cos(math.radians(origin_lat))
+    width = math.ceil((lon_max - lon_min) * scale_x / resolution)
+    height = math.ceil((lat_max - lat_min) * METRES_PER_DEGREE / resolution)
+    return {
+        'shape': [height, width],
+        'resolution': resolution,
+        'origin_lat': origin_lat,
+        'bounds': {
+            'lat_min': lat_max - height * resolution / METRES_PER_DEGREE,
+            'lat_max': lat_max,
+            'lon_min': lon_min,
+            'lon_max': lon_min + width * resolution / scale_x,
+        },
+    }
+
+def to_pixels(lat: np.ndarray, lon: np.ndarray, geometry: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """Fractional (x, y) grid coordinates of points; cell (i, j) spans [j, j+1) x [i, i+1)."""
+    bounds = geometry['bounds']
+    scale_x = METRES_PER_DEGREE * math.cos(math.radians(geometry['origin_lat']))
+    x = (np.asarray(lon, dtype=np.float64) - bounds['lon_min']) * scale_x / geometry['resolution']
+    y = (bounds['lat_max'] - np.asarray(lat, dtype=np.float64)) * METRES_PER_DEGREE / geometry['resolution']
+    return x, y
+
+def _init_worker(path: str, x: np.ndarray, y: np.ndarray, reach: np.ndarray, kernel: str) -> None:
+    """Map the output grid and keep the craters in pixel units, once per worker process."""
+    _worker['grid'] = np.load(path, mmap_mode='r+')
+    _worker['x'], _worker['y'], _worker['reach'], _worker['kernel'] = x, y, reach, kernel
+
+def stamp_band(band: Tuple[int, int]) -> float:
+    """
+    Stamp every crater reaching rows [row_start, row_end) into the grid.
+    Returns the largest value in the band.
+    """
+    row_start, row_end = band
+    grid = _worker['grid']
+    width = grid.shape[1]
+    x, y, reach, kernel = _worker['x'], _worker['y'], _worker['reach'], _worker['kernel']
+    extent = reach * (GAUSSIAN_SIGMAS if kernel == 'gaussian' else 1.0)
+
+    # Cell ranges covered by each stamp, clipped to the band and the grid
+    hit = (y + extent >= row_start) & (y - extent < row_end) & (x + extent >= 0) & (x - extent < width)
+    index = np.flatnonzero(hit)
+    col0 = np.maximum(0, np.floor(x[index] - extent[index])).astype(np.int64)
+    col1 = np.minimum(width, np.floor(x[index] + extent[index]) + 1).astype(np.int64)
+    row0 = np.maximum(row_start, np.floor(y[index] - extent[index])).astype(np.int64)
+    row1 = np.minimum(row_end, np.floor(y[index] + extent[index]) + 1).astype(np.int64)
+    widths = np.maximum(col1 - col0, 0)
+    cells = widths * np.maximum(row1 - row0, 0)
+
+    values = np.zeros((row_end - row_start) * width)
+    start = 0
+    while start < len(index):
+        # Enough stamps to fill about MAX_STAMP_CELLS cells, and at least one
+        stop = start + max(1, int(np.searchsorted(np.cumsum(cells[start:]), MAX_STAMP_CELLS)))
+        counts = cells[start:stop]
+        stamp = np.repeat(np.arange(start, stop), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows = row0[stamp] + local // widths[stamp]
+        cols = col0[stamp] + local % widths[stamp]
+
+        # Distance from each cell center to its crater, in units of the reach
+        crater = index[stamp]
+        distance2 = ((cols + 0.5 - x[crater]) ** 2 + (rows + 0.5 - y[crater]) ** 2) / reach[crater] ** 2
+        if kernel == 'gaussian':
+            weights = np.where(distance2 <= GAUSSIAN_SIGMAS ** 2, np.exp(-0.5 * distance2), 0.0)
+        else:
+            weights = (distance2 <= 1.0).astype(np.float64)
+        values += np.bincount((rows - row_start) * width + cols, weights=weights, minlength=values.size)
+        start = stop
+
+    grid[row_start:row_end] = values.reshape(-1, width)
+    grid.flush()
+    return float(values.max()) if values.size else 0.0
+
+def downsample(grid: np.ndarray, scale: int = OVERLAY_SCALE) -> np.ndarray:
+    """
+    Means of scale x scale blocks, reading the grid a band of blocks at a time.
+    Blocks on the southern and eastern edges are padded with zeros.
+    """
+    height, width = grid.shape
+    out_height, out_width = math.ceil(height / scale), math.ceil(width / scale)
+    overlay = np.zeros((out_height, out_width), dtype=np.float32)
+    band = scale * max(1, BAND_ROWS // scale)
+    for row in range(0, height, band):
+        block = np.zeros((min(band, out_height * scale - row), out_width * scale), dtype=np.float32)
+        rows = grid[row:row + band]
+        block[:rows.shape[0], :width] = rows
+        overlay[row // scale:row // scale + block.shape[0] // scale] = \
+            block.reshape(-1, scale, out_width, scale).mean(axis=(1, 3))
+    return overlay
+
+def write_overlay_png(overlay: np.ndarray, path: str) -> None:
+    """Write the overlay as OVERLAY_COLOR with opacity rising with density."""
+    peak = float(overlay.max())
+    alpha = np.sqrt(overlay / peak) if peak > 0 else np.zeros_like(overlay)
+    rgba = np.zeros(overlay.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = OVERLAY_COLOR
+    rgba[..., 3] = np.rint(alpha * OVERLAY_MAX_ALPHA).astype(np.uint8)
+    temp_path = path + '.tmp'
+    Image.fromarray(rgba, 'RGBA').save(temp_path, 'PNG', optimize=True)
+    os.replace(temp_path, path)
+
+def build_crater_density(craters_file: str, csv_file: str, output_dir: str, kernel: str = 'disc',
+                         resolution: float = RESOLUTION, radius_factor: float = DAMAGE_RADIUS_FACTOR,
+                         max_workers: int = None) -> Dict[str, Any]:
+    """
+    Rasterize the craters and write the grid, the overlay and their metadata.
+    Returns the metadata.
+    """
+    if kernel not in KERNELS:
+        raise ValueError(f"Unknown kernel '{kernel}', expected one of: {', '.join(KERNELS)}")
+    geometry = grid_geometry(load_tile_index(csv_file), resolution)
+    craters = load_craters(craters_file)
+    x, y = to_pixels(craters['lat'], craters['lon'], geometry)
+    # A reach below half a cell would miss every cell center
+    reach = np.maximum(radius_factor * craters['radius'] / resolution, 0.5)
+
+    os.makedirs(output_dir, exist_ok=True)
+    grid_file = os.path.join(output_dir, 'crater_density.npy')
+    temp_file = os.path.join(output_dir, 'crater_density.tmp.npy')
+    height, width = geometry['shape']
+    grid = np.lib.format.open_memmap(temp_file, mode='w+', dtype='<f4', shape=(height, width))
+    del grid  # Workers map it themselves
+
+    bands = [(row, min(row + BAND_ROWS, height)) for row in range(0, height, BAND_ROWS)]
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(temp_file, x, y, reach, kernel)) as pool:
+        peak = max(pool.map(stamp_band, bands), default=0.0)
+    os.replace(temp_file, grid_file)
+
+    overlay = downsample(np.load(grid_file, mmap_mode='r'))
+    overlay_file = os.path.join(output_dir, 'crater_density_overlay.f32')
+    with open(overlay_file, 'wb') as f:
+        f.write(np.ascontiguousarray(overlay, dtype='<f4').tobytes())
+    bounds = geometry['bounds']
+    scale_x = METRES_PER_DEGREE * math.cos(math.radians(geometry['origin_lat']))
+    overlay_info = {
+        'file': os.path.basename(overlay_file),
+        'png': None,
+        'scale': OVERLAY_SCALE,
+        'shape': list(overlay.shape),
+        'max': float(overlay.max()) if overlay.size else 0.0,
+        'bounds': {
+            'lat_min': bounds['lat_max'] - overlay.shape[0] * OVERLAY_SCALE * resolution / METRES_PER_DEGREE,
+            'lat_max': bounds['lat_max'],
+            'lon_min': bounds['lon_min'],
+            'lon_max': bounds['lon_min'] + overlay.shape[1] * OVERLAY_SCALE * resolution / scale_x,
+        },
+    }
+    if Image is not None:
+        png_file = os.path.join(output_dir, 'crater_density_overlay.png')
+        write_overlay_png(overlay, png_file)
+        overlay_info['png'] = os.path.basename(png_file)
+
+    metadata = dict(geometry, version=DENSITY_VERSION, file=os.path.basename(grid_file), kernel=kernel,
+                    radius_factor=radius_factor, craters=int(len(x)), max=peak, overlay=overlay_info)
+    metadata_file = os.path.join(output_dir, 'crater_density.json')
+    with open(metadata_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(metadata_file + '.tmp', metadata_file)
+    return metadata
+
+class CraterDensity:
+    """
+    Point lookups in a crater density grid written by build_crater_density.
+    """
+
+    def __init__(self, metadata_file: str):
+        with open(metadata_file, 'r', encoding='utf-8') as f:
+            self.metadata = json.load(f)
+        self.grid = np.load(os.path.join(os.path.dirname(metadata_file), self.metadata['file']), mmap_mode='r')
+
+    def sample(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        """Density at each point, 0 outside the grid."""
+        x, y = to_pixels(lat, lon, self.metadata)
+        cols, rows = np.floor(x).astype(np.int64), np.floor(y).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.grid.shape[0]) & (cols >= 0) & (cols < self.grid.shape[1])
+        values = np.zeros(rows.shape, dtype=np.float32)
+        values[inside] = self.grid[rows[inside], cols[inside]]
+        return values
+
+def main() -> None:
+    """Main function to run the script."""
+
+    # Determine file paths
+    args = [arg for arg in sys.argv[1:] if arg not in KERNELS]
+    kernel = next((arg for arg in sys.argv[1:] if arg in KERNELS), 'disc')
+    if len(args) > 2:
+        craters_file, csv_file, output_dir = args[:3]
+        resolution = float(args[3]) if len(args) > 3 else RESOLUTION
+    else:
+        # Default paths
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        output_dir = os.path.join(os.path.dirname(script_dir), 'data')
+        craters_file = os.path.join(output_dir, 'all_craters.json')
+        csv_file = os.path.join(output_dir, 'tile_bounds_coords_adj.csv')
+        resolution = float(args[0]) if args else RESOLUTION
+
+    print(f"Rasterizing craters from {craters_file} ({kernel}, {resolution:g} m cells)...")
+    metadata = build_crater_density(craters_file, csv_file, output_dir, kernel, resolution)
+    height, width = metadata['shape']
+    print(f"Stamped {metadata['craters']} craters on a {width} x {height} grid, peak density {metadata['max']:.2f}.")
+    if metadata['overlay']['png'] is None:
+        print("Pillow is not installed, skipped the PNG overlay.")
+    print(f"Saved crater density to {output_dir}.")
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
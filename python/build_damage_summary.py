@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+build_damage_summary.py
+
+This script precomputes a damage summary cube, so dashboards and zoomed-out
+map views can read damage rates per area without scanning every building.
+
+The cube counts buildings, damaged buildings and craters per cell of several
+grids:
+    tile        the labeled tile grid (x = col, y = row)
+    10 ... 14   Web Mercator XYZ tiles at that zoom, the cells Leaflet uses
+
+Building counts are further split by the 'building' type property. A building
+on a tile seam is filed under every tile it overlaps, so it is counted once per
+'id' property: in its home tile, the one whose center is nearest its centroid
+(as tile_index locates it), or in the first tile holding it when the home tile
+does not. It is damaged when is_damaged or is_damaged_labeled is "True" in any
+copy, and is placed by the centroid of its outer ring (buildings without
+geometry only count towards their tile). Craters come from all_craters.json and
+are not split by type.
+
+Internally a cube is a pair of arrays: keys, int64 rows of (grid, x, y, type),
+and counts, int64 rows of (buildings, damaged, craters). Grid is TILE_GRID or
+a zoom level, and type indexes building_types, or is ALL_TYPES for crater rows.
+A state file next to the build manifest keeps a record of every building copy
+per tile and how each building is currently counted. When tiles change, only
+they are read, only the buildings with a copy in them are recounted from all
+their copies, and the cube is updated by subtracting their old counts and
+adding the new ones, at a cost proportional to the buildings touched. All
+grouping is done with NumPy. A change of the tile CSV rebuilds the state.
+
+The output JSON holds the building types, dataset totals and, per grid, a
+cells list of [x, y, buildings, damaged, craters] and a types list of
+[x, y, type, buildings, damaged].
+"""
+
+import json
+import os
+import pickle
+import sys
+from typing import Callable, Dict, List, Tuple, Any
+
+import numpy as np
+
+from build_building_bundle import collect_tile_columns, counts_to_offsets, file_digest, find_tile_files, merge_columns
+from build_heatmap_points import DAMAGED_VALUE, ring_centroids
+from build_vector_tiles import DETAIL_MIN_ZOOM, MIN_ZOOM, lonlat_to_tile
+from craters import load_craters
+from tile_index import TileIndex, load_tile_index
+
+SUMMARY_VERSION = 1
+STATE_VERSION = 2
+# Zoom levels summarized as XYZ cells; from DETAIL_MIN_ZOOM up the map shows buildings
+SUMMARY_ZOOMS = tuple(range(MIN_ZOOM, DETAIL_MIN_ZOOM + 1))
+TILE_GRID = -1
+ALL_TYPES = -1
+COLUMNS = ('buildings', 'damaged', 'craters')
+
+def empty_cube() -> Dict[str, np.ndarray]:
+    """A cube with no cells."""
+    return {'keys': np.zeros((0, 4), dtype=np.int64), 'counts': np.zeros((0, 3), dtype=np.int64)}
+
+def group_counts(keys: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sum the count rows of equal key rows. Returns the unique keys, sorted
+    lexicographically, and their summed counts.
+    """
+    if len(keys) == 0:
+        return keys.reshape(0, keys.shape[1]), counts.reshape(0, counts.shape[1])
+    unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    summed = np.column_stack([
+        np.bincount(inverse, weights=counts[:, i], minlength=len(unique_keys)) for i in range(counts.shape[1])
+    ])
+    return unique_keys, np.rint(summed).astype(np.int64)
+
+def combine_cubes(add: List[Dict[str, np.ndarray]], subtract: List[Dict[str, np.ndarray]] = ()) -> Dict[str, np.ndarray]:
+    """
+    Sum the cubes in add minus the cubes in subtract, dropping cells that end
+    up with no counts.
+    """
+    cubes = list(add) + list(subtract)
+    if not cubes:
+        return empty_cube()
+    keys = np.concatenate([cube['keys'] for cube in cubes])
+    counts = np.concatenate([cube['counts'] for cube in add] + [-cube['counts'] for cube in subtract])
+    keys, counts = group_counts(keys, counts)
+    nonzero = np.any(counts != 0, axis=1)
+    return {'keys': keys[nonzero], 'counts': counts[nonzero]}
+
+def _type_codes(values: List[Any], building_types: List[Any]) -> np.ndarray:
+    """Codes of values in building_types, appending unseen values to it."""
+    lookup = {value: code for code, value in enumerate(building_types)}
+    codes = np.empty(len(values), dtype=np.int64)
+    for i, value in enumerate(values):
+        if value not in lookup:
+            lookup[value] = len(building_types)
+            building_types.append(value)
+        codes[i] = lookup[value]
+    return codes
+
+def _grid_keys(source: np.ndarray, row: np.ndarray, col: np.ndarray, lon: np.ndarray, lat: np.ndarray,
+               type_code: np.ndarray, located: np.ndarray) -> np.ndarray:
+    """
+    Key rows (source, grid, x, y, type) of items in the tile grid and, for the
+    located ones, in every summary zoom.
+    """
+    parts = [np.column_stack((source, np.full(len(source), TILE_GRID), col, row, type_code))]
+    for zoom in SUMMARY_ZOOMS:
+        x, y = lonlat_to_tile(lon[located], lat[located], zoom)
+        parts.append(np.column_stack((source[located], np.full(len(x), zoom), x, y, type_code[located])))
+    return np.concatenate(parts).astype(np.int64)
+
+def _split_by_source(keys: np.ndarray, counts: np.ndarray, sources: int) -> List[Dict[str, np.ndarray]]:
+    """Split grouped (source, ...) rows into one cube per source."""
+    keys, counts = group_counts(keys, counts)
+    bounds = np.searchsorted(keys[:, 0], np.arange(sources + 1))
+    return [{'keys': keys[start:end, 1:], 'counts': counts[start:end]}
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+def building_records(tile_columns: List[Dict[str, Any]], building_types: List[Any],
+                     index: TileIndex = None) -> List[Dict[Any, Tuple[int, float, float, bool, bool, int, int]]]:
+    """
+    Per tile, a record of every building copy in it, keyed by building id (a
+    building without one gets a key of its own), computed in one pass over all
+    the given tiles: (type, lon, lat, located, damaged, home_row, home_col).
+    Home is the tile whose center is nearest the centroid, or (-1, -1) when it
+    is unknown. New building types are appended to building_types.
+    """
+    if not tile_columns:
+        return []
+    columns = merge_columns(tile_columns)
+    feature_count = len(columns['feature_polygon_counts'])
+
+    damaged = np.zeros(feature_count, dtype=bool)
+    for name in ('is_damaged', 'is_damaged_labeled'):
+        damaged |= np.asarray([value == DAMAGED_VALUE for value in columns['properties'][name]], dtype=bool)
+    type_code = _type_codes(columns['properties']['building'], building_types)
+
+    # Place each building with geometry by the centroid of its outer ring
+    coords = np.asarray(columns['coords'], dtype=np.float64).reshape(-1, 2)
+    ring_offsets = counts_to_offsets(columns['ring_lengths']).astype(np.int64)
+    polygon_offsets = counts_to_offsets(columns['polygon_ring_counts']).astype(np.int64)
+    feature_offsets = counts_to_offsets(columns['feature_polygon_counts']).astype(np.int64)
+    located = np.diff(feature_offsets) > 0
+    lon = np.zeros(feature_count)
+    lat = np.zeros(feature_count)
+    home_row = np.full(feature_count, -1, dtype=np.int64)
+    home_col = np.full(feature_count, -1, dtype=np.int64)
+    if located.any():
+        outer_rings = polygon_offsets[feature_offsets[np.nonzero(located)[0]]]
+        centroids = ring_centroids(coords, ring_offsets[outer_rings], ring_offsets[outer_rings + 1])
+        lon[located], lat[located] = centroids[:, 0], centroids[:, 1]
+        if index is not None:
+            home_row[located], home_col[located] = index.locate_tiles(lat[located], lon[located])
+
+    values = list(zip(type_code.tolist(), lon.tolist(), lat.tolist(), located.tolist(), damaged.tolist(),
+                      home_row.tolist(), home_col.tolist()))
+    records = []
+    start = 0
+    for tile in tile_columns:
+        count = len(tile['feature_polygon_counts'])
+        tile_records = {}
+        for position, (building_id, record) in enumerate(zip(columns['id'][start:start + count],
+                                                             values[start:start + count])):
+            key = building_id if building_id is not None else (int(tile['tile_row'][0]), int(tile['tile_col'][0]), position)
+            tile_records[key] = record
+        records.append(tile_records)
+        start += count
+    return records
+
+def counted_copy(copies: Dict[Tuple[int, int], Tuple[int, float, float, bool, bool, int, int]]
+                 ) -> Tuple[int, int, int, float, float, bool, bool]:
+    """
+    How a building filed under several tiles is counted, once: in its home tile
+    if that holds a copy and otherwise in the first tile that does, damaged
+    when any copy is. Returns (row, col, type, lon, lat, located, damaged).
+    """
+    tiles = sorted(copies)
+    tile = next((tile for tile in tiles if copies[tile][5:] == tile), tiles[0])
+    type_code, lon, lat, located = copies[tile][:4]
+    return tile + (type_code, lon, lat, located, any(record[4] for record in copies.values()))
+
+def building_cube(counted: List[Tuple[int, int, int, float, float, bool, bool]]) -> Dict[str, np.ndarray]:
+    """The building part of the cube for the given counted buildings."""
+    if not counted:
+        return empty_cube()
+    row, col, type_code, lon, lat, located, damaged = (np.asarray(column) for column in zip(*counted))
+    located = located.astype(bool)
+    keys = _grid_keys(np.zeros(len(row), dtype=np.int64), row, col, lon, lat, type_code, located)
+    per_building = np.column_stack((np.ones(len(row), dtype=np.int64), damaged, np.zeros(len(row))))
+    counts = np.concatenate([per_building] + [per_building[located]] * len(SUMMARY_ZOOMS)).astype(np.int64)
+    return _split_by_source(keys, counts, 1)[0]
+
+def crater_cube(craters: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """The crater part of the cube, for all craters at once."""
+    count = len(craters['lat'])
+    keys = _grid_keys(np.zeros(count, dtype=np.int64), craters['row'], craters['col'], craters['lon'],
+                      craters['lat'], np.full(count, ALL_TYPES), np.ones(count, dtype=bool))
+    counts = np.zeros((len(keys), 3), dtype=np.int64)
+    counts[:, 2] = 1
+    return _split_by_source(keys, counts, 1)[0]
+
+def load_state(state_file: str) -> Dict[str, Any]:
+    """Load the building records and cube of the last build, or an empty state."""
+    if state_file and os.path.exists(state_file):
+        with open(state_file, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('version') == STATE_VERSION:
+            return state
+    return {'version': STATE_VERSION, 'tiles_csv': None, 'building_types': [], 'tiles': {}, 'holders': {},
+            'counted': {}, 'craters': None, 'cube': empty_cube()}
+
+def save_state(state: Dict[str, Any], state_file: str) -> None:
+    """Write the state atomically."""
+    os.makedirs(os.path.dirname(state_file) or '.', exist_ok=True)
+    temp_file = state_file + '.tmp'
+    with open(temp_file, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_file, state_file)
+
+def update_summary(state: Dict[str, Any], input_dir: str, craters_file: str, tiles_csv: str = None,
+                   digest: Callable[[str], str] = file_digest) -> Tuple[int, int]:
+    """
+    Bring the cube in state up to date with the building tiles and craters.
+    Only tiles whose digest changed are read, and only the buildings with a
+    copy in them are recounted. Returns the number of tiles recomputed and
+    removed.
+    """
+    # Home tiles depend on the tile grid, so a new grid starts from scratch
+    csv_digest = digest(tiles_csv) if tiles_csv else None
+    if state['tiles_csv'] != csv_digest:
+        state.update(load_state(None), tiles_csv=csv_digest)
+    index = load_tile_index(tiles_csv) if csv_digest else None
+
+    tile_files = find_tile_files(input_dir)
+    live = {(row, col): (path, digest(path)) for row, col, path in tile_files}
+    holders: Dict[Any, set] = state['holders']
+    affected = set()
+
+    def drop_tile(tile: Tuple[int, int]) -> None:
+        for key in state['tiles'].pop(tile)['records']:
+            holders[key].discard(tile)
+            affected.add(key)
+
+    removed = [tile for tile in state['tiles'] if tile not in live]
+    for tile in removed:
+        drop_tile(tile)
+
+    changed = [(row, col, path, tile_digest) for (row, col), (path, tile_digest) in sorted(live.items())
+               if state['tiles'].get((row, col), {}).get('digest') != tile_digest]
+    records = building_records([collect_tile_columns(row, col, path) for row, col, path, _ in changed],
+                               state['building_types'], index)
+    for (row, col, _, tile_digest), tile_records in zip(changed, records):
+        if (row, col) in state['tiles']:
+            drop_tile((row, col))
+        state['tiles'][(row, col)] = {'digest': tile_digest, 'records': tile_records}
+        for key in tile_records:
+            holders.setdefault(key, set()).add((row, col))
+            affected.add(key)
+
+    # Recount every building with a copy in a changed tile from all its copies
+    add: List[Dict[str, np.ndarray]] = []
+    subtract: List[Dict[str, np.ndarray]] = []
+    old_counted = []
+    new_counted = []
+    for key in affected:
+        if key in state['counted']:
+            old_counted.append(state['counted'].pop(key))
+        if holders.get(key):
+            state['counted'][key] = counted_copy({tile: state['tiles'][tile]['records'][key] for tile in holders[key]})
+            new_counted.append(state['counted'][key])
+        else:
+            holders.pop(key, None)
+    if affected:
+        subtract.append(building_cube(old_counted))
+        add.append(building_cube(new_counted))
+
+    craters_digest = digest(craters_file) if craters_file else None
+    previous = state['craters']
+    if (previous or {}).get('digest') != craters_digest:
+        if previous is not None:
+            subtract.append(previous['cube'])
+        if craters_digest is None:
+            state['craters'] = None
+        else:
+            state['craters'] = {'digest': craters_digest, 'cube': crater_cube(load_craters(craters_file))}
+            add.append(state['craters']['cube'])
+
+    if add or subtract:
+        state['cube'] = combine_cubes([state['cube']] + add, subtract)
+    return len(changed), len(removed)
+
+def summary_document(cube: Dict[str, np.ndarray], building_types: List[Any]) -> Dict[str, Any]:
+    """
+    The JSON summary of a cube: totals, per-type totals and the cells of every grid.
+    """
+    keys, counts = cube['keys'].copy(), cube['counts']
+    typed = keys[:, 3] != ALL_TYPES
+
+    # Types are listed in sorted order (missing type last), whatever order tiles
+    # were read in, and types no longer in use are dropped
+    used = sorted(np.unique(keys[typed, 3]).tolist(),
+                  key=lambda code: (building_types[code] is None, str(building_types[code])))
+    renumber = np.full(len(building_types), ALL_TYPES, dtype=np.int64)
+    renumber[used] = np.arange(len(used))
+    keys[typed, 3] = renumber[keys[typed, 3]]
+    keys, counts = group_counts(keys, counts)
+    typed = keys[:, 3] != ALL_TYPES
+
+    tile_rows = keys[:, 0] == TILE_GRID
+    totals = counts[tile_rows].sum(axis=0) if tile_rows.any() else np.zeros(3, dtype=np.int64)
+    type_keys, type_counts = group_counts(keys[tile_rows & typed][:, 3:], counts[tile_rows & typed][:, :2])
+    document: Dict[str, Any] = {
+        'version': SUMMARY_VERSION,
+        'columns': list(COLUMNS),
+        'building_types': [building_types[code] for code in used],
+        'totals': totals.tolist(),
+        'by_type': np.column_stack((type_keys, type_counts)).tolist(),
+        'grids': {},
+    }
+    for grid in (TILE_GRID,) + SUMMARY_ZOOMS:
+        in_grid = keys[:, 0] == grid
+        cell_keys, cell_counts = group_counts(keys[in_grid][:, 1:3], counts[in_grid])
+        in_types = in_grid & typed
+        type_rows = np.column_stack((keys[in_types][:, 1:4], counts[in_types][:, :2]))
+        document['grids']['tile' if grid == TILE_GRID else str(grid)] = {
+            'cells': np.column_stack((cell_keys, cell_counts)).tolist(),
+            'types': type_rows.tolist(),
+        }
+    return document
+
+def write_summary(document: Dict[str, Any], output_file: str) -> None:
+    """Write the summary JSON compactly and atomically."""
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    temp_file = output_file + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(document, f, separators=(',', ':'))
+    os.replace(temp_file, output_file)
+
+def build_damage_summary(input_dir: str, craters_file: str, output_file: str, state_file: str,
+                         digest: Callable[[str], str] = file_digest, tiles_csv: str = None) -> Dict[str, Any]:
+    """
+    Update the cube kept in state_file and write the summary JSON. Returns the
+    summary document.
+    """
+    state = load_state(state_file)
+    recomputed, removed = update_summary(state, input_dir, craters_file, tiles_csv, digest)
+    print(f"Recomputed {recomputed} tiles, removed {removed}, kept {len(state['tiles']) - recomputed}.")
+    document = summary_document(state['cube'], state['building_types'])
+    write_summary(document, output_file)
+    save_state(state, state_file)
+    return document
+
+def main() -> None:
+    """Main function to run the script."""
+
+    # Determine file paths
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.path.join(os.path.dirname(script_dir), 'data')
+    if len(sys.argv) > 3:
+        input_dir, craters_file, output_file = sys.argv[1:4]
+    else:
+        # Default paths
+        input_dir = os.path.join(data_dir, 'building-polygons-labeled')
+        craters_file = os.path.join(data_dir, 'all_craters.json')
+        output_file = os.path.join(data_dir, 'damage_summary.json')
+    state_file = sys.argv[4] if len(sys.argv) > 4 else os.path.join(data_dir, '.build', 'damage_summary_state.pkl')
+    tiles_csv = sys.argv[5] if len(sys.argv) > 5 else os.path.join(data_dir, 'tile_bounds_coords_adj.csv')
+
+    print(f"Summarizing damage in {input_dir}...")
+    document = build_damage_summary(input_dir, craters_file, output_file, state_file, tiles_csv=tiles_csv)
+    buildings, damaged, craters = document['totals']
+    rate = damaged / buildings if buildings else 0.0
+    print(f"{buildings} buildings, {damaged} damaged ({rate:.1%}), {craters} craters.")
+    print(f"Saved damage summary to {output_file}.")
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+build_heatmap_points.py
+
+This script precomputes the damaged-building heatmap points that the damage map
+otherwise derives on every page load.
+
+For every labeled building with is_damaged or is_damaged_labeled set to "True",
+the centroid of its outer ring is computed with vectorized shoelace math over
+all tiles at once. The points are written as a packed little-endian Float32
+buffer of [lat, lon, weight] triples, ready to hand to L.heatLayer.
+
+Weights default to 1. An optional CSV with row,col,weight columns assigns a
+weight per tile; tiles missing from it keep weight 1.
+"""
+
+import csv
+import os
+import sys
+from typing import Dict, Tuple, Any
+
+import numpy as np
+
+from build_building_bundle import collect_features, counts_to_offsets, find_tile_files
+
+DAMAGED_VALUE = "True"
+
+def read_tile_weights(csv_file: str) -> Dict[Tuple[int, int], float]:
+    """
+    Read per-tile weights from a CSV with row, col and weight columns.
+    """
+    weights = {}
+    with open(csv_file, 'r') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            weights[(int(row['row']), int(row['col']))] = float(row['weight'])
+    return weights
+
+def ring_centroids(coords: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    Area-weighted centroids of the rings coords[starts[i]:ends[i]], all at once.
+
+    Rings are non-empty, closed GeoJSON rings. Coordinates are taken relative to each ring's
+    first vertex to keep the shoelace sums well conditioned; degenerate rings
+    with no area fall back to the mean of their vertices.
+    """
+    lengths = ends - starts
+    ring_id = np.repeat(np.arange(starts.size), lengths)
+    packed_starts = np.cumsum(lengths) - lengths
+    vertex = np.arange(lengths.sum()) + np.repeat(starts - packed_starts, lengths)
+    local = coords[vertex] - coords[np.repeat(starts, lengths)]
+
+    # Each vertex pairs with the next one in its ring (the last with the first)
+    following = np.arange(vertex.size) + 1
+    following[packed_starts + lengths - 1] = packed_starts
+    x0, y0 = local[:, 0], local[:, 1]
+    x1, y1 = local[following, 0], local[following, 1]
+    cross = x0 * y1 - x1 * y0
+
+    area2 = np.bincount(ring_id, weights=cross, minlength=starts.size)
+    cx = np.bincount(ring_id, weights=(x0 + x1) * cross, minlength=starts.size)
+    cy = np.bincount(ring_id, weights=(y0 + y1) * cross, minlength=starts.size)
+
+    mean_x = np.bincount(ring_id, weights=x0, minlength=starts.size) / np.maximum(lengths, 1)
+    mean_y = np.bincount(ring_id, weights=y0, minlength=starts.size) / np.maximum(lengths, 1)
+
+    degenerate = np.abs(area2) < 1e-18
+    safe_area = np.where(degenerate, 1.0, area2)
+    centroid_x = np.where(degenerate, mean_x, cx / (3 * safe_area))
+    centroid_y = np.where(degenerate, mean_y, cy / (3 * safe_area))
+    return np.column_stack((centroid_x, centroid_y)) + coords[starts]
+
+def compute_heatmap_points(input_dir: str, tile_weights: Dict[Tuple[int, int], float] = None) -> np.ndarray:
+    """
+    Compute the [lat, lon, weight] points for all damaged buildings in input_dir.
+    """
+    return heatmap_points_from_columns(collect_features(find_tile_files(input_dir)), tile_weights)
+
+def heatmap_points_from_columns(columns: Dict[str, Any],
+                                tile_weights: Dict[Tuple[int, int], float] = None) -> np.ndarray:
+    """
+    Compute the [lat, lon, weight] points from columns produced by collect_features.
+    """
+
+    coords = np.asarray(columns['coords'], dtype=np.float64).reshape(-1, 2)
+    ring_offsets = counts_to_offsets(columns['ring_lengths']).astype(np.int64)
+    polygon_offsets = counts_to_offsets(columns['polygon_ring_counts']).astype(np.int64)
+    feature_offsets = counts_to_offsets(columns['feature_polygon_counts']).astype(np.int64)
+
+    damaged = np.zeros(len(columns['feature_polygon_counts']), dtype=bool)
+    for name in ('is_damaged', 'is_damaged_labeled'):
+        damaged |= np.asarray([value == DAMAGED_VALUE for value in columns['properties'][name]], dtype=bool)
+    # Features without geometry have nothing to place on the map
+    damaged &= np.diff(feature_offsets) > 0
+
+    features = np.nonzero(damaged)[0]
+    outer_rings = polygon_offsets[feature_offsets[features]]
+    centroids = ring_centroids(coords, ring_offsets[outer_rings], ring_offsets[outer_rings + 1])
+
+    weights = np.ones(features.size)
+    if tile_weights:
+        tile_row = np.asarray(columns['tile_row'])[features]
+        tile_col = np.asarray(columns['tile_col'])[features]
+        weights = np.asarray([tile_weights.get((r, c), 1.0) for r, c in zip(tile_row.tolist(), tile_col.tolist())])
+
+    return np.column_stack((centroids[:, 1], centroids[:, 0], weights))
+
+def write_points(points: np.ndarray, output_file: str) -> None:
+    """
+    Write the points as a packed little-endian Float32 [lat, lon, weight] buffer.
+    """
+    with open(output_file, 'wb') as f:
+        f.write(np.ascontiguousarray(points, dtype='<f4').tobytes())
+
+def main() -> None:
+    """Main function to run the script."""
+
+    # Determine file paths
+    if len(sys.argv) > 2:
+        input_dir = sys.argv[1]
+        output_file = sys.argv[2]
+        weights_csv = sys.argv[3] if len(sys.argv) > 3 else None
+    else:
+        # Default paths
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        data_dir = os.path.join(os.path.dirname(script_dir), 'data')
+        input_dir = os.path.join(data_dir, 'building-polygons-labeled')
+        output_file = os.path.join(data_dir, 'damage_heatmap_points.bin')
+        weights_csv = None
+
+    tile_weights = None
+    if weights_csv:
+        print(f"Reading tile weights from {weights_csv}...")
+        tile_weights = read_tile_weights(weights_csv)
+        print(f"Found weights for {len(tile_weights)} tiles.")
+
+    print(f"Computing damaged building centroids from {input_dir}...")
+    points = compute_heatmap_points(input_dir, tile_weights)
+    print(f"Computed {len(points)} heatmap points.")
+
+    print(f"Saving heatmap points to {output_file}...")
+    write_points(points, output_file)
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
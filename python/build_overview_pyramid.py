@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+build_overview_pyramid.py
+
+This script builds a multi-resolution overview pyramid from the satellite crops
+in images/tiles, so the map can show imagery when zoomed out below the zoom at
+which the full-resolution crops are loaded.
+
+Level 1 mosaics each 2x2 block of neighbouring crops into one image at half
+resolution, level 2 mosaics 2x2 blocks of level 1 images (4x4 crops) at a
+quarter resolution, and so on until one image covers the whole grid. Crops are
+placed by their bounds in tile_bounds_coords_adj.csv, not by row/col, because
+the column numbering is staggered between rows. Blocks are a geographic grid
+anchored at the north-west corner of the dataset, with cells of 2^level tile
+spacings; a crop belongs to the cell containing its center.
+
+The output directory looks like:
+    index.json              levels, their usable zoom range and tile bounds
+    {level}/{x}_{y}.webp    one overview image per non-empty block
+
+Every overview tile records a hash of its sources (the crop file hashes and
+bounds, or the hashes of its child tiles). A rebuild only re-renders tiles
+whose hash changed, so replacing one crop re-renders one tile per level.
+Tiles of a level are rendered in parallel in a process pool.
+
+Requires Pillow with WebP support.
+"""
+
+import hashlib
+import json
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, Any
+
+import numpy as np
+
+try:
+    from PIL import Image
+except ImportError:  # Optional, only needed to render the pyramid
+    Image = None
+
+from extract_perimeter import read_tile_bounds
+from incremental_build import BUILD_DIR_NAME, BuildManifest
+
+CROP_NAME = 'cropped_row_{row}_col_{col}.webp'
+INDEX_FILE_NAME = 'index.json'
+INDEX_VERSION = 1
+WEBP_QUALITY = 80
+# Web Mercator tile size, used to convert image resolution into a map zoom
+TILE_SIZE = 256
+
+def grid_spacing(tiles: List[Dict[str, Any]]) -> Tuple[float, float]:
+    """
+    Return the (lon, lat) spacing of the tile grid in degrees.
+
+    Tiles overlap their neighbours slightly, so the spacing is taken from the
+    distance between centers rather than from the tile sizes.
+    """
+    by_row: Dict[int, List[float]] = {}
+    for tile in tiles:
+        by_row.setdefault(tile['row'], []).append(tile['lon_center'])
+    lon_steps = np.concatenate([np.diff(sorted(lons)) for lons in by_row.values() if len(lons) > 1])
+    lat_centers = np.unique(np.round([tile['lat_center'] for tile in tiles], 9))
+    return float(np.median(lon_steps)), float(np.median(np.diff(lat_centers)))
+
+def union_bounds(bounds: List[List[float]]) -> List[float]:
+    """Bounding box [lat_min, lon_min, lat_max, lon_max] of several boxes."""
+    boxes = np.asarray(bounds)
+    return [float(boxes[:, 0].min()), float(boxes[:, 1].min()), float(boxes[:, 2].max()), float(boxes[:, 3].max())]
+
+def _hash_sources(parts: List[str]) -> str:
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+def overview_path(output_dir: str, level: int, cell: Tuple[int, int]) -> str:
+    """Path of the overview image of a block."""
+    return os.path.join(output_dir, str(level), f"{cell[0]}_{cell[1]}.webp")
+
+def plan_pyramid(tiles: List[Dict[str, Any]], crop_digests: Dict[Tuple[int, int], str],
+                 crops_dir: str, output_dir: str) -> List[Dict[Tuple[int, int], Dict[str, Any]]]:
+    """
+    Group the crops into the blocks of every overview level.
+
+    Returns one dict per level (level 1 first) mapping a block (x, y) to its
+    image path, bounds, source images (path and bounds) and source hash.
+    Level 1 sources are crops; higher levels use the images of the level below.
+    """
+    step_lon, step_lat = grid_spacing(tiles)
+    origin_lon = min(tile['lon_min'] for tile in tiles)
+    origin_lat = max(tile['lat_max'] for tile in tiles)
+
+    # Level 0: the crops themselves, in cells of one tile spacing
+    blocks = []
+    for tile in tiles:
+        digest = crop_digests.get((tile['row'], tile['col']))
+        if digest is None:
+            continue
+        bounds = [tile['lat_min'], tile['lon_min'], tile['lat_max'], tile['lon_max']]
+        blocks.append({
+            'cell': (int((tile['lon_center'] - origin_lon) // step_lon),
+                     int((origin_lat - tile['lat_center']) // step_lat)),
+            'path': os.path.join(crops_dir, CROP_NAME.format(row=tile['row'], col=tile['col'])),
+            'bounds': bounds,
+            'sources_hash': _hash_sources([str(tile['row']), str(tile['col']), repr(bounds), digest]),
+        })
+
+    levels = []
+    while len(blocks) > 1 or not levels:
+        children: Dict[Tuple[int, int], List[Dict[str, Any]]] = {}
+        for child in blocks:
+            children.setdefault((child['cell'][0] // 2, child['cell'][1] // 2), []).append(child)
+
+        number = len(levels) + 1
+        level = {}
+        for cell, members in sorted(children.items()):
+            level[cell] = {
+                'cell': cell,
+                'path': overview_path(output_dir, number, cell),
+                'bounds': union_bounds([member['bounds'] for member in members]),
+                'sources': [(member['path'], member['bounds']) for member in members],
+                'sources_hash': _hash_sources([member['sources_hash'] for member in members]),
+            }
+        levels.append(level)
+        blocks = list(level.values())
+    return levels
+
+def render_block(path: str, bounds: List[float], sources: List[Tuple[str, List[float]]],
+                 degrees_per_pixel: Tuple[float, float]) -> Tuple[int, int]:
+    """
+    Mosaic the source images into one image covering bounds at the given
+    (lon, lat) resolution and save it as WebP. Returns the image size.
+    """
+    lat_min, lon_min, lat_max, lon_max = bounds
+    scale_x, scale_y = degrees_per_pixel
+    width = max(1, round((lon_max - lon_min) / scale_x))
+    height = max(1, round((lat_max - lat_min) / scale_y))
+
+    # Transparent where no crop covers the block, so gaps show the base map
+    canvas = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    for source_path, (src_lat_min, src_lon_min, src_lat_max, src_lon_max) in sources:
+        left = round((src_lon_min - lon_min) / scale_x)
+        top = round((lat_max - src_lat_max) / scale_y)
+        right = round((src_lon_max - lon_min) / scale_x)
+        bottom = round((lat_max - src_lat_min) / scale_y)
+        with Image.open(source_path) as image:
+            image = image.convert('RGBA').resize((max(1, right - left), max(1, bottom - top)),
+                                                 Image.Resampling.LANCZOS)
+        canvas.alpha_composite(image, (left, top))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    canvas.save(temp_path, 'WEBP', quality=WEBP_QUALITY, method=6)
+    os.replace(temp_path, path)
+    return width, height
+
+def _render_task(task: Tuple[str, List[float], List[Tuple[str, List[float]]], Tuple[float, float]]) -> Tuple[int, int]:
+    return render_block(*task)
+
+def crop_resolution(tiles: List[Dict[str, Any]], crops_dir: str) -> Tuple[float, float]:
+    """Median (lon, lat) degrees per pixel of the full-resolution crops."""
+    scales = []
+    for tile in tiles:
+        path = os.path.join(crops_dir, CROP_NAME.format(row=tile['row'], col=tile['col']))
+        if os.path.exists(path):
+            with Image.open(path) as image:
+                width, height = image.size
+            scales.append(((tile['lon_max'] - tile['lon_min']) / width, (tile['lat_max'] - tile['lat_min']) / height))
+    scales = np.asarray(scales)
+    return float(np.median(scales[:, 0])), float(np.median(scales[:, 1]))
+
+def max_sharp_zoom(degrees_per_pixel: float) -> int:
+    """The highest map zoom at which an image of this resolution is not upsampled."""
+    return int(math.floor(math.log2(360.0 / (TILE_SIZE * degrees_per_pixel))))
+
+def build_overview_pyramid(csv_file: str, crops_dir: str, output_dir: str, manifest_file: str,
+                           force: bool = False, max_workers: int = None) -> Dict[str, Any]:
+    """
+    Build or update the overview pyramid and return the written index.
+    """
+    if Image is None:
+        raise RuntimeError("Pillow is required to build the overview pyramid (pip install Pillow)")
+
+    tiles = read_tile_bounds(csv_file)
+    manifest = BuildManifest(manifest_file)
+    crop_digests = {}
+    for tile in tiles:
+        digest = manifest.digest(os.path.join(crops_dir, CROP_NAME.format(row=tile['row'], col=tile['col'])))
+        if digest is not None:
+            crop_digests[(tile['row'], tile['col'])] = digest
+    if not crop_digests:
+        raise FileNotFoundError(f"No satellite crops found in {crops_dir}")
+    print(f"Found {len(crop_digests)} of {len(tiles)} crops")
+
+    # Hashes of the tiles written by the previous build
+    previous = {}
+    index_file = os.path.join(output_dir, INDEX_FILE_NAME)
+    if os.path.exists(index_file) and not force:
+        with open(index_file, 'r', encoding='utf-8') as f:
+            old_index = json.load(f)
+        if old_index.get('version') == INDEX_VERSION:
+            for level in old_index['levels']:
+                for tile in level['tiles']:
+                    previous[(level['level'], tile['x'], tile['y'])] = tile
+
+    base_x, base_y = crop_resolution(tiles, crops_dir)
+    levels = plan_pyramid(tiles, crop_digests, crops_dir, output_dir)
+    index = {'version': INDEX_VERSION, 'levels': []}
+    rendered = 0
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        # Levels are built in order, since each one is mosaicked from the level below
+        for number, level in enumerate(levels, start=1):
+            resolution = (base_x * 2 ** number, base_y * 2 ** number)
+            entries, pending = [], []
+            for cell, block in level.items():
+                entry = {'x': cell[0], 'y': cell[1], 'bounds': block['bounds'],
+                         'file': f"{number}/{cell[0]}_{cell[1]}.webp", 'sources_hash': block['sources_hash']}
+                old = previous.get((number, cell[0], cell[1]))
+                if old and old['sources_hash'] == block['sources_hash'] and os.path.exists(block['path']):
+                    entry['width'], entry['height'] = old['width'], old['height']
+                else:
+                    pending.append((entry, block))
+                entries.append(entry)
+
+            tasks = [(block['path'], block['bounds'], block['sources'], resolution) for _, block in pending]
+            for (entry, _), (width, height) in zip(pending, pool.map(_render_task, tasks)):
+                entry['width'], entry['height'] = width, height
+
+            rendered += len(tasks)
+            index['levels'].append({'level': number, 'max_zoom': max_sharp_zoom(resolution[0]), 'tiles': entries})
+            print(f"  level {number}: {len(entries)} tiles, rendered {len(tasks)}")
+
+    # Drop images of blocks that no longer exist
+    live = {block['path'] for level in levels for block in level.values()}
+    for number, x, y in previous:
+        path = overview_path(output_dir, number, (x, y))
+        if path not in live and os.path.exists(path):
+            os.remove(path)
+
+    temp_path = index_file + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2)
+    os.replace(temp_path, index_file)
+    manifest.save()
+    print(f"Rendered {rendered} overview tiles")
+    return index
+
+def main() -> None:
+    """Main function to run the script."""
+
+    # Determine paths; --force re-renders every tile
+    args = [arg for arg in sys.argv[1:] if arg != '--force']
+    force = len(args) != len(sys.argv) - 1
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    repo_dir = os.path.dirname(script_dir)
+    if len(args) >= 3:
+        csv_file, crops_dir, output_dir = args[:3]
+    else:
+        # Default paths
+        csv_file = os.path.join(repo_dir, 'data', 'tile_bounds_coords_adj.csv')
+        crops_dir = os.path.join(repo_dir, 'images', 'tiles')
+        output_dir = os.path.join(repo_dir, 'images', 'overview')
+    manifest_file = os.path.join(repo_dir, 'data', BUILD_DIR_NAME, 'overview_manifest.json')
+
+    print(f"Building overview pyramid from {crops_dir} into {output_dir}...")
+    index = build_overview_pyramid(csv_file, crops_dir, output_dir, manifest_file, force)
+    print(f"Wrote {len(index['levels'])} levels to {output_dir}")
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,595 @@
+#!/usr/bin/env python3
+"""
+build_vector_tiles.py
+
+This script cuts the labeled building footprints and the detected craters into a
+z/x/y quadtree of pre-clipped vector tiles, so a web map only has to fetch the
+tiles that are visible instead of holding every polygon in memory.
+
+Tiles use the standard Web Mercator (XYZ) scheme that Leaflet uses. The output
+directory looks like:
+    index.json          zoom range, data bounds and the list of non-empty tiles
+    {z}/{x}/{y}.json    one GeoJSON FeatureCollection per tile
+
+From DETAIL_MIN_ZOOM up to MAX_ZOOM a tile holds its buildings clipped to the tile
+and simplified to about one pixel at that zoom, plus the craters whose centers
+fall inside it. Below DETAIL_MIN_ZOOM a tile only holds aggregated counts: an
+AGGREGATE_GRID x AGGREGATE_GRID grid of points with building, damaged and crater
+counts. Detail tiles are built in parallel in a process pool.
+
+The pyramid is written to a sibling directory and swapped into place once it
+is complete, so a failed build leaves the previous one as it was.
+
+Given a state file, the footprint bounds of every building tile and the craters
+of the last build are kept in it. When the output still holds that build, only
+the detail tiles overlapping a changed, added or removed building tile or
+crater are rebuilt in place, and the cheap aggregate zooms are redone; index.json
+is replaced last, so an interrupted update is simply redone by the next run.
+"""
+
+import json
+import math
+import os
+import pickle
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Set, Tuple, Any
+
+import numpy as np
+import shapely
+
+from build_building_bundle import collect_features, counts_to_offsets, file_digest, find_tile_files
+from craters import load_craters
+
+MIN_ZOOM = 10
+DETAIL_MIN_ZOOM = 14
+MAX_ZOOM = 17
+TILE_SIZE = 256
+# Cells per side of the count grid in aggregated tiles
+AGGREGATE_GRID = 16
+# Tiles handed to a worker per task
+TILES_PER_TASK = 64
+DAMAGED_VALUE = "True"
+# A build is written to output_dir + BUILD_SUFFIX, which holds BUILD_MARKER until
+# it is complete, and the build it replaces is moved to output_dir + PREVIOUS_SUFFIX
+BUILD_SUFFIX = '.tmp'
+PREVIOUS_SUFFIX = '.old'
+BUILD_MARKER = '.incomplete'
+STATE_VERSION = 1
+
+# Worker state, filled in once per process by _init_worker
+_worker: Dict[str, Any] = {}
+
+def lonlat_to_tile(lon: np.ndarray, lat: np.ndarray, zoom: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the XYZ tile indices containing the given points at this zoom.
+    """
+    n = 2 ** zoom
+    x = np.floor((np.asarray(lon) + 180.0) / 360.0 * n)
+    lat_rad = np.radians(np.asarray(lat))
+    y = np.floor((1.0 - np.arcsinh(np.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
+
+def tile_bounds(zoom: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """
+    Return (lon_min, lat_min, lon_max, lat_max) of an XYZ tile.
+    """
+    n = 2 ** zoom
+    lon_min = x / n * 360.0 - 180.0
+    lon_max = (x + 1) / n * 360.0 - 180.0
+    lat_max = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    lat_min = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return lon_min, lat_min, lon_max, lat_max
+
+def pixel_size(zoom: int) -> float:
+    """Degrees of longitude covered by one pixel at this zoom."""
+    return 360.0 / (TILE_SIZE * 2 ** zoom)
+
+def coordinate_decimals(zoom: int) -> int:
+    """Decimals needed to keep coordinates at roughly a tenth of a pixel."""
+    return max(0, math.ceil(-math.log10(pixel_size(zoom) / 10)))
+
+def load_buildings(input_dir: str, columns: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Load all labeled buildings as a Shapely geometry array plus attribute columns,
+    reading the tile files unless their merged columns are given.
+
+    A building on a tile seam is filed under every tile it overlaps, with the
+    same footprint. Only its first copy is kept, and it counts as damaged when
+    any copy is labeled damaged. 'tile_bounds' maps each building tile to the
+    bounds of all its footprints, copies included.
+    """
+    if columns is None:
+        columns = collect_features(find_tile_files(input_dir))
+    coords = np.asarray(columns['coords'], dtype=np.float64).reshape(-1, 2)
+    offsets = (
+        counts_to_offsets(columns['ring_lengths']).astype(np.int64),
+        counts_to_offsets(columns['polygon_ring_counts']).astype(np.int64),
+        counts_to_offsets(columns['feature_polygon_counts']).astype(np.int64),
+    )
+    geometries = shapely.from_ragged_array(shapely.GeometryType.MULTIPOLYGON, coords, offsets)
+
+    # Single-part footprints are written back out as plain Polygons
+    single = shapely.get_num_geometries(geometries) == 1
+    geometries[single] = shapely.get_geometry(geometries[single], 0)
+
+    damaged = np.zeros(len(geometries), dtype=bool)
+    for name in ('is_damaged', 'is_damaged_labeled'):
+        damaged |= np.asarray([value == DAMAGED_VALUE for value in columns['properties'][name]], dtype=bool)
+
+    # Features without geometry have nowhere to go on the map
+    present = np.flatnonzero(~shapely.is_empty(geometries))
+    tile_bounds = group_by_tile(shapely.bounds(geometries[present]),
+                                columns['tile_row'][present], columns['tile_col'][present])
+
+    # One copy per building id; features without an id are all kept
+    unique_ids: Dict[Any, int] = {}
+    inverse = np.fromiter(
+        (unique_ids.setdefault(value if value is not None else (None, index), len(unique_ids))
+         for index, value in ((index, columns['id'][index]) for index in present.tolist())),
+        dtype=np.int64, count=present.size,
+    )
+    first = np.full(len(unique_ids), present.size, dtype=np.int64)
+    np.minimum.at(first, inverse, np.arange(present.size))
+    any_damaged = np.zeros(len(unique_ids), dtype=bool)
+    np.logical_or.at(any_damaged, inverse, damaged[present])
+    keep = present[first]
+
+    centroids = shapely.centroid(geometries[keep])
+    return {
+        'geometry': geometries[keep],
+        'id': [str(columns['id'][index]) for index in keep.tolist()],
+        'building': [columns['properties']['building'][index] for index in keep.tolist()],
+        'damaged': any_damaged,
+        'lon': shapely.get_x(centroids),
+        'lat': shapely.get_y(centroids),
+        'tile_bounds': tile_bounds,
+    }
+
+def group_by_tile(values: np.ndarray, row: np.ndarray, col: np.ndarray) -> Dict[Tuple[int, int], np.ndarray]:
+    """Split the rows of values by their (row, col) tile."""
+    order = np.lexsort((col, row))
+    keys, starts = np.unique(np.column_stack((row[order], col[order])), axis=0, return_index=True)
+    return {(int(r), int(c)): values[group] for (r, c), group in zip(keys, np.split(order, starts[1:]))}
+
+def _init_worker(buildings: Dict[str, Any], craters: Dict[str, np.ndarray], output_dir: str) -> None:
+    """Store the shared inputs and a spatial index once per worker process."""
+    _worker['buildings'] = buildings
+    _worker['craters'] = craters
+    _worker['output_dir'] = output_dir
+    _worker['tree'] = shapely.STRtree(buildings['geometry'])
+
+def _craters_by_tile(zoom: int) -> Dict[Tuple[int, int], np.ndarray]:
+    """Group crater indices by the tile holding their center, cached per zoom."""
+    cache = _worker.setdefault('crater_tiles', {})
+    if zoom not in cache:
+        craters = _worker['craters']
+        x, y = lonlat_to_tile(craters['lon'], craters['lat'], zoom)
+        order = np.lexsort((y, x))
+        keys, starts = np.unique(np.column_stack((x[order], y[order])), axis=0, return_index=True)
+        groups = np.split(order, starts[1:])
+        cache[zoom] = {(int(kx), int(ky)): group for (kx, ky), group in zip(keys, groups)}
+    return cache[zoom]
+
+def _write_tile(output_dir: str, zoom: int, x: int, y: int, features: List[str]) -> None:
+    """Write one tile's pre-serialized features as a FeatureCollection."""
+    tile_dir = os.path.join(output_dir, str(zoom), str(x))
+    os.makedirs(tile_dir, exist_ok=True)
+    with open(os.path.join(tile_dir, f"{y}.json"), 'w', encoding='utf-8') as f:
+        f.write('{"type":"FeatureCollection","features":[')
+        f.write(','.join(features))
+        f.write(']}')
+
+def _build_detail_tiles(zoom: int, tiles: List[Tuple[int, int]]) -> List[List[int]]:
+    """
+    Clip, simplify and write a batch of detail tiles at one zoom.
+    Returns [x, y, buildings, damaged, craters] for every non-empty tile.
+    """
+    buildings = _worker['buildings']
+    craters = _worker['craters']
+    crater_tiles = _craters_by_tile(zoom)
+    no_craters = np.zeros(0, dtype=np.int64)
+    tolerance = pixel_size(zoom)
+    decimals = coordinate_decimals(zoom)
+    summaries = []
+
+    for x, y in tiles:
+        lon_min, lat_min, lon_max, lat_max = tile_bounds(zoom, x, y)
+        hits = _worker['tree'].query(shapely.box(lon_min, lat_min, lon_max, lat_max))
+        hits.sort()
+
+        clipped = shapely.clip_by_rect(buildings['geometry'][hits], lon_min, lat_min, lon_max, lat_max)
+        clipped = shapely.simplify(clipped, tolerance, preserve_topology=True)
+        clipped = shapely.transform(clipped, lambda c: np.round(c, decimals))
+        keep = ~shapely.is_empty(clipped)
+        hits, clipped = hits[keep], clipped[keep]
+
+        in_tile = crater_tiles.get((x, y), no_craters)
+        if not hits.size and not in_tile.size:
+            continue
+
+        features = []
+        for index, geometry in zip(hits.tolist(), shapely.to_geojson(clipped).tolist()):
+            properties = {
+                'id': buildings['id'][index],
+                'building': buildings['building'][index],
+                'is_damaged': DAMAGED_VALUE if buildings['damaged'][index] else "False",
+            }
+            features.append(
+                f'{{"type":"Feature","properties":{json.dumps(properties, separators=(",", ":"))},'
+                f'"geometry":{geometry}}}'
+            )
+        for index in in_tile.tolist():
+            properties = {
+                'kind': 'crater',
+                'radius': round(float(craters['radius'][index]), 2),
+                'row': int(craters['row'][index]),
+                'col': int(craters['col'][index]),
+            }
+            point = [round(float(craters['lon'][index]), decimals), round(float(craters['lat'][index]), decimals)]
+            features.append(json.dumps(
+                {'type': 'Feature', 'properties': properties, 'geometry': {'type': 'Point', 'coordinates': point}},
+                separators=(',', ':'),
+            ))
+
+        _write_tile(_worker['output_dir'], zoom, x, y, features)
+        summaries.append([x, y, int(hits.size), int(buildings['damaged'][hits].sum()), int(in_tile.size)])
+
+    return summaries
+
+def build_aggregate_tiles(buildings: Dict[str, Any], craters: Dict[str, np.ndarray],
+                          zoom: int, output_dir: str) -> List[List[int]]:
+    """
+    Write count-only tiles at a low zoom, binning points into an AGGREGATE_GRID
+    grid per tile with vectorized histograms over the whole dataset.
+    """
+    sub_zoom = zoom + int(math.log2(AGGREGATE_GRID))
+    layers = {
+        'buildings': lonlat_to_tile(buildings['lon'], buildings['lat'], sub_zoom),
+        'damaged': lonlat_to_tile(buildings['lon'][buildings['damaged']], buildings['lat'][buildings['damaged']], sub_zoom),
+        'craters': lonlat_to_tile(craters['lon'], craters['lat'], sub_zoom),
+    }
+
+    # Count points per sub-tile cell for each layer
+    counts: Dict[Tuple[int, int], Dict[str, int]] = {}
+    for name, (cell_x, cell_y) in layers.items():
+        cells, cell_counts = np.unique(np.column_stack((cell_x, cell_y)), axis=0, return_counts=True)
+        for (cx, cy), count in zip(cells.tolist(), cell_counts.tolist()):
+            counts.setdefault((cx, cy), {'buildings': 0, 'damaged': 0, 'craters': 0})[name] = count
+
+    tiles: Dict[Tuple[int, int], List[str]] = {}
+    totals: Dict[Tuple[int, int], List[int]] = {}
+    for (cx, cy), cell in sorted(counts.items()):
+        tile = (cx // AGGREGATE_GRID, cy // AGGREGATE_GRID)
+        lon_min, lat_min, lon_max, lat_max = tile_bounds(sub_zoom, cx, cy)
+        center = [round((lon_min + lon_max) / 2, 6), round((lat_min + lat_max) / 2, 6)]
+        tiles.setdefault(tile, []).append(json.dumps(
+            {'type': 'Feature', 'properties': cell, 'geometry': {'type': 'Point', 'coordinates': center}},
+            separators=(',', ':'),
+        ))
+        total = totals.setdefault(tile, [0, 0, 0])
+        total[0] += cell['buildings']
+        total[1] += cell['damaged']
+        total[2] += cell['craters']
+
+    for (x, y), features in tiles.items():
+        _write_tile(output_dir, zoom, x, y, features)
+    return [[x, y, *totals[(x, y)]] for x, y in sorted(tiles)]
+
+def tiles_covering_bounds(bounds: np.ndarray, zoom: int) -> Set[Tuple[int, int]]:
+    """
+    Return every tile at this zoom that intersects one of the (lon_min, lat_min,
+    lon_max, lat_max) rows of bounds.
+    """
+    bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+    x_min, y_max = lonlat_to_tile(bounds[:, 0], bounds[:, 1], zoom)
+    x_max, y_min = lonlat_to_tile(bounds[:, 2], bounds[:, 3], zoom)
+
+    tiles = set()
+    # Most footprints fall inside one tile; only the rest need their full range
+    single = (x_min == x_max) & (y_min == y_max)
+    tiles.update(zip(x_min[single].tolist(), y_min[single].tolist()))
+    for x0, x1, y0, y1 in zip(x_min[~single].tolist(), x_max[~single].tolist(),
+                              y_min[~single].tolist(), y_max[~single].tolist()):
+        tiles.update((x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+    return tiles
+
+def crater_bounds(craters: Dict[str, np.ndarray]) -> np.ndarray:
+    """Crater centers as zero-size bounds rows."""
+    return np.column_stack((craters['lon'], craters['lat'], craters['lon'], craters['lat']))
+
+def covering_tiles(buildings: Dict[str, Any], craters: Dict[str, np.ndarray], zoom: int) -> List[Tuple[int, int]]:
+    """
+    Return every tile at this zoom that intersects a building or holds a crater.
+    """
+    bounds = np.concatenate((shapely.bounds(buildings['geometry']).reshape(-1, 4), crater_bounds(craters)))
+    return sorted(tiles_covering_bounds(bounds, zoom))
+
+def build_detail_tiles(buildings: Dict[str, Any], craters: Dict[str, np.ndarray], output_dir: str,
+                       zoom_tiles: Dict[int, List[Tuple[int, int]]], max_workers: int = None) -> Dict[int, List[List[int]]]:
+    """
+    Build the given detail tiles of every zoom, in a process pool unless there
+    are too few to fill one task. Returns the sorted tile summaries per zoom.
+    """
+    if sum(len(tiles) for tiles in zoom_tiles.values()) <= TILES_PER_TASK:
+        _init_worker(buildings, craters, output_dir)
+        try:
+            return {zoom: sorted(_build_detail_tiles(zoom, tiles)) for zoom, tiles in zoom_tiles.items()}
+        finally:
+            _worker.clear()
+
+    summaries: Dict[int, List[List[int]]] = {}
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(buildings, craters, output_dir)) as pool:
+        for zoom, tiles in zoom_tiles.items():
+            batches = [tiles[i:i + TILES_PER_TASK] for i in range(0, len(tiles), TILES_PER_TASK)]
+            summaries[zoom] = sorted(
+                summary for batch in pool.map(_build_detail_tiles, [zoom] * len(batches), batches) for summary in batch
+            )
+    return summaries
+
+def remove_tiles(output_dir: str, zoom: int, tiles: List[Tuple[int, int]]) -> None:
+    """Delete the files of the given tiles at one zoom, where they exist."""
+    for x, y in tiles:
+        path = os.path.join(output_dir, str(zoom), str(x), f"{y}.json")
+        if os.path.isfile(path):
+            os.remove(path)
+
+def remove_previous_build(output_dir: str) -> None:
+    """
+    Delete a build directory left by this script: the tiles and index.json of a
+    finished build, found through the tile list of its index, or everything in
+    an unfinished one, which still holds its BUILD_MARKER. Nothing else is
+    touched, the directory itself is removed once empty, and a non-empty
+    directory that is neither is refused rather than cleared.
+    """
+    if not os.path.isdir(output_dir):
+        return
+    index_file = os.path.join(output_dir, 'index.json')
+    marker_file = os.path.join(output_dir, BUILD_MARKER)
+    if os.path.isfile(index_file):
+        with open(index_file, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        for zoom, tiles in index.get('tiles', {}).items():
+            zoom_dir = os.path.join(output_dir, str(zoom))
+            for x, y, *_ in tiles:
+                path = os.path.join(zoom_dir, str(x), f"{y}.json")
+                if os.path.isfile(path):
+                    os.remove(path)
+            # Drop the directories the build created once they are empty
+            for column_dir in [os.path.join(zoom_dir, str(x)) for x in {tile[0] for tile in tiles}] + [zoom_dir]:
+                if os.path.isdir(column_dir) and not os.listdir(column_dir):
+                    os.rmdir(column_dir)
+        os.remove(index_file)
+        if os.path.isfile(marker_file):
+            os.remove(marker_file)
+    elif os.path.isfile(marker_file):
+        # Everything in an unfinished build was written by this script
+        shutil.rmtree(output_dir)
+        return
+    elif os.listdir(output_dir):
+        raise ValueError(f"{output_dir} is not empty and has no vector tile index.json; "
+                         "choose an empty or new output directory")
+    if not os.listdir(output_dir):
+        os.rmdir(output_dir)
+
+def check_output_dir(output_dir: str) -> None:
+    """Refuse a non-empty output directory that does not hold a previous build."""
+    if (os.path.isdir(output_dir) and os.listdir(output_dir)
+            and not os.path.isfile(os.path.join(output_dir, 'index.json'))):
+        raise ValueError(f"{output_dir} is not empty and has no vector tile index.json; "
+                         "choose an empty or new output directory")
+
+def replace_build(build_dir: str, output_dir: str) -> None:
+    """
+    Move a finished build into output_dir, then delete the build it replaces.
+    The previous build stays complete until the new one is in place.
+    """
+    previous_dir = output_dir.rstrip(os.sep) + PREVIOUS_SUFFIX
+    if os.path.isdir(output_dir):
+        os.rename(output_dir, previous_dir)
+    os.rename(build_dir, output_dir)
+    os.remove(os.path.join(output_dir, BUILD_MARKER))
+    remove_previous_build(previous_dir)
+    if os.path.isdir(previous_dir):
+        # Files of others that were kept in the output go back to it
+        for name in os.listdir(previous_dir):
+            if not os.path.exists(os.path.join(output_dir, name)):
+                os.rename(os.path.join(previous_dir, name), os.path.join(output_dir, name))
+        if os.listdir(previous_dir):
+            print(f"Kept files not written by this script in {previous_dir}")
+        else:
+            os.rmdir(previous_dir)
+
+def new_index(buildings: Dict[str, Any], craters: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """An index with the zoom range and data bounds, and no tiles yet."""
+    bounds = shapely.total_bounds(buildings['geometry'])
+    if len(craters['lat']):
+        bounds = [
+            min(bounds[0], craters['lon'].min()), min(bounds[1], craters['lat'].min()),
+            max(bounds[2], craters['lon'].max()), max(bounds[3], craters['lat'].max()),
+        ]
+    return {
+        'min_zoom': MIN_ZOOM,
+        'max_zoom': MAX_ZOOM,
+        'detail_min_zoom': DETAIL_MIN_ZOOM,
+        'bounds': [float(value) for value in bounds],
+        'tile_fields': ['x', 'y', 'buildings', 'damaged', 'craters'],
+        'tiles': {},
+    }
+
+def write_index(index: Dict[str, Any], output_dir: str) -> None:
+    """Write index.json atomically."""
+    index_file = os.path.join(output_dir, 'index.json')
+    temp_file = f"{index_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(temp_file, index_file)
+
+def build_pyramid(buildings: Dict[str, Any], craters: Dict[str, np.ndarray], output_dir: str,
+                  max_workers: int = None) -> Dict[str, Any]:
+    """
+    Build the full tile pyramid and its index. Returns the index.
+    """
+    # Build next to the output and swap it in at the end, so a failed build
+    # leaves the previous one untouched; clear what an interrupted run left
+    build_dir = output_dir.rstrip(os.sep) + BUILD_SUFFIX
+    remove_previous_build(build_dir)
+    remove_previous_build(output_dir.rstrip(os.sep) + PREVIOUS_SUFFIX)
+    os.makedirs(build_dir)
+    open(os.path.join(build_dir, BUILD_MARKER), 'w').close()
+
+    index = new_index(buildings, craters)
+    for zoom in range(MIN_ZOOM, DETAIL_MIN_ZOOM):
+        index['tiles'][str(zoom)] = build_aggregate_tiles(buildings, craters, zoom, build_dir)
+        print(f"Zoom {zoom}: {len(index['tiles'][str(zoom)])} aggregate tiles.")
+
+    zoom_tiles = {zoom: covering_tiles(buildings, craters, zoom) for zoom in range(DETAIL_MIN_ZOOM, MAX_ZOOM + 1)}
+    for zoom, summaries in build_detail_tiles(buildings, craters, build_dir, zoom_tiles, max_workers).items():
+        index['tiles'][str(zoom)] = summaries
+        print(f"Zoom {zoom}: {len(summaries)} detail tiles.")
+
+    write_index(index, build_dir)
+    replace_build(build_dir, output_dir)
+    return index
+
+def update_pyramid(buildings: Dict[str, Any], craters: Dict[str, np.ndarray], output_dir: str,
+                   dirty_bounds: np.ndarray, max_workers: int = None) -> Dict[str, Any]:
+    """
+    Update the pyramid in output_dir in place: redo the aggregate zooms and the
+    detail tiles intersecting dirty_bounds, and keep every other detail tile.
+    Returns the new index.
+    """
+    with open(os.path.join(output_dir, 'index.json'), 'r', encoding='utf-8') as f:
+        previous = json.load(f)['tiles']
+    index = new_index(buildings, craters)
+
+    for zoom in range(MIN_ZOOM, DETAIL_MIN_ZOOM):
+        summaries = build_aggregate_tiles(buildings, craters, zoom, output_dir)
+        kept = {(x, y) for x, y, *_ in summaries}
+        remove_tiles(output_dir, zoom, [(x, y) for x, y, *_ in previous.get(str(zoom), []) if (x, y) not in kept])
+        index['tiles'][str(zoom)] = summaries
+
+    zoom_tiles = {}
+    for zoom in range(DETAIL_MIN_ZOOM, MAX_ZOOM + 1):
+        zoom_tiles[zoom] = sorted(tiles_covering_bounds(dirty_bounds, zoom))
+        # Tiles that end up empty are not written again, so clear them first
+        remove_tiles(output_dir, zoom, zoom_tiles[zoom])
+    rebuilt = build_detail_tiles(buildings, craters, output_dir, zoom_tiles, max_workers)
+    for zoom, tiles in zoom_tiles.items():
+        dirty = set(tiles)
+        kept = [summary for summary in previous.get(str(zoom), []) if tuple(summary[:2]) not in dirty]
+        index['tiles'][str(zoom)] = sorted(kept + rebuilt[zoom])
+    print(f"Rebuilt {sum(len(tiles) for tiles in zoom_tiles.values())} detail tiles.")
+
+    write_index(index, output_dir)
+    return index
+
+def crater_rows(craters: Dict[str, np.ndarray]) -> np.ndarray:
+    """The crater fields the tiles show, one row per crater."""
+    return np.column_stack((craters['lon'], craters['lat'], craters['radius'],
+                            craters['row'], craters['col'])).astype(np.float64)
+
+def changed_bounds(state: Dict[str, Any], tile_digests: Dict[Tuple[int, int], str],
+                   buildings: Dict[str, Any], craters: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Bounds of everything that changed since the build recorded in state: the old
+    and new footprints of every changed building tile, and the centers of the
+    craters that were added or removed.
+    """
+    parts = [np.zeros((0, 4))]
+    for tile in set(state['tiles']) | set(tile_digests):
+        old = state['tiles'].get(tile)
+        if old is not None and old['digest'] == tile_digests.get(tile):
+            continue
+        if old is not None:
+            parts.append(old['bounds'])
+        if tile in buildings['tile_bounds']:
+            parts.append(buildings['tile_bounds'][tile])
+
+    old_craters = {tuple(row) for row in state['craters'].tolist()}
+    new_craters = {tuple(row) for row in crater_rows(craters).tolist()}
+    points = np.asarray(sorted(old_craters ^ new_craters), dtype=np.float64).reshape(-1, 5)
+    parts.append(np.column_stack((points[:, 0], points[:, 1], points[:, 0], points[:, 1])))
+    return np.concatenate(parts)
+
+def load_state(state_file: str) -> Dict[str, Any]:
+    """Load the record of the last build, or None."""
+    if state_file and os.path.exists(state_file):
+        with open(state_file, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('version') == STATE_VERSION:
+            return state
+    return None
+
+def save_state(state: Dict[str, Any], state_file: str) -> None:
+    """Write the state atomically."""
+    os.makedirs(os.path.dirname(state_file) or '.', exist_ok=True)
+    temp_file = state_file + '.tmp'
+    with open(temp_file, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_file, state_file)
+
+def build_vector_tiles(input_dir: str, craters_file: str, output_dir: str, max_workers: int = None,
+                       state_file: str = None, digest: Callable[[str], str] = file_digest,
+                       columns: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Bring the tile pyramid in output_dir up to date and return its index. With
+    a state file whose build is still in output_dir, only the tiles touched by
+    changed building tiles or craters are rebuilt; otherwise everything is.
+    Merged building columns may be passed in to skip reading the tile files.
+    """
+    check_output_dir(output_dir)
+    buildings = load_buildings(input_dir, columns)
+    craters = load_craters(craters_file)
+    print(f"Loaded {len(buildings['geometry'])} buildings and {len(craters['lat'])} craters.")
+
+    index_file = os.path.join(output_dir, 'index.json')
+    tile_digests = {(row, col): digest(path) for row, col, path in find_tile_files(input_dir)}
+    state = load_state(state_file)
+    if state is not None and state['index'] is not None and state['index'] == digest(index_file):
+        index = update_pyramid(buildings, craters, output_dir, changed_bounds(state, tile_digests, buildings, craters),
+                               max_workers)
+    else:
+        index = build_pyramid(buildings, craters, output_dir, max_workers)
+
+    if state_file:
+        save_state({
+            'version': STATE_VERSION,
+            'index': digest(index_file),
+            'tiles': {tile: {'digest': tile_digest, 'bounds': buildings['tile_bounds'].get(tile, np.zeros((0, 4)))}
+                      for tile, tile_digest in tile_digests.items()},
+            'craters': crater_rows(craters),
+        }, state_file)
+    return index
+
+def main() -> None:
+    """Main function to run the script."""
+
+    # Determine file paths
+    if len(sys.argv) > 3:
+        input_dir = sys.argv[1]
+        craters_file = sys.argv[2]
+        output_dir = sys.argv[3]
+    else:
+        # Default paths
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        data_dir = os.path.join(os.path.dirname(script_dir), 'data')
+        input_dir = os.path.join(data_dir, 'building-polygons-labeled')
+        craters_file = os.path.join(data_dir, 'all_craters.json')
+        output_dir = os.path.join(data_dir, 'vector-tiles')
+
+    state_file = sys.argv[4] if len(sys.argv) > 4 else None
+
+    print(f"Building vector tiles from {input_dir} and {craters_file}...")
+    try:
+        build_vector_tiles(input_dir, craters_file, output_dir, state_file=state_file)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(f"Vector tiles written to {output_dir}")
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+craters.py
+
+Shared helpers for the crater detections in all_craters.json.
+
+The file is a list of tiles, each with its row, col, bounds and a list of
+craters given as lat, lng and radius (in metres). Craters merged by
+dedupe_craters.py also carry the count of detections they stand for.
+"""
+
+import json
+from typing import Dict
+
+import numpy as np
+
+# Metres per degree of latitude, and of longitude at the equator
+METRES_PER_DEGREE = 111320.0
+
+def load_craters(craters_file: str) -> Dict[str, np.ndarray]:
+    """
+    Flatten all_craters.json into lat/lon/radius/count/row/col arrays.
+    """
+    with open(craters_file, 'r', encoding='utf-8') as f:
+        tiles = json.load(f)
+
+    records = [
+        (crater['lat'], crater['lng'], crater['radius'], crater.get('count', 1), tile['row'], tile['col'])
+        for tile in tiles
+        for crater in tile.get('craters', [])
+    ]
+    values = np.asarray(records, dtype=np.float64).reshape(-1, 6)
+    return {
+        'lat': values[:, 0],
+        'lon': values[:, 1],
+        'radius': values[:, 2],
+        'count': values[:, 3].astype(np.int64),
+        'row': values[:, 4].astype(np.int64),
+        'col': values[:, 5].astype(np.int64),
+    }
+
+def to_local_metres(lon: np.ndarray, lat: np.ndarray, origin_lat: float) -> np.ndarray:
+    """
+    Project lon/lat to an equirectangular x/y plane in metres around origin_lat.
+    Accurate to well under a percent over the few kilometres of one area.
+    """
+    scale_x = METRES_PER_DEGREE * np.cos(np.radians(origin_lat))
+    return np.column_stack((np.asarray(lon) * scale_x, np.asarray(lat) * METRES_PER_DEGREE))
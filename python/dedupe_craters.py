@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+dedupe_craters.py
+
+This script merges near-duplicate crater detections in all_craters.json.
+
+The same crater is often detected twice, either by the detector itself or by two
+neighbouring tiles whose edges overlap. Two detections are treated as the same
+crater when their centers are closer than MERGE_DISTANCE_FACTOR x the smaller
+radius. Candidate pairs come from a spatial hash on a metre grid sized by the
+median radius, with the larger craters hashed again on coarser grids, so the
+pass stays near-linear in the number of detections however skewed the radii
+are. Pairs are joined into clusters with a vectorized union-find.
+
+Each cluster becomes one crater at the count-weighted mean center and radius of
+its detections, with a "count" of the detections it stands for. Merged craters
+are filed under the tile of their first detection. Running the script again
+on its own output leaves it unchanged.
+
+Usage:
+    python dedupe_craters.py [input_file] [output_file]
+    python dedupe_craters.py --in-place [input_file]
+
+By default the merged craters are written to all_craters_deduped.json next to
+the input. --in-place replaces the input instead, together with the per-tile
+craters_row_R_col_C.json files in building-polygons-labeled/ beside it, so
+the two copies of the detections stay in sync.
+"""
+
+import json
+import os
+import sys
+from typing import Dict, List, Tuple, Any
+
+import numpy as np
+
+from craters import load_craters, to_local_metres
+
+# Detections closer than this many times the smaller radius are the same crater
+MERGE_DISTANCE_FACTOR = 1.0
+
+def find_duplicate_pairs(xy: np.ndarray, radius: np.ndarray,
+                         merge_factor: float = MERGE_DISTANCE_FACTOR) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return index arrays (i, j) of all detection pairs that should be merged.
+
+    Detections are hashed into square cells as wide as the median merge
+    distance. A pair can only merge within the smaller of its two merge
+    distances, so every pair with at least one detection at or below the
+    median lies in the same or adjacent cells. Each cell is paired with itself
+    and four of its neighbours to visit every pair of cells once. Pairs of
+    larger detections are found by hashing those detections again, on a grid
+    sized by their own median, so one huge crater cannot collapse the grid
+    into a handful of crowded cells.
+    """
+    if len(xy) < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    cell_size = max(float(merge_factor * np.median(radius)), 1e-9)
+    large = merge_factor * radius > cell_size
+    cells = np.floor((xy - xy.min(axis=0)) / cell_size).astype(np.int64)
+    width = int(cells[:, 0].max()) + 3
+    keys = (cells[:, 1] + 1) * width + (cells[:, 0] + 1)
+
+    # Work in key order so every neighbour lookup is a sorted, cache-friendly search
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    first, second = [], []
+    for dx, dy in ((0, 0), (1, 0), (-1, 1), (0, 1), (1, 1)):
+        neighbour = sorted_keys + dy * width + dx
+        lo = np.searchsorted(sorted_keys, neighbour, side='left')
+        hi = np.searchsorted(sorted_keys, neighbour, side='right')
+        counts = hi - lo
+        i = np.repeat(np.arange(len(xy)), counts)
+        j = np.arange(counts.sum()) + np.repeat(lo - np.cumsum(counts) + counts, counts)
+        if dx == 0 and dy == 0:
+            keep = i < j
+            i, j = i[keep], j[keep]
+        first.append(order[i])
+        second.append(order[j])
+
+    i = np.concatenate(first)
+    j = np.concatenate(second)
+    distance = np.hypot(*(xy[i] - xy[j]).T)
+    close = distance < merge_factor * np.minimum(radius[i], radius[j])
+    # Pairs of two large detections may be further apart than one cell; they
+    # are all found below, so drop the ones seen here to avoid duplicates
+    close &= ~(large[i] & large[j])
+    i, j = i[close], j[close]
+
+    # At least the smallest detection is never large, so this terminates
+    if np.count_nonzero(large) > 1:
+        index = np.flatnonzero(large)
+        large_i, large_j = find_duplicate_pairs(xy[index], radius[index], merge_factor)
+        i = np.concatenate((i, index[large_i]))
+        j = np.concatenate((j, index[large_j]))
+    return i, j
+
+def cluster_labels(n: int, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+    """
+    Label the connected components of the graph with edges (i, j).
+    Each component is labeled with its smallest member index.
+    """
+    labels = np.arange(n)
+    while True:
+        previous = labels.copy()
+        smaller = np.minimum(labels[i], labels[j])
+        np.minimum.at(labels, i, smaller)
+        np.minimum.at(labels, j, smaller)
+        # Pointer jumping collapses chains in a logarithmic number of rounds
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return labels
+
+def merge_craters(craters: Dict[str, np.ndarray], labels: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Merge the detections of each cluster into one crater.
+    """
+    roots, inverse = np.unique(labels, return_inverse=True)
+    weight = craters['count'].astype(np.float64)
+    total = np.bincount(inverse, weights=weight)
+
+    def weighted_mean(values: np.ndarray) -> np.ndarray:
+        return np.bincount(inverse, weights=values * weight) / total
+
+    return {
+        'lat': weighted_mean(craters['lat']),
+        'lon': weighted_mean(craters['lon']),
+        'radius': weighted_mean(craters['radius']),
+        'count': total.astype(np.int64),
+        'row': craters['row'][roots],
+        'col': craters['col'][roots],
+    }
+
+def dedupe_craters(craters: Dict[str, np.ndarray],
+                   merge_factor: float = MERGE_DISTANCE_FACTOR) -> Dict[str, np.ndarray]:
+    """
+    Cluster and merge duplicate detections.
+    """
+    if not len(craters['lat']):
+        return craters
+    origin_lat = float(np.mean(craters['lat']))
+    xy = to_local_metres(craters['lon'], craters['lat'], origin_lat)
+    i, j = find_duplicate_pairs(xy, craters['radius'], merge_factor)
+    labels = cluster_labels(len(xy), i, j)
+    return merge_craters(craters, labels)
+
+def build_tile_entries(tiles: List[Dict[str, Any]], craters: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    """
+    Put the merged craters back into the per-tile layout of all_craters.json,
+    keeping every original tile entry and its bounds.
+    """
+    entries = {(tile['row'], tile['col']): dict(tile, craters=[]) for tile in tiles}
+    for lat, lon, radius, count, row, col in zip(
+        craters['lat'].tolist(), craters['lon'].tolist(), craters['radius'].tolist(),
+        craters['count'].tolist(), craters['row'].tolist(), craters['col'].tolist()
+    ):
+        crater = {'lat': lat, 'lng': lon, 'radius': radius}
+        if count > 1:
+            crater['count'] = count
+        entries[(row, col)]['craters'].append(crater)
+    return list(entries.values())
+
+def write_craters(entries: List[Dict[str, Any]], output_file: str, tiles_dir: str = None) -> None:
+    """
+    Write the tile entries to output_file, and when tiles_dir is given also to
+    the per-tile craters_row_R_col_C.json files in it. Every file is written to
+    a temporary file and renamed into place.
+    """
+    outputs = [(entries, output_file)]
+    if tiles_dir is not None:
+        outputs = [
+            (entry, os.path.join(tiles_dir, f"craters_row_{entry['row']}_col_{entry['col']}.json"))
+            for entry in entries
+        ] + outputs
+    for data, path in outputs:
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, path)
+
+def main() -> None:
+    """Main function to run the script."""
+
+    # Determine file paths; --in-place replaces the input and the per-tile files
+    args = [arg for arg in sys.argv[1:] if arg != '--in-place']
+    in_place = len(args) != len(sys.argv) - 1
+    if args:
+        input_file = args[0]
+    else:
+        # Default path
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        data_dir = os.path.join(os.path.dirname(script_dir), 'data')
+        input_file = os.path.join(data_dir, 'all_craters.json')
+    tiles_dir = None
+    if in_place:
+        output_file = input_file
+        tiles_dir = os.path.join(os.path.dirname(os.path.abspath(input_file)), 'building-polygons-labeled')
+    elif len(args) > 1:
+        output_file = args[1]
+    else:
+        output_file = os.path.join(os.path.dirname(os.path.abspath(input_file)), 'all_craters_deduped.json')
+
+    print(f"Reading craters from {input_file}...")
+    with open(input_file, 'r', encoding='utf-8') as f:
+        tiles = json.load(f)
+    craters = load_craters(input_file)
+    print(f"Found {len(craters['lat'])} detections in {len(tiles)} tiles.")
+
+    merged = dedupe_craters(craters)
+    print(f"Merged into {len(merged['lat'])} craters "
+          f"({len(craters['lat']) - len(merged['lat'])} duplicates removed).")
+
+    print(f"Saving deduplicated craters to {output_file}...")
+    if tiles_dir is not None:
+        print(f"Updating the per-tile crater files in {tiles_dir}...")
+    write_craters(build_tile_entries(tiles, merged), output_file, tiles_dir)
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+diff_snapshots.py
+
+This script compares two labeling rounds of the building tiles, e.g. labels
+made on the 2022 and the 2023 imagery, and reports what changed.
+
+Both snapshots are directories of buildings_row_{r}_col_{c}.geojson files.
+Each tile is compared with a hash join on the building 'id' property:
+    build   the old tile is streamed into a dict of id -> (damaged, centroid)
+    probe   the new tile is streamed feature by feature and looked up in it
+A building present in both with a different damage label is newly damaged or
+repaired; one only in the new tile is added, and one only in the old tile is
+removed. A building counts as damaged when is_damaged or is_damaged_labeled is
+"True". Only one tile of the old snapshot is held in memory per worker, never
+the snapshots themselves, and tiles are compared in parallel in a process pool.
+Buildings are joined within their tile, so one filed under a different tile in
+the two rounds shows up as removed there and added here.
+
+The output is a compact GeoJSON FeatureCollection of one Point per change, at
+the centroid of the building's outer ring, with id, change, row and col
+properties, ready to overlay with L.geoJSON. Top-level members hold the
+totals per change type and a tiles list of
+[row, col, newly_damaged, repaired, added, removed, unchanged].
+
+Usage:
+    python diff_snapshots.py OLD_DIR NEW_DIR [output.geojson[.gz]]
+"""
+
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, Any
+
+import numpy as np
+
+from build_building_bundle import find_tile_files, iter_polygons
+from build_heatmap_points import DAMAGED_VALUE, ring_centroids
+from geojson_writer import GeoJSONWriter
+from strip_geojson import iter_features
+
+CHANGE_TYPES = ('newly_damaged', 'repaired', 'added', 'removed')
+
+def feature_id(feature: Dict[str, Any]) -> Any:
+    """The building id, from the 'id' property or else the feature id."""
+    properties = feature.get('properties') or {}
+    return properties.get('id', feature.get('id'))
+
+def is_damaged(feature: Dict[str, Any]) -> bool:
+    """True when either damage label of the feature is set."""
+    properties = feature.get('properties') or {}
+    return properties.get('is_damaged') == DAMAGED_VALUE or properties.get('is_damaged_labeled') == DAMAGED_VALUE
+
+def outer_ring(feature: Dict[str, Any]) -> List[List[float]]:
+    """The outer ring of the feature's first polygon, or None without geometry."""
+    polygons = iter_polygons(feature.get('geometry'))
+    return polygons[0][0] if polygons and polygons[0] and polygons[0][0] else None
+
+def centroids(rings: List[List[List[float]]]) -> np.ndarray:
+    """Centroids of the given rings (NaN for missing ones), computed together."""
+    result = np.full((len(rings), 2), np.nan)
+    present = [i for i, ring in enumerate(rings) if ring is not None]
+    if present:
+        lengths = np.asarray([len(rings[i]) for i in present], dtype=np.int64)
+        coords = np.asarray([point[:2] for i in present for point in rings[i]], dtype=np.float64)
+        ends = np.cumsum(lengths)
+        result[present] = ring_centroids(coords, ends - lengths, ends)
+    return result
+
+def diff_tile(task: Tuple[int, int, str, str]) -> Tuple[int, int, List[int], List[Tuple[Any, str, float, float]]]:
+    """
+    Compare one tile of the two snapshots; either path may be None.
+    Returns (row, col, counts, changes) with counts in CHANGE_TYPES order plus
+    unchanged, and changes as (id, change, lon, lat).
+    """
+    row, col, old_path, new_path = task
+
+    # Build: hash the old tile on id, keeping only what a change record needs
+    old: Dict[Any, Tuple[bool, List[List[float]]]] = {}
+    if old_path:
+        for feature in iter_features(old_path):
+            old[feature_id(feature)] = (is_damaged(feature), outer_ring(feature))
+
+    # Probe: stream the new tile and match every feature against the old one
+    ids: List[Any] = []
+    kinds: List[str] = []
+    rings: List[List[List[float]]] = []
+    unchanged = 0
+    if new_path:
+        for feature in iter_features(new_path):
+            building_id = feature_id(feature)
+            damaged = is_damaged(feature)
+            match = old.pop(building_id, None)
+            if match is None:
+                kind = 'added'
+            elif damaged == match[0]:
+                unchanged += 1
+                continue
+            else:
+                kind = 'newly_damaged' if damaged else 'repaired'
+            ids.append(building_id)
+            kinds.append(kind)
+            rings.append(outer_ring(feature))
+
+    # Whatever the new tile did not match was removed
+    for building_id, (_, ring) in old.items():
+        ids.append(building_id)
+        kinds.append('removed')
+        rings.append(ring)
+
+    points = centroids(rings)
+    counts = [kinds.count(kind) for kind in CHANGE_TYPES] + [unchanged]
+    changes = [(building_id, kind, float(lon), float(lat))
+               for building_id, kind, (lon, lat) in zip(ids, kinds, points.tolist())]
+    return row, col, counts, changes
+
+def diff_snapshots(old_dir: str, new_dir: str, output_file: str, max_workers: int = None) -> Dict[str, int]:
+    """
+    Compare every tile of two snapshot directories and write the change file.
+    Returns the total count per change type.
+    """
+    old_tiles = {(row, col): path for row, col, path in find_tile_files(old_dir)}
+    new_tiles = {(row, col): path for row, col, path in find_tile_files(new_dir)}
+    tasks = [(row, col, old_tiles.get((row, col)), new_tiles.get((row, col)))
+             for row, col in sorted(old_tiles.keys() | new_tiles.keys())]
+
+    totals = dict.fromkeys(CHANGE_TYPES + ('unchanged',), 0)
+    tile_counts = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool, GeoJSONWriter(output_file) as writer:
+        chunksize = max(1, len(tasks) // (4 * (os.cpu_count() or 1)))
+        for row, col, counts, changes in pool.map(diff_tile, tasks, chunksize=chunksize):
+            for building_id, kind, lon, lat in changes:
+                geometry = None if np.isnan(lon) else {'type': 'Point', 'coordinates': [lon, lat]}
+                writer.write_feature({
+                    'type': 'Feature',
+                    'properties': {'id': building_id, 'change': kind, 'row': row, 'col': col},
+                    'geometry': geometry,
+                })
+            for name, count in zip(totals, counts):
+                totals[name] += count
+            if any(counts[:len(CHANGE_TYPES)]):
+                tile_counts.append([row, col] + counts)
+        writer.write_member('totals', totals)
+        writer.write_member('tiles', tile_counts)
+    return totals
+
+def main() -> None:
+    """Main function to run the script."""
+    if len(sys.argv) < 3:
+        print(f"Usage: python {os.path.basename(__file__)} OLD_DIR NEW_DIR [output.geojson[.gz]]")
+        sys.exit(1)
+    old_dir, new_dir = sys.argv[1:3]
+    if len(sys.argv) > 3:
+        output_file = sys.argv[3]
+    else:
+        # Default path
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        output_file = os.path.join(os.path.dirname(script_dir), 'data', 'label_changes.geojson')
+
+    print(f"Comparing {old_dir} with {new_dir}...")
+    totals = diff_snapshots(old_dir, new_dir, output_file)
+    print(', '.join(f"{count} {name.replace('_', ' ')}" for name, count in totals.items()))
+    print(f"Saved changes to {output_file}.")
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
@@ -10,35 +10,43 @@ row,col,lat_center,lon_center,url,lat_min,lat_max,lon_min,lon_max
 
 The output is a GeoJSON file containing a single polygon feature that represents
 the outer boundary of the entire dataset.
+
+By default the perimeter is traced on a NumPy occupancy grid whose lines are
+the tiles' own edge coordinates, stored as runs of covered lon per band of
+lat. It is the exact union of the tiles, including staggered or arbitrarily
+offset rows, concave footprints, holes and corner-touching tiles, always as
+valid geometry, and scales to millions of tiles. Pass --legacy to use the
+original perimeter-tile walker instead.
+
+The CSV is read through tile_index, which compiles it once into a
+memory-mapped binary next to it, so later runs start with one mmap. The
+perimeter is written compactly by geojson_writer, with coordinates quantized
+to 7 decimals and no vertices along straight edges; pass --gzip to compress.
 """
 
-import csv
-import json
 import os
 import sys
 from typing import Dict, List, Tuple, Any, Set
 
+import numpy as np
+
+from dedupe_craters import cluster_labels
+from geojson_writer import DEFAULT_DECIMALS, write_feature_collection
+from spans import span
+from tile_index import load_tile_index
+
+# Edge directions on the occupancy grid, counter-clockwise in (lon, lat) space
+EAST, NORTH, WEST, SOUTH = 0, 1, 2, 3
+# Tile edges closer than this are one grid line, so quantizing the output to
+# DEFAULT_DECIMALS can never collapse two of them into a zero-width sliver
+SNAP_TOLERANCE = 10.0 ** -DEFAULT_DECIMALS
+
 def read_tile_bounds(csv_file: str) -> List[Dict[str, Any]]:
     """
-    Read the tile bounds from the CSV file.
+    Read the tile bounds through the compiled tile index of the CSV file.
     Returns a list of tile information.
     """
-    tiles = []
-    with open(csv_file, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            tile = {
-                'row': int(row['row']),
-                'col': int(row['col']),
-                'lat_center': float(row['lat_center']),
-                'lon_center': float(row['lon_center']),
-                'lat_min': float(row['lat_min']),
-                'lat_max': float(row['lat_max']),
-                'lon_min': float(row['lon_min']),
-                'lon_max': float(row['lon_max'])
-            }
-            tiles.append(tile)
-    return tiles
+    return load_tile_index(csv_file).to_dicts()
 
 def find_min_max_extents(tiles: List[Dict[str, Any]]) -> Tuple[int, int, int, int]:
     """Find minimum and maximum row/column indices"""
@@ -213,62 +221,402 @@ def add_intermediate_vertices(points: List[Tuple[float, float]]) -> List[Tuple[f
     
     return fixed_points
 
-def create_geojson(polygon: List[Tuple[float, float]], output_file: str) -> None:
-    """
-    Create a GeoJSON file containing the polygon.
-    """
-    geojson = {
-        "type": "FeatureCollection",
-        "features": [
-            {
-                "type": "Feature",
-                "properties": {
-                    "name": "Dataset Perimeter",
-                    "description": "Outer boundary of the dataset region"
-                },
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": [polygon]  # GeoJSON uses [lon, lat] order
-                }
-            }
-        ]
+def tiles_to_arrays(tiles: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """
+    Convert the list of tile dicts into column arrays keyed like the CSV headers.
+    """
+    count = len(tiles)
+    arrays = {
+        'row': np.fromiter((tile['row'] for tile in tiles), dtype=np.int64, count=count),
+        'col': np.fromiter((tile['col'] for tile in tiles), dtype=np.int64, count=count),
+    }
+    for key in ('lat_min', 'lat_max', 'lon_min', 'lon_max'):
+        arrays[key] = np.fromiter((tile[key] for tile in tiles), dtype=np.float64, count=count)
+    return arrays
+
+def snap_coordinates(values: np.ndarray, tolerance: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merge coordinates that lie within tolerance of their neighbour into one.
+    Returns the sorted distinct coordinates and the index of every value in them.
+    """
+    unique, inverse = np.unique(values, return_inverse=True)
+    new_run = np.ones(unique.size, dtype=bool)
+    new_run[1:] = np.diff(unique) > tolerance
+    run = np.cumsum(new_run) - 1
+    return unique[new_run], run[inverse.ravel()]
+
+def build_occupancy_grid(arrays: Dict[str, np.ndarray], tolerance: float = SNAP_TOLERANCE) -> Dict[str, np.ndarray]:
+    """
+    Rasterize the tiles into runs of occupied cells, one band at a time.
+
+    Every distinct lat_min/lat_max is a grid line across, and each band between
+    two of them is cut only by the lon_min/lon_max of the tiles spanning it, so
+    a run is a maximal stretch of lon that tiles cover within one band. Tiles
+    that share edges, overlap or are staggered merge exactly, and the grid
+    stores a few runs per band rather than every band times every distinct
+    lon, which stays small even when each row is offset by its own fraction of
+    a tile. Bands run north to south like the tile rows. Returns the band and
+    the start and stop lon line of every run, sorted by band and start, and
+    the lon and lat of every grid line.
+    """
+    count = arrays['row'].size
+    lon, lon_index = snap_coordinates(np.concatenate((arrays['lon_min'], arrays['lon_max'])), tolerance)
+    lat, lat_index = snap_coordinates(np.concatenate((arrays['lat_min'], arrays['lat_max'])), tolerance)
+    west, east = lon_index[:count], lon_index[count:]
+    top = lat.size - 1 - lat_index[count:]
+    bottom = lat.size - 1 - lat_index[:count]
+    # Tiles narrower than the tolerance collapse and cover nothing
+    keep = (east > west) & (bottom > top)
+    west, east, top, bottom = west[keep], east[keep], top[keep], bottom[keep]
+
+    # One piece per tile and band it spans
+    spans = bottom - top
+    first_piece = np.cumsum(spans) - spans
+    band = np.repeat(top - first_piece, spans) + np.arange(int(spans.sum()))
+    west, east = np.repeat(west, spans), np.repeat(east, spans)
+
+    # Sorted by band and west, a piece starts a new run unless it overlaps or
+    # touches the furthest east reached so far in its band
+    order = np.lexsort((west, band))
+    band, west, east = band[order], west[order], east[order]
+    stride = lon.size
+    reach = np.maximum.accumulate(band * stride + east) - band * stride
+    new_run = np.ones(band.size, dtype=bool)
+    new_run[1:] = (band[1:] != band[:-1]) | (west[1:] > reach[:-1])
+    first = np.flatnonzero(new_run)
+    last = np.append(first[1:], band.size) - 1
+
+    return {
+        'band': band[first],
+        'start': west[first],
+        'stop': reach[last],
+        'lon': lon,
+        'lat': lat[::-1],
+    }
+
+def covering_runs(grid: Dict[str, np.ndarray], band: np.ndarray, lon_index: np.ndarray) -> np.ndarray:
+    """The run of each band that covers the cell east of each lon line, or -1."""
+    stride = grid['lon'].size
+    run = np.searchsorted(grid['band'] * stride + grid['start'], band * stride + lon_index, side='right') - 1
+    candidate = np.maximum(run, 0)
+    covered = (run >= 0) & (grid['band'][candidate] == band) & (lon_index < grid['stop'][candidate])
+    return np.where(covered, run, -1)
+
+def find_boundary_edges(grid: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Find every boundary edge of the occupied runs with vectorized searches.
+
+    Each edge is directed so that the occupied cell lies on its left, which makes
+    outer rings counter-clockwise and holes clockwise. The ends of every run are
+    vertical edges; along every grid line, each stretch between run ends that
+    is covered on one side only is a horizontal edge, so edges meet only at
+    their end points. Vertex (line, j) lies on grid line line at lon line j;
+    vertices are numbered compactly and every edge keeps the run it bounds.
+    """
+    band, start, stop = grid['band'], grid['start'], grid['stop']
+    stride = grid['lon'].size
+    runs = np.arange(band.size)
+
+    # Cut every grid line at the run ends of the bands on both sides of it
+    cuts = np.unique(np.concatenate((band, band, band + 1, band + 1)) * stride
+                     + np.concatenate((start, stop, start, stop)))
+    line, cut = np.divmod(cuts, stride)
+    same_line = line[1:] == line[:-1]
+    line, west, east = line[:-1][same_line], cut[:-1][same_line], cut[1:][same_line]
+    above = covering_runs(grid, line - 1, west)
+    below = covering_runs(grid, line, west)
+    top_side = (below >= 0) & (above < 0)
+    bottom_side = (above >= 0) & (below < 0)
+
+    sides = (
+        # top edge, right to left
+        (WEST, below[top_side], line[top_side], east[top_side], line[top_side], west[top_side]),
+        # bottom edge, left to right
+        (EAST, above[bottom_side], line[bottom_side], west[bottom_side], line[bottom_side], east[bottom_side]),
+        # left end of a run, top to bottom
+        (SOUTH, runs, band, start, band + 1, start),
+        # right end of a run, bottom to top
+        (NORTH, runs, band + 1, stop, band, stop),
+    )
+
+    owner_run, direction, start_key, end_key = [], [], [], []
+    for side, run, start_line, start_lon, end_line, end_lon in sides:
+        owner_run.append(run)
+        direction.append(np.full(run.size, side, dtype=np.int8))
+        start_key.append(start_line * stride + start_lon)
+        end_key.append(end_line * stride + end_lon)
+
+    vertex_keys, vertex = np.unique(np.concatenate(start_key + end_key), return_inverse=True)
+    vertex = vertex.ravel()
+    vertex_line, vertex_lon = np.divmod(vertex_keys, stride)
+    edge_count = vertex.size // 2
+    return {
+        'run': np.concatenate(owner_run),
+        'direction': np.concatenate(direction),
+        'start': vertex[:edge_count],
+        'end': vertex[edge_count:],
+        'vertex_count': np.int64(vertex_keys.size),
+        'vertex_line': vertex_line,
+        'vertex_lon': vertex_lon,
+    }
+
+def link_boundary_edges(edges: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Compute the successor of every boundary edge along its ring.
+
+    A grid vertex has one outgoing edge, or two at a saddle, where occupied
+    cells touch only diagonally. Saddles first take the left turn, which keeps
+    hugging the same cell so diagonal neighbours end up in separate rings. If
+    both passes through a saddle still land on one ring, the two cells are
+    connected some other way and that ring is pinched at the vertex, which is
+    not a valid polygon ring. Those saddles take the right turn instead, which
+    splits the ring into an outer ring and a hole that touch at the vertex.
+    """
+    start = edges['start']
+    end = edges['end']
+    direction = edges['direction']
+
+    order = np.argsort(start, kind='stable')
+    sorted_start = start[order]
+    first = np.ones(order.size, dtype=bool)
+    first[1:] = sorted_start[1:] != sorted_start[:-1]
+
+    out_a = np.full(int(edges['vertex_count']), -1, dtype=np.int64)
+    out_b = np.full(int(edges['vertex_count']), -1, dtype=np.int64)
+    out_a[sorted_start[first]] = order[first]
+    out_b[sorted_start[~first]] = order[~first]
+
+    a = out_a[end]
+    b = out_b[end]
+    left_turn = (direction + 1) % 4
+    successor = np.where((b < 0) | (direction[a] == left_turn), a, b)
+
+    # The two edges entering each saddle vertex, side by side
+    entering = np.flatnonzero(b >= 0)
+    if entering.size:
+        entering = entering[np.argsort(end[entering], kind='stable')].reshape(-1, 2)
+        ordered, offsets = trace_rings(successor)
+        ring_of_edge = ring_membership(ordered, offsets)
+        pinched = entering[ring_of_edge[entering[:, 0]] == ring_of_edge[entering[:, 1]]].ravel()
+        successor[pinched] = np.where(successor[pinched] == a[pinched], b[pinched], a[pinched])
+    return successor
+
+def trace_rings(successor: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Walk the successor permutation once, returning the edges in ring order and
+    the start offset of each ring (plus a final end offset).
+    """
+    successor_list = successor.tolist()
+    visited = bytearray(len(successor_list))
+    ordered: List[int] = []
+    offsets = [0]
+
+    for first_edge in range(len(successor_list)):
+        if visited[first_edge]:
+            continue
+        edge = first_edge
+        while not visited[edge]:
+            visited[edge] = 1
+            ordered.append(edge)
+            edge = successor_list[edge]
+        offsets.append(len(ordered))
+
+    return np.asarray(ordered, dtype=np.int64), np.asarray(offsets, dtype=np.int64)
+
+def ring_membership(ordered: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """The index of the ring every edge belongs to."""
+    ring_of_edge = np.empty(ordered.size, dtype=np.int64)
+    ring_of_edge[ordered] = np.repeat(np.arange(offsets.size - 1), np.diff(offsets))
+    return ring_of_edge
+
+def rings_to_coordinates(grid: Dict[str, np.ndarray], edges: Dict[str, np.ndarray],
+                         successor: np.ndarray, ordered: np.ndarray,
+                         offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Map the traced rings back to lon/lat.
+
+    Only the vertices where a ring turns are kept, at the lon and lat of their
+    grid lines, so straight runs collapse to their end points.
+    """
+    direction = edges['direction'][ordered]
+    turn = direction != edges['direction'][successor[ordered]]
+    vertex = edges['end'][ordered[turn]]
+    vertex_offsets = np.concatenate(([0], np.cumsum(turn)))[offsets]
+    return grid['lon'][edges['vertex_lon'][vertex]], grid['lat'][edges['vertex_line'][vertex]], vertex_offsets
+
+def run_components(grid: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Label the connected components of the runs. Runs of neighbouring bands
+    belong together when they share a stretch of lon, not just an end point.
+    """
+    band, start, stop = grid['band'], grid['start'], grid['stop']
+    stride = grid['lon'].size
+    # The runs of the band above that overlap each run form one contiguous slice
+    first = np.searchsorted(band * stride + stop, (band - 1) * stride + start, side='right')
+    last = np.searchsorted(band * stride + start, (band - 1) * stride + stop, side='left')
+    counts = np.maximum(last - first, 0)
+    below = np.repeat(np.arange(band.size), counts)
+    above = np.repeat(first - (np.cumsum(counts) - counts), counts) + np.arange(int(counts.sum()))
+    return cluster_labels(band.size, below, above)
+
+def classify_rings(grid: Dict[str, np.ndarray], edges: Dict[str, np.ndarray],
+                   ordered: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Return, for every ring, -1 if it is an outer ring or the index of the outer
+    ring that encloses it if it is a hole.
+
+    Orientation comes from the signed area in grid-line space. Every ring
+    bounds the runs of a single connected component, which has exactly one
+    outer ring, so a hole's parent is the outer ring of its component.
+    """
+    ring_count = offsets.size - 1
+    ring_of_edge = ring_membership(ordered, offsets)
+
+    # Shoelace over grid-line indices, x = lon line, y = -lat line
+    x = edges['vertex_lon']
+    y = -edges['vertex_line']
+    start, end = edges['start'], edges['end']
+    cross = (x[start] * y[end] - x[end] * y[start]).astype(np.float64)
+    is_hole = np.bincount(ring_of_edge, weights=cross, minlength=ring_count) < 0
+
+    parent = np.full(ring_count, -1, dtype=np.int64)
+    if not is_hole.any():
+        return parent
+
+    component = run_components(grid)
+    ring_component = np.empty(ring_count, dtype=np.int64)
+    ring_component[ring_of_edge] = component[edges['run']]
+    outer_ring = np.full(grid['band'].size, -1, dtype=np.int64)
+    outer_ring[ring_component[~is_hole]] = np.flatnonzero(~is_hole)
+    parent[is_hole] = outer_ring[ring_component[is_hole]]
+    return parent
+
+def extract_perimeter_rings(arrays: Dict[str, np.ndarray],
+                            tolerance: float = SNAP_TOLERANCE) -> List[List[List[Tuple[float, float]]]]:
+    """
+    Trace every closed ring of the tile footprint on the occupied runs of the grid.
+
+    Unlike extract_perimeter_from_tiles this follows concave footprints exactly and
+    also returns holes. The result is a list of polygons, each a list of rings in
+    GeoJSON order (outer ring first, then its holes), with closed [lon, lat] rings.
+    It is the exact union of the tiles with edges snapped to tolerance, and a
+    valid (Multi)Polygon: tiles that touch only at a corner become separate
+    polygons, and a hole that touches its outer ring at a corner stays a hole.
+    """
+    if arrays['row'].size == 0:
+        return []
+    with span('extract_perimeter.occupancy_grid', tiles=arrays['row'].size):
+        grid = build_occupancy_grid(arrays, tolerance)
+    if not grid['band'].size:
+        return []
+    with span('extract_perimeter.boundary_edges') as edge_span:
+        edges = find_boundary_edges(grid)
+        successor = link_boundary_edges(edges)
+        edge_span.count(edges=successor.size)
+    with span('extract_perimeter.trace_rings') as ring_span:
+        ordered, offsets = trace_rings(successor)
+        lon, lat, vertex_offsets = rings_to_coordinates(grid, edges, successor, ordered, offsets)
+        parent = classify_rings(grid, edges, ordered, offsets)
+        ring_span.count(rings=len(parent), vertices=lon.size)
+
+    lon_list = lon.tolist()
+    lat_list = lat.tolist()
+    rings = []
+    for start, stop in zip(vertex_offsets[:-1].tolist(), vertex_offsets[1:].tolist()):
+        ring = list(zip(lon_list[start:stop], lat_list[start:stop]))
+        ring.append(ring[0])
+        rings.append(ring)
+
+    polygons: Dict[int, List[List[Tuple[float, float]]]] = {}
+    for index, ring in enumerate(rings):
+        if parent[index] < 0:
+            polygons[index] = [ring]
+    for index, ring in enumerate(rings):
+        if parent[index] >= 0:
+            polygons[int(parent[index])].append(ring)
+    return list(polygons.values())
+
+def perimeter_geometry(polygons: List[List[List[Tuple[float, float]]]]) -> Dict[str, Any]:
+    """
+    Wrap traced polygons as a GeoJSON Polygon, or a MultiPolygon if there are several.
+    """
+    if len(polygons) == 1:
+        return {"type": "Polygon", "coordinates": polygons[0]}
+    return {"type": "MultiPolygon", "coordinates": polygons}
+
+def create_geojson(geometry: Dict[str, Any], output_file: str, decimals: int = DEFAULT_DECIMALS) -> None:
+    """
+    Create a GeoJSON file containing the perimeter geometry.
+
+    Coordinates are quantized to the given decimals and vertices along straight
+    edges are dropped. Output ending in .gz is gzip-compressed.
+    """
+    feature = {
+        "type": "Feature",
+        "properties": {
+            "name": "Dataset Perimeter",
+            "description": "Outer boundary of the dataset region"
+        },
+        "geometry": geometry  # GeoJSON uses [lon, lat] order
     }
     
-    with open(output_file, 'w') as f:
-        json.dump(geojson, f, indent=2)
+    with span('extract_perimeter.write_geojson'):
+        write_feature_collection(output_file, [feature], decimals)
 
 def main() -> None:
     """Main function to run the script."""
     
-    # Determine file paths
-    if len(sys.argv) > 2:
-        input_csv = sys.argv[1]
-        output_geojson = sys.argv[2]
+    # Determine file paths; --legacy selects the original edge walker, --gzip compresses the output
+    args = [arg for arg in sys.argv[1:] if arg not in ('--legacy', '--gzip')]
+    use_legacy = '--legacy' in sys.argv[1:]
+    use_gzip = '--gzip' in sys.argv[1:]
+    if len(args) > 1:
+        input_csv = args[0]
+        output_geojson = args[1]
     else:
         # Default paths
         script_dir = os.path.dirname(os.path.abspath(__file__))
         data_dir = os.path.join(os.path.dirname(script_dir), 'data')
         input_csv = os.path.join(data_dir, 'tile_bounds_coords_adj.csv')
         output_geojson = os.path.join(data_dir, 'dataset_perimeter.geojson')
+    if use_gzip and not output_geojson.endswith('.gz'):
+        output_geojson += '.gz'
     
     print(f"Reading tile bounds from {input_csv}...")
-    tiles = read_tile_bounds(input_csv)
-    print(f"Found {len(tiles)} tiles.")
-    
-    print("Identifying perimeter tiles...")
-    perimeter_tiles = find_perimeter_tiles(tiles)
-    print(f"Found {len(perimeter_tiles)} perimeter tiles.")
-    
-    print("Extracting perimeter coordinates...")
-    perimeter = extract_perimeter_from_tiles(perimeter_tiles)
-    print(f"Generated perimeter with {len(perimeter)} points.")
+    with span('extract_perimeter.read_tiles') as read_span:
+        index = load_tile_index(input_csv)
+        read_span.count(tiles=len(index))
+    print(f"Found {len(index)} tiles.")
     
-    if not perimeter:
-        print("ERROR: Failed to create perimeter!")
-        return
+    if use_legacy:
+        print("Identifying perimeter tiles...")
+        with span('extract_perimeter.find_perimeter_tiles', tiles=len(index)):
+            perimeter_tiles = find_perimeter_tiles(index.to_dicts())
+        print(f"Found {len(perimeter_tiles)} perimeter tiles.")
+        
+        print("Extracting perimeter coordinates...")
+        with span('extract_perimeter.walk_perimeter', tiles=len(perimeter_tiles)):
+            perimeter = extract_perimeter_from_tiles(perimeter_tiles)
+        print(f"Generated perimeter with {len(perimeter)} points.")
+        
+        if not perimeter:
+            print("ERROR: Failed to create perimeter!")
+            return
+        geometry = {"type": "Polygon", "coordinates": [perimeter]}
+    else:
+        print("Tracing perimeter rings on the occupancy grid...")
+        polygons = extract_perimeter_rings(index.arrays())
+        ring_count = sum(len(polygon) for polygon in polygons)
+        point_count = sum(len(ring) for polygon in polygons for ring in polygon)
+        print(f"Generated {len(polygons)} polygon(s) with {ring_count} ring(s) and {point_count} points.")
+        
+        if not polygons:
+            print("ERROR: Failed to create perimeter!")
+            return
+        geometry = perimeter_geometry(polygons)
     
     print(f"Saving GeoJSON to {output_geojson}...")
-    create_geojson(perimeter, output_geojson)
+    create_geojson(geometry, output_geojson)
     print("Done!")
 
 if __name__ == "__main__":
@@ -1,13 +1,66 @@
-import csv
-import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import shapely
 from shapely.geometry import box, MultiPolygon, Polygon
 from shapely.ops import unary_union
 from shapely.validation import make_valid  # To help clean geometries
 import sys
 import logging  # Using logging for better messages
 
+from extract_perimeter import snap_coordinates
+from geojson_writer import DEFAULT_DECIMALS, write_feature_collection
+from spans import span
+from tile_index import load_tile_index
+
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
+# Lattice spacing (degrees) of fast mode. Tile edges closer than this are first
+# moved onto one coordinate by snap_tile_edges, so they coincide exactly and
+# merge without an epsilon buffer; the union is then computed on this lattice.
+LATTICE_GRID_SIZE = 1e-7
+# The fast-mode perimeter stays within this Hausdorff distance (degrees, ~2 cm)
+# of the buffered perimeter produced by the default mode.
+FAST_MODE_TOLERANCE = 2e-7
+# Below this many tiles per band a process pool costs more than it saves
+MIN_TILES_PER_BAND = 2000
+
+
+def write_perimeter_geojson(final_geom, tile_count, geojson_filepath, decimals=DEFAULT_DECIMALS):
+    """
+    Writes the overall perimeter geometry as a FeatureCollection with one feature.
+
+    The output is compact: coordinates are quantized to decimals and vertices
+    along straight edges are dropped. A path ending in .gz is gzip-compressed.
+
+    Args:
+        final_geom (shapely.Geometry): The (Multi)Polygon perimeter.
+        tile_count (int): Number of tiles that went into the perimeter.
+        geojson_filepath (str): Path for the output GeoJSON file.
+        decimals (int): Decimals kept in the coordinates.
+    """
+    # --- Create GeoJSON Output ---
+    # Now we create a FeatureCollection with only ONE feature: the overall perimeter
+    feature = {
+        "type": "Feature",
+        "geometry": final_geom.__geo_interface__,
+        "properties": {
+            # Add relevant properties, e.g., total original tiles
+            "original_tile_count": tile_count,
+            "description": "Overall perimeter of all tiles" 
+        }
+    }
+    
+    # The FeatureCollection contains just the single overall perimeter feature
+    logging.info(f"Writing GeoJSON output to: {geojson_filepath}")
+    try:
+        with span("extract_perimeter_2.write_geojson", vertices=shapely.get_num_coordinates(final_geom)):
+            write_feature_collection(geojson_filepath, [feature], decimals)
+        logging.info("GeoJSON file created successfully with the overall perimeter.")
+    except Exception as e:
+        logging.error(f"Error writing GeoJSON file: {e}")
+        sys.exit(1)
+
 
 def create_geojson_from_csv_overall_perimeter(csv_filepath, geojson_filepath):
     """
@@ -20,58 +73,13 @@ def create_geojson_from_csv_overall_perimeter(csv_filepath, geojson_filepath):
         geojson_filepath (str): Path for the output GeoJSON file.
     """
 
-    # Store all valid tile geometries in a single list
-    all_tile_geoms = [] 
-    required_headers = {"lat_min", "lat_max", "lon_min", "lon_max"}
     # Buffer amount (1e-7 seemed okay for intra-row merging, should work here too)
     BUFFER_EPSILON = 1e-7 
-    total_tiles_processed = 0 # Keep track of total tiles read
 
-    logging.info(f"Reading CSV file: {csv_filepath}")
-    try:
-        with open(csv_filepath, mode="r", newline="", encoding="utf-8") as infile:
-            reader = csv.DictReader(infile)
-
-            if not required_headers.issubset(reader.fieldnames):
-                missing = required_headers - set(reader.fieldnames)
-                logging.error(f"Missing required columns in CSV: {missing}")
-                sys.exit(1)
-
-            for i, record in enumerate(reader):
-                try:
-                    # Create a Shapely box (polygon) for each tile
-                    tile_geom = box(
-                        float(record["lon_min"]),
-                        float(record["lat_min"]),
-                        float(record["lon_max"]),
-                        float(record["lat_max"]),
-                    )
-                    # Basic check for validity before adding
-                    if not tile_geom.is_valid:
-                        logging.warning(
-                            f"Skipping invalid geometry from CSV row {i+1}: {record}"
-                        )
-                        continue
-                    
-                    # Add the valid geometry to the single list
-                    all_tile_geoms.append(tile_geom) 
-                    total_tiles_processed += 1
-
-                except (ValueError, TypeError) as e:
-                    logging.warning(
-                        f"Skipping CSV row {i+1} due to invalid number format: {e} - Record: {record}"
-                    )
-                except KeyError as e:
-                    logging.warning(
-                        f"Skipping CSV row {i+1} due to missing key: {e} - Record: {record}"
-                    )
-
-    except FileNotFoundError:
-        logging.error(f"Input CSV file not found at {csv_filepath}")
-        sys.exit(1)
-    except Exception as e:
-        logging.error(f"Error reading CSV file: {e}")
-        sys.exit(1)
+    # Create a Shapely box (polygon) for each valid tile
+    _, bounds = read_tile_bounds_arrays(csv_filepath)
+    all_tile_geoms = [box(*tile_bounds) for tile_bounds in bounds.tolist()]
+    total_tiles_processed = len(all_tile_geoms) # Keep track of total tiles read
 
     # Check if any valid geometries were collected
     if not all_tile_geoms:
@@ -93,11 +101,12 @@ def create_geojson_from_csv_overall_perimeter(csv_filepath, geojson_filepath):
 
         # Apply positive buffer individually and clean
         buffered_geoms = []
-        for geom in valid_initial_geoms:
-            buffered = geom.buffer(BUFFER_EPSILON)
-            cleaned_buffered = make_valid(buffered) # Clean after buffering
-            if not cleaned_buffered.is_empty:
-                buffered_geoms.append(cleaned_buffered)
+        with span("extract_perimeter_2.buffer", tiles=len(valid_initial_geoms)):
+            for geom in valid_initial_geoms:
+                buffered = geom.buffer(BUFFER_EPSILON)
+                cleaned_buffered = make_valid(buffered) # Clean after buffering
+                if not cleaned_buffered.is_empty:
+                    buffered_geoms.append(cleaned_buffered)
 
         if not buffered_geoms:
             logging.error("No valid geometries remained after positive buffer, exiting.")
@@ -105,20 +114,25 @@ def create_geojson_from_csv_overall_perimeter(csv_filepath, geojson_filepath):
 
         # 2. Calculate the union of ALL buffered tiles
         logging.info("Performing unary union...")
-        unioned_geom = unary_union(buffered_geoms)
+        with span("extract_perimeter_2.union", tiles=len(buffered_geoms)) as union_span:
+            unioned_geom = unary_union(buffered_geoms)
+            union_span.count(vertices=shapely.get_num_coordinates(unioned_geom))
         logging.info("Union complete. Cleaning geometry...")
 
         # Clean the unioned geometry
-        unioned_geom = make_valid(unioned_geom.buffer(0)) 
+        with span("extract_perimeter_2.clean"):
+            unioned_geom = make_valid(unioned_geom.buffer(0)) 
         logging.info("Cleaning complete.")
 
         # 3. Buffer the result back inward
         if not unioned_geom.is_empty and unioned_geom.geom_type in ("Polygon", "MultiPolygon"):
             logging.info("Performing negative buffer...")
-            # Apply negative buffer
-            final_geom = unioned_geom.buffer(-BUFFER_EPSILON)
-            # Clean up results of negative buffer
-            final_geom = make_valid(final_geom.buffer(0))
+            with span("extract_perimeter_2.negative_buffer") as negative_span:
+                # Apply negative buffer
+                final_geom = unioned_geom.buffer(-BUFFER_EPSILON)
+                # Clean up results of negative buffer
+                final_geom = make_valid(final_geom.buffer(0))
+                negative_span.count(vertices=shapely.get_num_coordinates(final_geom))
             logging.info("Negative buffer and final cleaning complete.")
         else:
             # Handle cases where union resulted in something unexpected
@@ -147,30 +161,179 @@ def create_geojson_from_csv_overall_perimeter(csv_filepath, geojson_filepath):
     # --- End Buffering Strategy ---
 
 
-    # --- Create GeoJSON Output ---
-    # Now we create a FeatureCollection with only ONE feature: the overall perimeter
-    feature = {
-        "type": "Feature",
-        "geometry": final_geom.__geo_interface__,
-        "properties": {
-            # Add relevant properties, e.g., total original tiles
-            "original_tile_count": total_tiles_processed,
-            "description": "Overall perimeter of all tiles" 
-        }
-    }
-    
-    # The FeatureCollection now contains just the single overall perimeter feature
-    feature_collection = {"type": "FeatureCollection", "features": [feature]} 
+    write_perimeter_geojson(final_geom, total_tiles_processed, geojson_filepath)
 
-    logging.info(f"Writing GeoJSON output to: {geojson_filepath}")
+
+def read_tile_bounds_arrays(csv_filepath):
+    """
+    Reads the tile boundaries into NumPy arrays through the compiled tile index.
+
+    The CSV is compiled once into a memory-mapped index (see tile_index.py) and
+    later runs only map it. Rows with missing or non-numeric bounds, or with
+    min >= max, are skipped with a warning when the index is compiled.
+
+    Args:
+        csv_filepath (str): Path to the input CSV file.
+
+    Returns:
+        tuple: (rows, bounds) where rows is an int array of tile rows and bounds
+        is an (N, 4) float array of lon_min, lat_min, lon_max, lat_max.
+    """
+    logging.info(f"Loading tile index of: {csv_filepath}")
     try:
-        with open(geojson_filepath, mode="w", encoding="utf-8") as outfile:
-            json.dump(feature_collection, outfile, indent=2)
-        logging.info("GeoJSON file created successfully with the overall perimeter.")
+        with span("extract_perimeter_2.read_tiles") as read_span:
+            index = load_tile_index(csv_filepath)
+            read_span.count(tiles=len(index))
+    except FileNotFoundError:
+        logging.error(f"Input CSV file not found at {csv_filepath}")
+        sys.exit(1)
     except Exception as e:
-        logging.error(f"Error writing GeoJSON file: {e}")
+        logging.error(f"Error reading CSV file: {e}")
         sys.exit(1)
 
+    bounds = np.column_stack((index.lon_min, index.lat_min, index.lon_max, index.lat_max))
+    return index.row.astype(np.int64), bounds
+
+
+def snap_tile_edges(bounds, grid_size=LATTICE_GRID_SIZE):
+    """
+    Moves tile edges that lie within grid_size of each other onto one coordinate.
+
+    Rounding to the lattice alone does not do this: edges at 1.00000014 and
+    1.00000016 round to neighbouring lattice points and leave a gap. Instead
+    the distinct longitudes, and separately latitudes, are sorted and every run
+    of values no more than grid_size apart takes the first value of the run.
+
+    Args:
+        bounds (np.ndarray): (N, 4) array of lon_min, lat_min, lon_max, lat_max.
+        grid_size (float): Largest distance between edges that are merged.
+
+    Returns:
+        np.ndarray: The snapped (N, 4) bounds.
+    """
+    snapped = np.empty_like(bounds)
+    for columns in ([0, 2], [1, 3]):
+        values, index = snap_coordinates(bounds[:, columns].ravel(), grid_size)
+        snapped[:, columns] = values[index].reshape(-1, 2)
+    return snapped
+
+
+def union_tile_band(bounds, grid_size=LATTICE_GRID_SIZE):
+    """
+    Unions one band of tiles on the snapping lattice.
+
+    The boxes are built in a single vectorized call and rounded to the lattice.
+    union_tiles_fast snaps nearly coincident edges together beforehand, so tiles
+    whose edges are within grid_size of each other share exact coordinates and
+    merge without any buffering.
+
+    Args:
+        bounds (np.ndarray): (N, 4) array of lon_min, lat_min, lon_max, lat_max.
+        grid_size (float): Lattice spacing in degrees.
+
+    Returns:
+        shapely.Geometry: The union of the band's tiles.
+    """
+    with span("extract_perimeter_2.union_band", tiles=len(bounds)):
+        boxes = shapely.box(bounds[:, 0], bounds[:, 1], bounds[:, 2], bounds[:, 3])
+        boxes = shapely.set_precision(boxes, grid_size)
+        return shapely.union_all(boxes, grid_size=grid_size)
+
+
+def split_into_row_bands(rows, bounds, band_count):
+    """
+    Splits the tiles into band_count bands of whole, consecutive rows.
+
+    Without a row column the tiles are banded by latitude instead.
+
+    Args:
+        rows (np.ndarray or None): Tile row indices.
+        bounds (np.ndarray): (N, 4) array of tile bounds.
+        band_count (int): Number of bands wanted.
+
+    Returns:
+        list: One (M, 4) bounds array per non-empty band.
+    """
+    sort_key = rows if rows is not None else -bounds[:, 3]
+    order = np.argsort(sort_key, kind="stable")
+    sorted_key = sort_key[order]
+
+    # Cut at evenly spaced tile counts, then move each cut to the next row change
+    cuts = np.linspace(0, order.size, band_count + 1).astype(np.int64)[1:-1]
+    if rows is not None:
+        cuts = np.searchsorted(sorted_key, sorted_key[cuts], side="left")
+    cuts = np.unique(cuts)
+    return [bounds[band] for band in np.split(order, cuts) if band.size]
+
+
+def union_tiles_fast(rows, bounds, grid_size=LATTICE_GRID_SIZE, max_workers=None):
+    """
+    Unions all tiles by row band in a process pool and merges the band results.
+
+    Args:
+        rows (np.ndarray or None): Tile row indices.
+        bounds (np.ndarray): (N, 4) array of tile bounds.
+        grid_size (float): Lattice spacing in degrees.
+        max_workers (int, optional): Pool size, defaults to the CPU count.
+
+    Returns:
+        shapely.Geometry: The union of all tiles.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    # Snap across all tiles at once so every band sees the same edges
+    bounds = snap_tile_edges(bounds, grid_size)
+    band_count = max(1, min(max_workers, len(bounds) // MIN_TILES_PER_BAND))
+    if band_count == 1:
+        logging.info(f"Unioning {len(bounds)} tiles in-process...")
+        return union_tile_band(bounds, grid_size)
+
+    bands = split_into_row_bands(rows, bounds, band_count)
+    logging.info(f"Unioning {len(bounds)} tiles in {len(bands)} row bands on {max_workers} workers...")
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        band_geoms = list(pool.map(union_tile_band, bands, [grid_size] * len(bands)))
+
+    logging.info("Merging band results...")
+    with span("extract_perimeter_2.merge_bands", bands=len(band_geoms)):
+        return shapely.union_all(band_geoms, grid_size=grid_size)
+
+
+def create_geojson_from_csv_overall_perimeter_fast(
+    csv_filepath, geojson_filepath, grid_size=LATTICE_GRID_SIZE, max_workers=None
+):
+    """
+    Fast mode of create_geojson_from_csv_overall_perimeter.
+
+    Builds all tile boxes as one Shapely geometry array, snaps them onto an exact
+    lattice instead of buffering, unions row bands in parallel and merges them.
+    The result matches the default mode to within FAST_MODE_TOLERANCE.
+
+    Args:
+        csv_filepath (str): Path to the input CSV file.
+        geojson_filepath (str): Path for the output GeoJSON file.
+        grid_size (float): Lattice spacing in degrees.
+        max_workers (int, optional): Pool size, defaults to the CPU count.
+    """
+    rows, bounds = read_tile_bounds_arrays(csv_filepath)
+    if not len(bounds):
+        logging.error("No valid tile data found or processed from the CSV file.")
+        sys.exit(1)
+    logging.info(f"Collected {len(bounds)} valid tile bounds.")
+
+    try:
+        final_geom = union_tiles_fast(rows, bounds, grid_size, max_workers)
+    except Exception as e:
+        logging.error(f"Unexpected error during geometry processing: {e}", exc_info=True)
+        sys.exit(1)
+
+    if final_geom.is_empty or final_geom.geom_type not in ("Polygon", "MultiPolygon"):
+        logging.error(
+            f"Union resulted in non-polygon geometry ({final_geom.geom_type}) or was empty. Cannot proceed."
+        )
+        sys.exit(1)
+    logging.info("Union complete.")
+
+    write_perimeter_geojson(final_geom, len(bounds), geojson_filepath)
+
 
 # --- How to use the script ---
 if __name__ == "__main__":
@@ -178,6 +341,16 @@ if __name__ == "__main__":
     input_csv = 'data/tile_bounds_coords_adj.csv' 
     # Consider a different output name to avoid confusion with the per-row version
     output_geojson = 'data/tile_perimeter.geojson' 
+    # Both paths can be overridden on the command line
+    paths = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    if len(paths) > 1:
+        input_csv, output_geojson = paths[:2]
+    # --gzip writes a gzip-compressed GeoJSON next to the plain output path
+    if "--gzip" in sys.argv[1:] and not output_geojson.endswith(".gz"):
+        output_geojson += ".gz"
 
-    # Call the modified function
-    create_geojson_from_csv_overall_perimeter(input_csv, output_geojson)
+    # Call the modified function (pass --fast for the vectorized, parallel union)
+    if "--fast" in sys.argv[1:]:
+        create_geojson_from_csv_overall_perimeter_fast(input_csv, output_geojson)
+    else:
+        create_geojson_from_csv_overall_perimeter(input_csv, output_geojson)
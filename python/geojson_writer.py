@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+geojson_writer.py
+
+Compact GeoJSON output shared by the perimeter scripts and the stripper.
+
+Geometries are compacted before writing:
+    - coordinates are quantized to DEFAULT_DECIMALS decimals (7 decimals is
+      about 1 cm, the precision of the OSM footprints)
+    - consecutive duplicate vertices are dropped
+    - vertices in the middle of a straight run are dropped, so a perimeter
+      keeps one vertex per corner instead of one per tile edge
+
+Duplicate and collinear vertices are found for all rings of a geometry at
+once with NumPy on the quantized integer coordinates, so the tests are exact.
+
+GeoJSONWriter streams a FeatureCollection one feature at a time with compact
+separators, and writes gzip when the output path ends in .gz (or gzip=True).
+
+Usage:
+    python geojson_writer.py input.geojson output.geojson[.gz] [decimals]
+"""
+
+import gzip as gzip_module
+import json
+import os
+import sys
+from typing import Dict, Iterable, List, Tuple, Any
+
+import numpy as np
+
+DEFAULT_DECIMALS = 7
+GZIP_LEVEL = 6
+SEPARATORS = (',', ':')
+
+def quantize(coords: np.ndarray, decimals: int = DEFAULT_DECIMALS) -> np.ndarray:
+    """Round coordinates to integer units of 10^-decimals degrees."""
+    return np.rint(np.asarray(coords, dtype=np.float64) * 10.0 ** decimals).astype(np.int64)
+
+def simplify_rings(rings: List[np.ndarray], decimals: int = DEFAULT_DECIMALS,
+                   closed: bool = True) -> List[np.ndarray]:
+    """
+    Quantize rings (or lines with closed=False) and drop duplicate and collinear
+    vertices. Returns float arrays; closed rings stay closed.
+
+    Rings are concatenated and tested together, each vertex against its
+    neighbours within its own ring. A ring that would collapse below a
+    triangle keeps its quantized vertices instead.
+    """
+    if not rings:
+        return []
+    lengths = []
+    parts = []
+    for ring in rings:
+        points = np.asarray(ring, dtype=np.float64).reshape(-1, 2)
+        if closed and len(points) > 1 and np.array_equal(points[0], points[-1]):
+            points = points[:-1]
+        parts.append(points)
+        lengths.append(len(points))
+    units = quantize(np.concatenate(parts), decimals)
+    ring_id = np.repeat(np.arange(len(parts)), lengths)
+
+    def neighbours(keep: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Indices of the kept vertices and of their previous/next kept vertex in the same ring
+        index = np.flatnonzero(keep)
+        ids = ring_id[index]
+        counts = np.bincount(ids, minlength=len(parts))
+        starts = np.cumsum(counts) - counts
+        position = np.arange(index.size) - starts[ids]
+        size = counts[ids]
+        prev = index[starts[ids] + (position - 1) % size]
+        nxt = index[starts[ids] + (position + 1) % size]
+        if not closed:
+            # Line ends have no neighbour on one side and are always kept
+            prev = np.where(position == 0, index, prev)
+            nxt = np.where(position == size - 1, index, nxt)
+        return index, prev, nxt
+
+    # Duplicates: a vertex equal to the one before it
+    index, prev, _ = neighbours(np.ones(len(units), dtype=bool))
+    duplicate = np.all(units[index] == units[prev], axis=1) & (index != prev)
+    keep = np.ones(len(units), dtype=bool)
+    keep[index[duplicate]] = False
+    if closed:
+        # Never drop every vertex of a ring whose points all coincide
+        empty = np.bincount(ring_id[keep], minlength=len(parts)) == 0
+        keep[np.flatnonzero(np.isin(ring_id, np.flatnonzero(empty)))] = True
+
+    # Collinear: the turn at a vertex is zero and the path goes straight through
+    index, prev, nxt = neighbours(keep)
+    d1 = (units[index] - units[prev]).astype(np.float64)
+    d2 = (units[nxt] - units[index]).astype(np.float64)
+    cross = d1[:, 0] * d2[:, 1] - d1[:, 1] * d2[:, 0]
+    dot = (d1 * d2).sum(axis=1)
+    straight = (cross == 0) & (dot > 0)
+    keep_final = keep.copy()
+    keep_final[index[straight]] = False
+
+    minimum = 3 if closed else 2
+    counts = np.bincount(ring_id[keep_final], minlength=len(parts))
+    collapsed = np.isin(ring_id, np.flatnonzero(counts < minimum))
+    keep_final[collapsed] = keep[collapsed]
+
+    scale = 10.0 ** decimals
+    result = []
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    for i in range(len(parts)):
+        ring_units = units[offsets[i]:offsets[i + 1]][keep_final[offsets[i]:offsets[i + 1]]]
+        if closed:
+            ring_units = np.vstack((ring_units, ring_units[:1]))
+        result.append(ring_units / scale)
+    return result
+
+def compact_geometry(geometry: Dict[str, Any], decimals: int = DEFAULT_DECIMALS,
+                     simplify: bool = True) -> Dict[str, Any]:
+    """
+    Return a copy of a GeoJSON geometry with quantized coordinates and, when
+    simplify is set, without duplicate or collinear vertices.
+    """
+    if geometry is None:
+        return None
+    kind = geometry['type']
+    if kind == 'GeometryCollection':
+        return {'type': kind, 'geometries': [compact_geometry(g, decimals, simplify) for g in geometry['geometries']]}
+
+    coordinates = geometry['coordinates']
+    if kind in ('Point', 'MultiPoint'):
+        return {'type': kind, 'coordinates': (quantize(coordinates, decimals) / 10.0 ** decimals).tolist()}
+
+    # Flatten every ring or line into one list, simplify them together, then regroup
+    if kind == 'LineString':
+        groups, closed = [[coordinates]], False
+    elif kind == 'MultiLineString':
+        groups, closed = [coordinates], False
+    elif kind == 'Polygon':
+        groups, closed = [coordinates], True
+    elif kind == 'MultiPolygon':
+        groups, closed = list(coordinates), True
+    else:
+        raise ValueError(f"Unsupported geometry type: {kind}")
+
+    rings = [ring for group in groups for ring in group]
+    if simplify:
+        rings = simplify_rings(rings, decimals, closed)
+    else:
+        rings = [quantize(ring, decimals) / 10.0 ** decimals for ring in rings]
+    lists = [ring.tolist() for ring in rings]
+
+    regrouped, start = [], 0
+    for group in groups:
+        regrouped.append(lists[start:start + len(group)])
+        start += len(group)
+    if kind == 'LineString':
+        return {'type': kind, 'coordinates': regrouped[0][0]}
+    if kind in ('MultiLineString', 'Polygon'):
+        return {'type': kind, 'coordinates': regrouped[0]}
+    return {'type': kind, 'coordinates': regrouped}
+
+def _open_text(path: str, gzip: bool = None):
+    if gzip if gzip is not None else path.endswith('.gz'):
+        return gzip_module.open(path, 'wt', encoding='utf-8', compresslevel=GZIP_LEVEL)
+    return open(path, 'w', encoding='utf-8')
+
+class GeoJSONWriter:
+    """
+    Stream a FeatureCollection to a file, one feature at a time.
+
+    Top-level members other than type and features can be written before or
+    after the features with write_member(). Geometries are compacted with
+    compact_geometry unless decimals is None.
+    """
+
+    def __init__(self, path: str, decimals: int = DEFAULT_DECIMALS, simplify: bool = True, gzip: bool = None):
+        self.path = path
+        self.decimals = decimals
+        self.simplify = simplify
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self.file = _open_text(path, gzip)
+        self.file.write('{"type":"FeatureCollection"')
+        self.count = 0
+        self.state = 'members'
+
+    def write_member(self, key: str, value: Any) -> None:
+        """Write one top-level member, such as 'name', 'crs' or 'bbox'."""
+        if self.state == 'features':
+            self.file.write(']')
+            self.state = 'done'
+        self.file.write(f",{json.dumps(key)}:{json.dumps(value, separators=SEPARATORS)}")
+
+    def write_feature(self, feature: Dict[str, Any]) -> None:
+        """Write one feature, compacting its geometry."""
+        if self.state == 'done':
+            raise ValueError("Features must be written in one run")
+        if self.state == 'members':
+            self.file.write(',"features":[')
+            self.state = 'features'
+        if self.decimals is not None and feature.get('geometry') is not None:
+            feature = dict(feature, geometry=compact_geometry(feature['geometry'], self.decimals, self.simplify))
+        if self.count:
+            self.file.write(',')
+        self.file.write(json.dumps(feature, separators=SEPARATORS))
+        self.count += 1
+
+    def write_features(self, features: Iterable[Dict[str, Any]]) -> None:
+        for feature in features:
+            self.write_feature(feature)
+
+    def close(self) -> None:
+        """Finish the collection and close the file."""
+        if self.state == 'members':
+            self.file.write(',"features":[')
+            self.state = 'features'
+        if self.state == 'features':
+            self.file.write(']')
+        self.file.write('}')
+        self.file.close()
+        self.state = 'closed'
+
+    def __enter__(self) -> 'GeoJSONWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.state != 'closed':
+            self.close()
+
+def write_feature_collection(path: str, features: Iterable[Dict[str, Any]], decimals: int = DEFAULT_DECIMALS,
+                             simplify: bool = True, gzip: bool = None) -> int:
+    """Write features as a compact FeatureCollection. Returns the number written."""
+    with GeoJSONWriter(path, decimals, simplify, gzip) as writer:
+        writer.write_features(features)
+        return writer.count
+
+def main() -> None:
+    """Rewrite a GeoJSON FeatureCollection compactly."""
+    if len(sys.argv) < 3:
+        print(f"Usage: python {os.path.basename(__file__)} input.geojson output.geojson[.gz] [decimals]")
+        sys.exit(1)
+    input_path, output_path = sys.argv[1:3]
+    decimals = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_DECIMALS
+
+    print(f"Reading {input_path}...")
+    opener = gzip_module.open if input_path.endswith('.gz') else open
+    with opener(input_path, 'rt', encoding='utf-8') as f:
+        data = json.load(f)
+    with GeoJSONWriter(output_path, decimals) as writer:
+        for key, value in data.items():
+            if key not in ('type', 'features'):
+                writer.write_member(key, value)
+        writer.write_features(data.get('features', []))
+    print(f"Wrote {writer.count} features: {os.path.getsize(input_path)} -> {os.path.getsize(output_path)} bytes")
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+incremental_build.py
+
+This script rebuilds the derived files in data/ incrementally.
+
+A build manifest (data/.build/manifest.json) records a content hash of every
+input and output of every stage. A stage reruns only when the hashes of its
+inputs differ from the last recorded build or one of its outputs is missing
+or was modified. Files are only rehashed when their size or modification time
+changed, so checking an unchanged tree costs one stat per file.
+
+The stages themselves are defined once, in pipeline.STAGES, and this script
+runs the pipeline's default stages; see pipeline.py for the list. This module
+holds the manifest and cache helpers they share.
+
+The CSV is hashed row by row, and the perimeter stages depend on the sorted
+row hashes, so reordering rows does not trigger a rebuild. The building tile
+stages keep a per-tile cache of parsed columns in data/.build/tiles, keyed by
+tile content hash. After one tile is relabeled only that tile is parsed again
+and the cached columns of every other tile are reused. The damage summary
+keeps its own per-tile building records and only recounts the buildings in the
+tiles that changed.
+
+Pass --force to rebuild every stage.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import pickle
+import sys
+import time
+from typing import Dict, List, Tuple, Any
+
+from build_building_bundle import collect_tile_columns
+
+MANIFEST_VERSION = 1
+BUILD_DIR_NAME = '.build'
+HASH_CHUNK_SIZE = 1 << 20
+
+class BuildManifest:
+    """
+    Content hashes of files and of the inputs/outputs of each stage.
+
+    File hashes are cached against (size, mtime_ns), the same shortcut git uses
+    for its index, so unchanged files are never read.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                self.files = data.get('files', {})
+                self.stages = data.get('stages', {})
+
+    def digest(self, path: str) -> str:
+        """Return the SHA-256 of a file, or None if it does not exist."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.files.pop(path, None)
+            return None
+        cached = self.files.get(path)
+        if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            return cached['sha256']
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                sha.update(chunk)
+        self.files[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha.hexdigest()}
+        return sha.hexdigest()
+
+    def is_current(self, stage: str, inputs: Dict[str, str], outputs: List[str] = None) -> bool:
+        """
+        True when the stage's inputs match its last build and its outputs are
+        intact. When outputs are given, the last build must have written exactly
+        those paths.
+        """
+        record = self.stages.get(stage)
+        if not record or record['inputs'] != inputs:
+            return False
+        if outputs is not None and set(record['outputs']) != set(outputs):
+            return False
+        return all(self.digest(path) == digest for path, digest in record['outputs'].items())
+
+    def record(self, stage: str, inputs: Dict[str, str], outputs: List[str]) -> None:
+        """Record a finished build of a stage."""
+        self.stages[stage] = {'inputs': inputs, 'outputs': {path: self.digest(path) for path in outputs}}
+
+    def save(self) -> None:
+        """Write the manifest atomically."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'files': self.files, 'stages': self.stages}, f)
+        os.replace(temp_path, self.path)
+
+def csv_rows_digest(csv_file: str) -> str:
+    """
+    Hash a CSV as the sorted set of its row hashes, ignoring row order.
+    """
+    with open(csv_file, 'r', newline='') as f:
+        rows = sorted(
+            hashlib.sha256('\x1f'.join(row).encode('utf-8')).hexdigest() for row in csv.reader(f)
+        )
+    return hashlib.sha256('\n'.join(rows).encode('utf-8')).hexdigest()
+
+def load_tile_columns(manifest: BuildManifest, cache_dir: str,
+                      tile_files: List[Tuple[int, int, str]]) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Return the columns of every tile, parsing only tiles missing from the cache.
+    Returns the columns and the number of tiles parsed.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    tile_columns = []
+    parsed = 0
+    for row, col, path in tile_files:
+        cache_file = os.path.join(cache_dir, f"{row}_{col}_{manifest.digest(path)}.pkl")
+        if os.path.exists(cache_file):
+            with open(cache_file, 'rb') as f:
+                tile_columns.append(pickle.load(f))
+            continue
+
+        columns = collect_tile_columns(row, col, path)
+        # Write then rename, since concurrent stages may cache the same tile
+        temp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'wb') as f:
+            pickle.dump(columns, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+        tile_columns.append(columns)
+        parsed += 1
+    return tile_columns, parsed
+
+def prune_tile_cache(cache_dir: str, manifest: BuildManifest, tile_files: List[Tuple[int, int, str]]) -> None:
+    """Delete cached columns of tile versions that no longer exist."""
+    live = {f"{row}_{col}_{manifest.digest(path)}.pkl" for row, col, path in tile_files}
+    for name in os.listdir(cache_dir):
+        if name.endswith('.pkl') and name not in live:
+            os.remove(os.path.join(cache_dir, name))
+
+def incremental_build(data_dir: str, force: bool = False) -> Dict[str, Tuple[str, float]]:
+    """
+    Bring every derived file in data_dir up to date by running the default
+    pipeline stages. Returns the pipeline's {stage: (status, seconds)}.
+    """
+    # Imported here because pipeline builds on the helpers above
+    from pipeline import run_pipeline
+    return run_pipeline(data_dir, force=force)
+
+def main() -> None:
+    """Main function to run the script."""
+
+    # Determine the data directory; --force rebuilds every stage
+    args = [arg for arg in sys.argv[1:] if arg != '--force']
+    force = len(args) != len(sys.argv) - 1
+    if args:
+        data_dir = args[0]
+    else:
+        # Default path
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        data_dir = os.path.join(os.path.dirname(script_dir), 'data')
+
+    print(f"Updating derived files in {data_dir}...")
+    start = time.perf_counter()
+    incremental_build(data_dir, force)
+    print(f"Done in {time.perf_counter() - start:.3f}s!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+ingest_footprints.py
+
+This script turns a raw OpenStreetMap building footprint extract into the
+per-tile buildings_row_{r}_col_{c}.geojson files the rest of the repo reads,
+in one streaming pass.
+
+The extract is a GeoJSON FeatureCollection (optionally .gz), read one feature
+at a time and handled in batches of BATCH_SIZE:
+    1. the bbox and outer-ring centroid of every footprint are computed with
+       NumPy for the whole batch
+    2. footprints whose bbox misses the perimeter's bbox are dropped
+    3. the rest are kept when their centroid lies inside the perimeter
+       (tile_perimeter.geojson by default), tested with one vectorized
+       contains_xy call against the prepared perimeter geometry
+    4. each kept footprint is assigned to the tile containing its centroid
+       with tile_index; where tiles overlap the nearest center wins, so every
+       footprint lands in exactly one tile
+
+Batches are handed to a process pool, where each worker serializes its batch
+sorted by tile into one spill file and returns the byte range of every tile in
+it. Once the input is consumed, the tile files are assembled in parallel from
+their ranges, in input order, in the one-feature-per-line layout of the
+labeled tiles. At most a few batches are in flight at a time and a tile is
+assembled from disk, so memory stays flat whatever the size of the extract.
+
+Kept features carry the OSM id (from id, osm_id or @id, without the way/
+prefix) and building properties. Run label_damage.py --replace on the output
+directory to add is_damaged. Tile files already in the output directory are
+replaced when the extract has buildings for their tile and left alone otherwise.
+
+Usage:
+    python ingest_footprints.py footprints.geojson[.gz] [output_dir] [perimeter.geojson] [tiles.csv]
+"""
+
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, List, Tuple, Any
+
+import numpy as np
+import shapely
+
+from build_building_bundle import iter_polygons
+from build_heatmap_points import ring_centroids
+from strip_geojson import iter_features
+from tile_index import load_tile_index
+
+# Footprints parsed, filtered and handed to a worker at a time
+BATCH_SIZE = 20000
+# Batches queued per worker before reading more of the input
+BATCHES_IN_FLIGHT = 2
+CRS = {"type": "name", "properties": {"name": "urn:ogc:def:crs:OGC:1.3:CRS84"}}
+
+def load_perimeter(perimeter_file: str) -> shapely.Geometry:
+    """Union of every geometry in a perimeter GeoJSON, prepared for repeated tests."""
+    opener = gzip.open if perimeter_file.endswith('.gz') else open
+    with opener(perimeter_file, 'rt', encoding='utf-8') as f:
+        data = json.load(f)
+    geometries = shapely.from_geojson([json.dumps(feature['geometry']) for feature in data.get('features', [])
+                                       if feature.get('geometry')])
+    perimeter = shapely.union_all(geometries)
+    shapely.prepare(perimeter)
+    return perimeter
+
+def osm_id(feature: Dict[str, Any]) -> str:
+    """The numeric OSM id of a feature as a string, e.g. '295984332' for 'way/295984332'."""
+    properties = feature.get('properties') or {}
+    for value in (properties.get('id'), properties.get('osm_id'), properties.get('@id'), feature.get('id')):
+        if value is not None:
+            return str(value).rsplit('/', 1)[-1]
+    return None
+
+def slim_feature(feature: Dict[str, Any]) -> Dict[str, Any]:
+    """The feature with only the properties the tile files keep."""
+    properties = feature.get('properties') or {}
+    return {
+        "type": "Feature",
+        "properties": {"id": osm_id(feature), "building": properties.get('building', 'yes')},
+        "geometry": feature['geometry'],
+    }
+
+def footprint_geometry(features: List[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Bbox and centroid of every feature, from one pass over its outer rings
+    (holes never extend a bbox). The centroid is that of the first polygon's
+    outer ring. Both are NaN for features without polygon geometry.
+    """
+    ring_lengths = []
+    ring_counts = []
+    coords: List[List[float]] = []
+    for feature in features:
+        count = 0
+        for polygon in iter_polygons(feature.get('geometry')):
+            if polygon and polygon[0]:
+                coords.extend(point[:2] for point in polygon[0])
+                ring_lengths.append(len(polygon[0]))
+                count += 1
+        ring_counts.append(count)
+
+    boxes = np.full((len(features), 4), np.nan)
+    centroids = np.full((len(features), 2), np.nan)
+    if not coords:
+        return boxes, centroids
+    points = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    ring_lengths = np.asarray(ring_lengths, dtype=np.int64)
+    ring_counts = np.asarray(ring_counts, dtype=np.int64)
+    ring_ends = np.cumsum(ring_lengths)
+    ring_starts = ring_ends - ring_lengths
+
+    present = ring_counts > 0
+    # First ring and first point of every feature that has one
+    first_ring = (np.cumsum(ring_counts) - ring_counts)[present]
+    point_starts = ring_starts[first_ring]
+    for axis in (0, 1):
+        boxes[present, axis] = np.minimum.reduceat(points[:, axis], point_starts)
+        boxes[present, axis + 2] = np.maximum.reduceat(points[:, axis], point_starts)
+    centroids[present] = ring_centroids(points, point_starts, ring_ends[first_ring])
+    return boxes, centroids
+
+def select_batch(features: List[Dict[str, Any]], perimeter: shapely.Geometry, perimeter_bounds: np.ndarray,
+                 index) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Filter a batch to the footprints inside the perimeter and assign their tiles.
+    Returns the positions of the kept features and their tile rows and cols.
+    """
+    boxes, centroids = footprint_geometry(features)
+    lon_min, lat_min, lon_max, lat_max = perimeter_bounds
+    # NaN bboxes (no polygon geometry) fail every comparison and are dropped here
+    candidates = np.flatnonzero((boxes[:, 0] <= lon_max) & (boxes[:, 2] >= lon_min)
+                                & (boxes[:, 1] <= lat_max) & (boxes[:, 3] >= lat_min))
+    centroids = centroids[candidates]
+    inside = shapely.contains_xy(perimeter, centroids[:, 0], centroids[:, 1])
+    kept = candidates[inside]
+    rows, cols = index.locate_tiles(centroids[inside, 1], centroids[inside, 0])
+    located = rows >= 0
+    return kept[located], rows[located], cols[located]
+
+def spill_batch(task: Tuple[str, int, List[Dict[str, Any]], np.ndarray, np.ndarray]
+                ) -> Tuple[int, Dict[Tuple[int, int], Tuple[int, int]]]:
+    """
+    Write a batch to its spill file, grouped by tile. Returns the batch number
+    and, per tile, the (offset, length) of its lines in the file.
+    """
+    spill_dir, batch, features, rows, cols = task
+    order = np.lexsort((cols, rows))
+    rows, cols = rows[order], cols[order]
+    # Start of every run of equal (row, col) in the sorted order
+    starts = np.flatnonzero(np.concatenate(([True], (np.diff(rows) != 0) | (np.diff(cols) != 0))))
+    stops = np.append(starts[1:], len(order))
+    order = order.tolist()
+
+    ranges: Dict[Tuple[int, int], Tuple[int, int]] = {}
+    path = os.path.join(spill_dir, f'batch_{batch:06d}.jsonl')
+    with open(path, 'wb') as f:
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            data = ''.join(json.dumps(features[i]) + '\n' for i in order[start:stop]).encode('utf-8')
+            ranges[(int(rows[start]), int(cols[start]))] = (f.tell(), len(data))
+            f.write(data)
+    return batch, ranges
+
+def write_tile(task: Tuple[str, int, int, str, List[Tuple[int, int, int]]]) -> int:
+    """
+    Assemble one tile file from its byte ranges in the spill files, in batch
+    order. Returns the number of buildings written.
+    """
+    output_dir, row, col, spill_dir, ranges = task
+    lines = []
+    for batch, offset, length in ranges:
+        with open(os.path.join(spill_dir, f'batch_{batch:06d}.jsonl'), 'rb') as f:
+            f.seek(offset)
+            lines.extend(f.read(length).decode('utf-8').splitlines())
+
+    name = f'buildings_row_{row}_col_{col}'
+    path = os.path.join(output_dir, f'{name}.geojson')
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write('{\n')
+        f.write('"type": "FeatureCollection",\n')
+        f.write(f'"name": {json.dumps(name)},\n')
+        f.write(f'"crs": {json.dumps(CRS)},\n')
+        f.write('"features": [\n')
+        f.write(',\n'.join(lines))
+        f.write('\n]\n}\n')
+    os.replace(temp_path, path)
+    return len(lines)
+
+def ingest_footprints(input_file: str, output_dir: str, perimeter_file: str, csv_file: str,
+                      batch_size: int = BATCH_SIZE, max_workers: int = None) -> Dict[str, int]:
+    """
+    Clip a footprint extract to the perimeter and split it into tile files.
+    Returns the number of features read, kept and tiles written.
+    """
+    perimeter = load_perimeter(perimeter_file)
+    perimeter_bounds = np.asarray(shapely.bounds(perimeter))
+    index = load_tile_index(csv_file)
+    max_workers = max_workers or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    spill_dir = tempfile.mkdtemp(prefix='.ingest_', dir=output_dir)
+
+    stats = {'read': 0, 'kept': 0, 'tiles': 0}
+    tile_ranges: Dict[Tuple[int, int], List[Tuple[int, int, int]]] = {}
+    batch_ranges: Dict[int, Dict[Tuple[int, int], Tuple[int, int]]] = {}
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            pending = set()
+
+            def submit(batch: int, features: List[Dict[str, Any]]) -> None:
+                kept, rows, cols = select_batch(features, perimeter, perimeter_bounds, index)
+                stats['kept'] += len(kept)
+                if not len(kept):
+                    return
+                # Bound memory: wait for a batch to finish before queueing too many
+                while len(pending) >= BATCHES_IN_FLIGHT * max_workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        pending.remove(future)
+                        number, ranges = future.result()
+                        batch_ranges[number] = ranges
+                features = [slim_feature(features[i]) for i in kept.tolist()]
+                pending.add(pool.submit(spill_batch, (spill_dir, batch, features, rows, cols)))
+
+            features: List[Dict[str, Any]] = []
+            batch = 0
+            for feature in iter_features(input_file):
+                features.append(feature)
+                if len(features) >= batch_size:
+                    stats['read'] += len(features)
+                    submit(batch, features)
+                    features = []
+                    batch += 1
+            stats['read'] += len(features)
+            if features:
+                submit(batch, features)
+            for future in pending:
+                number, ranges = future.result()
+                batch_ranges[number] = ranges
+
+            # Ranges of each tile in batch order, so features keep their input order
+            for number in sorted(batch_ranges):
+                for tile, (offset, length) in batch_ranges[number].items():
+                    tile_ranges.setdefault(tile, []).append((number, offset, length))
+            tasks = [(output_dir, row, col, spill_dir, ranges) for (row, col), ranges in sorted(tile_ranges.items())]
+            chunksize = max(1, len(tasks) // (4 * max_workers))
+            stats['tiles'] = sum(1 for _ in pool.map(write_tile, tasks, chunksize=chunksize))
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    return stats
+
+def main() -> None:
+    """Main function to run the script."""
+    if len(sys.argv) < 2:
+        print(f"Usage: python {os.path.basename(__file__)} footprints.geojson[.gz] "
+              "[output_dir] [perimeter.geojson] [tiles.csv]")
+        sys.exit(1)
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.path.join(os.path.dirname(script_dir), 'data')
+    input_file = sys.argv[1]
+    output_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join(data_dir, 'building-polygons')
+    perimeter_file = sys.argv[3] if len(sys.argv) > 3 else os.path.join(data_dir, 'tile_perimeter.geojson')
+    csv_file = sys.argv[4] if len(sys.argv) > 4 else os.path.join(data_dir, 'tile_bounds_coords_adj.csv')
+
+    print(f"Ingesting {input_file} inside {perimeter_file}...")
+    start = time.perf_counter()
+    stats = ingest_footprints(input_file, output_dir, perimeter_file, csv_file)
+    seconds = time.perf_counter() - start
+    print(f"Kept {stats['kept']} of {stats['read']} footprints in {stats['tiles']} tiles "
+          f"({stats['read'] / max(seconds, 1e-9) * 60:,.0f} footprints per minute).")
+    print(f"Saved tiles to {output_dir}.")
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
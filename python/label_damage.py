@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+label_damage.py
+
+This script recomputes the is_damaged label of every building from the crater
+detections, so labels can be refreshed whenever all_craters.json changes.
+
+A building is damaged when any part of its footprint lies within
+DAMAGE_RADIUS_FACTOR x radius of a crater center. Every worker process holds one
+Shapely STRtree over all crater centers in local metres, so craters straddling a
+tile seam reach buildings on both sides of it. The crater row/col recorded in
+all_craters.json is not used for matching: many detections lie outside the tile
+they are filed under, and building footprints extend past their tile bounds.
+Tiles are labeled in parallel in a process pool and only files whose labels
+changed are rewritten, through a temporary file and os.replace so a failed run
+never leaves a half-written tile.
+
+By default the computed label goes to its own is_damaged_craters property and
+the existing is_damaged labels are kept. Pass --replace to overwrite
+is_damaged instead. Manual labels in is_damaged_labeled are left untouched.
+
+Usage:
+    python label_damage.py [--dry-run] [--replace] [input_dir craters.json [radius_factor]]
+"""
+
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, Any
+
+import numpy as np
+import shapely
+
+from build_building_bundle import find_tile_files
+from craters import load_craters, to_local_metres
+
+# A building within this many crater radii of a crater center counts as damaged
+DAMAGE_RADIUS_FACTOR = 1.0
+# Property the computed label is written to, unless is_damaged is replaced
+CRATER_LABEL_PROPERTY = 'is_damaged_craters'
+REPLACE_LABEL_PROPERTY = 'is_damaged'
+
+_crater_tree = None
+_crater_points = None
+_crater_reach = None
+_origin_lat = None
+
+def _init_worker(crater_lon: np.ndarray, crater_lat: np.ndarray, crater_reach: np.ndarray,
+                 origin_lat: float) -> None:
+    """Build the crater index once per worker process."""
+    global _crater_tree, _crater_points, _crater_reach, _origin_lat
+    _origin_lat = origin_lat
+    _crater_points = shapely.points(to_local_metres(crater_lon, crater_lat, origin_lat))
+    _crater_reach = crater_reach
+    _crater_tree = shapely.STRtree(_crater_points)
+
+def find_damaged(geometries: np.ndarray) -> np.ndarray:
+    """
+    Return a boolean mask of the building geometries within reach of any crater.
+
+    The crater STRtree proposes candidate pairs within the largest reach, then
+    the exact building-to-center distances of all pairs are computed at once and
+    compared against each crater's own reach.
+    """
+    damaged = np.zeros(len(geometries), dtype=bool)
+    if not len(geometries) or not len(_crater_points):
+        return damaged
+
+    buildings = shapely.transform(geometries, lambda c: to_local_metres(c[:, 0], c[:, 1], _origin_lat))
+    building_index, crater_index = _crater_tree.query(buildings, predicate='dwithin',
+                                                      distance=float(_crater_reach.max()))
+    distances = shapely.distance(buildings[building_index], _crater_points[crater_index])
+    damaged[building_index[distances <= _crater_reach[crater_index]]] = True
+    return damaged
+
+def write_feature_collection(data: Dict[str, Any], output_file: str) -> None:
+    """
+    Write a FeatureCollection in the one-feature-per-line layout of the tile files.
+    The file is written next to output_file and moved into place when complete.
+    """
+    temp_file = f"{output_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        f.write('{\n')
+        for key, value in data.items():
+            if key != 'features':
+                f.write(f'{json.dumps(key)}: {json.dumps(value)},\n')
+        f.write('"features": [\n')
+        f.write(',\n'.join(json.dumps(feature) for feature in data.get('features', [])))
+        f.write('\n]\n}\n')
+    os.replace(temp_file, output_file)
+
+def label_tile(task: Tuple[int, int, str, bool, str]) -> Tuple[int, int, int, int, int]:
+    """
+    Relabel one tile file, setting label_property of every building.
+    Returns (row, col, buildings, damaged, changed).
+    """
+    row, col, path, write, label_property = task
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    features = data.get('features', [])
+
+    has_geometry = np.asarray([bool(feature.get('geometry')) for feature in features], dtype=bool)
+    geometries = shapely.from_geojson(
+        [json.dumps(feature['geometry']) for feature, present in zip(features, has_geometry) if present]
+    )
+    damaged = np.zeros(len(features), dtype=bool)
+    damaged[has_geometry] = find_damaged(np.asarray(geometries))
+
+    changed = 0
+    for feature, is_damaged in zip(features, damaged.tolist()):
+        properties = feature.setdefault('properties', {})
+        label = "True" if is_damaged else "False"
+        if properties.get(label_property) != label:
+            properties[label_property] = label
+            changed += 1
+
+    if changed and write:
+        write_feature_collection(data, path)
+    return row, col, len(features), int(damaged.sum()), changed
+
+def label_damage(input_dir: str, craters_file: str,
+                 radius_factor: float = DAMAGE_RADIUS_FACTOR, write: bool = True,
+                 max_workers: int = None,
+                 label_property: str = CRATER_LABEL_PROPERTY) -> List[Tuple[int, int, int, int, int]]:
+    """
+    Relabel every building tile in input_dir from the craters in craters_file,
+    writing the label to label_property (is_damaged_craters by default).
+    Returns the per-tile (row, col, buildings, damaged, changed) results.
+    """
+    craters = load_craters(craters_file)
+    reach = radius_factor * craters['radius']
+    origin_lat = float(np.mean(craters['lat'])) if len(craters['lat']) else 0.0
+
+    tasks = [(row, col, path, write, label_property) for row, col, path in find_tile_files(input_dir)]
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(craters['lon'], craters['lat'], reach, origin_lat)) as pool:
+        return list(pool.map(label_tile, tasks, chunksize=max(1, len(tasks) // (4 * (os.cpu_count() or 1)))))
+
+def main() -> None:
+    """Main function to run the script."""
+
+    # Determine file paths; --dry-run reports the changes without writing them,
+    # --replace overwrites is_damaged instead of writing is_damaged_craters
+    args = [arg for arg in sys.argv[1:] if arg not in ('--dry-run', '--replace')]
+    write = '--dry-run' not in sys.argv[1:]
+    label_property = REPLACE_LABEL_PROPERTY if '--replace' in sys.argv[1:] else CRATER_LABEL_PROPERTY
+    radius_factor = DAMAGE_RADIUS_FACTOR
+    if len(args) > 1:
+        input_dir, craters_file = args[:2]
+        if len(args) > 2:
+            radius_factor = float(args[2])
+    else:
+        # Default paths
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        data_dir = os.path.join(os.path.dirname(script_dir), 'data')
+        input_dir = os.path.join(data_dir, 'building-polygons-labeled')
+        craters_file = os.path.join(data_dir, 'all_craters.json')
+
+    print(f"Labeling {label_property} of buildings in {input_dir} from {craters_file} (factor {radius_factor})...")
+    results = label_damage(input_dir, craters_file, radius_factor, write, label_property=label_property)
+
+    buildings = sum(result[2] for result in results)
+    damaged = sum(result[3] for result in results)
+    changed = sum(result[4] for result in results)
+    changed_tiles = sum(1 for result in results if result[4])
+    print(f"Labeled {buildings} buildings in {len(results)} tiles: {damaged} damaged.")
+    action = "Would change" if not write else "Changed"
+    print(f"{action} {changed} labels in {changed_tiles} tiles.")
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
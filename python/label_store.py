@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+label_store.py
+
+Append-only label log for the training tool, with compaction into the tile files.
+
+Every save from /save_training_data becomes one record appended to
+labels.log next to the building tiles:
+
+    uint32 little-endian payload length
+    uint32 little-endian CRC-32 of the payload
+    payload  UTF-8 JSON {"row", "col", "states": {building id: state}, "craters"}
+
+Appends are O(1) and serialized by a lock. Durability uses group commit: a
+flusher thread waits up to FSYNC_DELAY for more appends, then one fsync covers
+all of them, and every waiting writer returns once its record is on disk.
+
+An in-memory index maps (row, col) -> building id -> offset of the newest
+record labeling that building, plus (row, col) -> offset of the newest
+craters. Lookups read the referenced record, so readers always see the
+latest save even before compaction.
+
+Compaction folds the indexed labels into the tile files. It writes the
+is_damaged_labeled property of buildings_row_R_col_C.geojson and replaces
+craters_row_R_col_C.json, using atomic file replacement. It then rewrites the
+log so that only records appended during the fold remain. It runs in the
+background once the log passes COMPACT_BYTES or COMPACT_INTERVAL seconds
+have passed, or on demand by running this script.
+
+On open, the log is scanned to rebuild the index. A torn record at the tail,
+left by a crash mid-append, is truncated.
+"""
+
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from typing import Dict, List, Tuple, Any
+
+from label_damage import write_feature_collection
+
+RECORD_HEADER = struct.Struct('<II')
+LOG_FILE_NAME = 'labels.log'
+# Seconds the flusher waits to batch appends into one fsync
+FSYNC_DELAY = 0.005
+# Compact once the log grows past this many bytes...
+COMPACT_BYTES = 64 * 1024 * 1024
+# ...or when it has records and this many seconds passed since the last compaction
+COMPACT_INTERVAL = 300.0
+
+def building_key(feature: Dict[str, Any], index: int) -> str:
+    """
+    The building id the training page uses for a feature: its properties.id,
+    which every building tile carries, then the feature id or @id, and only
+    as a last resort its position in the tile.
+    """
+    properties = feature.get('properties') or {}
+    key = properties.get('id') or feature.get('id') or properties.get('@id') or index
+    return str(key).replace('/', '_')
+
+def _write_json_atomic(data: Any, path: str) -> None:
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+class LabelStore:
+    """
+    Append-only label log with a latest-offset index and background compaction.
+    """
+
+    def __init__(self, buildings_dir: str, tile_bounds: Dict[Tuple[int, int], Dict[str, float]] = None,
+                 fsync_delay: float = FSYNC_DELAY, compact_bytes: int = COMPACT_BYTES,
+                 compact_interval: float = COMPACT_INTERVAL):
+        self.buildings_dir = buildings_dir
+        self.log_path = os.path.join(buildings_dir, LOG_FILE_NAME)
+        self.tile_bounds = tile_bounds or {}
+        self.fsync_delay = fsync_delay
+        self.compact_bytes = compact_bytes
+        self.compact_interval = compact_interval
+
+        # Guards the log descriptor, the end offset and the index
+        self._lock = threading.Lock()
+        self._durable_changed = threading.Condition(self._lock)
+        self._fsync_lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._closed = False
+
+        self.label_index: Dict[Tuple[int, int], Dict[str, int]] = {}
+        self.crater_index: Dict[Tuple[int, int], int] = {}
+        self._fd = os.open(self.log_path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._end = self._recover()
+        # Bytes dropped by compaction; durability is tracked in base + offset terms
+        # so writers waiting across a log rotation are still released
+        self._base = 0
+        self._durable = self._end
+
+        self._pending = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name='label-log-fsync', daemon=True)
+        self._flusher.start()
+        self._compactor = None
+
+    def _recover(self) -> int:
+        """Rebuild the index from the log and truncate a torn tail record."""
+        size = os.fstat(self._fd).st_size
+        offset = 0
+        while offset + RECORD_HEADER.size <= size:
+            length, checksum = RECORD_HEADER.unpack(os.pread(self._fd, RECORD_HEADER.size, offset))
+            payload = os.pread(self._fd, length, offset + RECORD_HEADER.size)
+            if len(payload) != length or zlib.crc32(payload) != checksum:
+                break
+            self._index_record(offset, json.loads(payload))
+            offset += RECORD_HEADER.size + length
+        if offset != size:
+            print(f"Truncating {size - offset} bytes of torn records from {self.log_path}")
+            os.ftruncate(self._fd, offset)
+        return offset
+
+    def _index_record(self, offset: int, record: Dict[str, Any]) -> None:
+        tile = (record['row'], record['col'])
+        states = self.label_index.setdefault(tile, {})
+        for building_id in record.get('states') or {}:
+            states[building_id] = offset
+        if record.get('craters') is not None:
+            self.crater_index[tile] = offset
+
+    def _read_record(self, offset: int) -> Dict[str, Any]:
+        length, _ = RECORD_HEADER.unpack(os.pread(self._fd, RECORD_HEADER.size, offset))
+        return json.loads(os.pread(self._fd, length, offset + RECORD_HEADER.size))
+
+    def append(self, row: int, col: int, states: Dict[str, str], craters: List[Dict[str, float]] = None,
+               durable: bool = True) -> int:
+        """
+        Append one save and return its offset. With durable=True this returns
+        only after the record has been fsynced (group-committed with others).
+        """
+        record = {'row': row, 'col': col, 'states': states or {}}
+        if craters is not None:
+            record['craters'] = [{'lat': c['lat'], 'lng': c['lng'], 'radius': c['radius']} for c in craters]
+        payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        data = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Label store is closed")
+            offset = self._end
+            os.write(self._fd, data)
+            self._end += len(data)
+            self._index_record(offset, record)
+            end = self._base + self._end
+            self._pending.set()
+            if durable:
+                while self._durable < end and not self._closed:
+                    self._durable_changed.wait()
+        return offset
+
+    def _flush_loop(self) -> None:
+        """Fsync batches of appends and wake the writers waiting on them."""
+        while True:
+            self._pending.wait()
+            if self._closed:
+                return
+            time.sleep(self.fsync_delay)
+            self._pending.clear()
+            with self._fsync_lock:
+                with self._lock:
+                    fd, end = self._fd, self._base + self._end
+                os.fsync(fd)
+                # Rotation also takes the fsync lock, so fd is still the live log here
+                with self._lock:
+                    self._durable = max(self._durable, end)
+                    self._durable_changed.notify_all()
+
+    def log_size(self) -> int:
+        """Current size of the log in bytes."""
+        with self._lock:
+            return self._end
+
+    def get_label(self, row: int, col: int, building_id: str) -> str:
+        """The newest saved state of one building, or None."""
+        with self._lock:
+            offset = self.label_index.get((row, col), {}).get(building_id)
+            if offset is None:
+                return None
+            return self._read_record(offset)['states'][building_id]
+
+    def tile_labels(self, row: int, col: int) -> Dict[str, str]:
+        """The newest saved state of every labeled building in a tile."""
+        with self._lock:
+            index = dict(self.label_index.get((row, col), {}))
+            records = {offset: self._read_record(offset) for offset in set(index.values())}
+        return {building_id: records[offset]['states'][building_id] for building_id, offset in index.items()}
+
+    def tile_craters(self, row: int, col: int) -> List[Dict[str, float]]:
+        """The newest saved craters of a tile, or None if none were saved since compaction."""
+        with self._lock:
+            offset = self.crater_index.get((row, col))
+            return None if offset is None else self._read_record(offset)['craters']
+
+    def apply_labels(self, data: Dict[str, Any], labels: Dict[str, str]) -> int:
+        """Set is_damaged_labeled on the features of a FeatureCollection. Returns the count set."""
+        applied = 0
+        for index, feature in enumerate(data.get('features', [])):
+            state = labels.get(building_key(feature, index))
+            if state is not None:
+                feature.setdefault('properties', {})['is_damaged_labeled'] = "True" if state == 'damaged' else "False"
+                applied += 1
+        return applied
+
+    def compact(self) -> int:
+        """
+        Fold every indexed label into the tile files and drop the folded records
+        from the log. Returns the number of tiles written.
+        """
+        with self._compact_lock:
+            with self._lock:
+                if self._closed:
+                    return 0
+                cut = self._end
+                tiles = set(self.label_index) | set(self.crater_index)
+            if not cut:
+                return 0
+
+            for row, col in sorted(tiles):
+                labels = self.tile_labels(row, col)
+                path = os.path.join(self.buildings_dir, f'buildings_row_{row}_col_{col}.geojson')
+                if labels and os.path.exists(path):
+                    with open(path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    if self.apply_labels(data, labels):
+                        temp_path = f"{path}.{os.getpid()}.tmp"
+                        write_feature_collection(data, temp_path)
+                        os.replace(temp_path, path)
+
+                craters = self.tile_craters(row, col)
+                if craters is not None:
+                    crater_file = {'row': row, 'col': col, 'craters': craters}
+                    if (row, col) in self.tile_bounds:
+                        crater_file['bounds'] = self.tile_bounds[(row, col)]
+                    _write_json_atomic(crater_file, os.path.join(self.buildings_dir, f'craters_row_{row}_col_{col}.json'))
+
+            self._rotate(cut)
+            return len(tiles)
+
+    def _rotate(self, cut: int) -> None:
+        """Replace the log by its records after offset cut, rebasing the index."""
+        with self._fsync_lock, self._lock:
+            tail = os.pread(self._fd, self._end - cut, cut)
+            temp_path = self.log_path + '.compact'
+            fd = os.open(temp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644)
+            os.write(fd, tail)
+            os.fsync(fd)
+            os.replace(temp_path, self.log_path)
+            os.close(self._fd)
+            self._fd = fd
+            self._base += cut
+            self._end = len(tail)
+            self._durable = self._base + self._end
+            self._durable_changed.notify_all()
+
+            for tile in list(self.label_index):
+                rebased = {key: offset - cut for key, offset in self.label_index[tile].items() if offset >= cut}
+                if rebased:
+                    self.label_index[tile] = rebased
+                else:
+                    del self.label_index[tile]
+            self.crater_index = {tile: offset - cut for tile, offset in self.crater_index.items() if offset >= cut}
+
+    def start_compactor(self) -> None:
+        """Compact in a background thread whenever the log is large or old."""
+        def run() -> None:
+            last = time.monotonic()
+            while not self._closed:
+                time.sleep(1.0)
+                size = self.log_size()
+                if size >= self.compact_bytes or (size and time.monotonic() - last >= self.compact_interval):
+                    try:
+                        tiles = self.compact()
+                        print(f"Compacted labels of {tiles} tiles into {self.buildings_dir}")
+                    except OSError as e:
+                        print(f"Label compaction failed: {e}")
+                    last = time.monotonic()
+
+        self._compactor = threading.Thread(target=run, name='label-log-compact', daemon=True)
+        self._compactor.start()
+
+    def close(self) -> None:
+        """Flush outstanding appends and close the log."""
+        with self._fsync_lock, self._lock:
+            os.fsync(self._fd)
+            self._durable = self._base + self._end
+            self._closed = True
+            self._durable_changed.notify_all()
+            self._pending.set()
+            os.close(self._fd)
+
+def main() -> None:
+    """Fold the label log into the tile files."""
+
+    # Determine the buildings directory
+    if len(sys.argv) > 1:
+        buildings_dir = sys.argv[1]
+    else:
+        # Default path
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        buildings_dir = os.path.join(os.path.dirname(script_dir), 'data', 'building-polygons-labeled')
+
+    store = LabelStore(buildings_dir)
+    print(f"Compacting {store.log_path} ({store.log_size()} bytes)...")
+    tiles = store.compact()
+    store.close()
+    print(f"Wrote labels of {tiles} tiles.")
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+load_test_training_server.py
+
+Load-test harness for training_server.py.
+
+Simulates many annotators at once. Each client holds one keep-alive connection
+and repeatedly loads a random tile, marks a random subset of its buildings as
+damaged and saves the result. Latencies of /get_random_tile and
+/save_training_data are reported as p50/p99 along with request throughput.
+
+By default a server is started in a subprocess on a temporary copy of the
+tile CSV and building files, so the saves never touch data/. Pass --url to
+test an already running server instead, which WILL write its labels.
+
+Usage:
+    python load_test_training_server.py [--clients 32] [--requests 20] [--url http://127.0.0.1:5000]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+
+from label_store import building_key
+
+async def request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str,
+                  method: str, path: str, body: bytes = b'') -> Tuple[int, bytes]:
+    """Send one HTTP/1.1 request on an open connection and read the response."""
+    head = (
+        f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+    )
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+async def annotator(host: str, port: int, requests: int, latencies: Dict[str, List[float]],
+                    errors: List[str]) -> None:
+    """One simulated annotator: load a tile, label it, save it, repeat."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(requests):
+            start = time.perf_counter()
+            status, body = await request(reader, writer, host, 'GET', '/get_random_tile')
+            latencies['get_random_tile'].append(time.perf_counter() - start)
+            tile = json.loads(body)
+            if status != 200 or 'error' in tile:
+                errors.append(f"get_random_tile: {status} {tile.get('error')}")
+                continue
+
+            states = {
+                building_key(feature, index): random.choice(('intact', 'damaged'))
+                for index, feature in enumerate(tile['buildings'].get('features', []))
+            }
+            (lat_min, lon_min), (lat_max, lon_max) = tile['bounds']
+            craters = [{'lat': random.uniform(lat_min, lat_max), 'lng': random.uniform(lon_min, lon_max),
+                        'radius': random.uniform(3, 20)} for _ in range(random.randint(0, 3))]
+            payload = json.dumps({'row': tile['row'], 'col': tile['col'],
+                                  'buildingStates': states, 'craters': craters}).encode('utf-8')
+
+            start = time.perf_counter()
+            status, body = await request(reader, writer, host, 'POST', '/save_training_data', payload)
+            latencies['save_training_data'].append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(f"save_training_data: {status} {body[:200]!r}")
+    finally:
+        writer.close()
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+async def run_load_test(host: str, port: int, clients: int, requests: int) -> None:
+    latencies: Dict[str, List[float]] = {'get_random_tile': [], 'save_training_data': []}
+    errors: List[str] = []
+    start = time.perf_counter()
+    await asyncio.gather(*(annotator(host, port, requests, latencies, errors) for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"\n{clients} clients x {requests} rounds: {total} requests in {elapsed:.2f}s "
+          f"({total / elapsed:.0f} req/s), {len(errors)} errors")
+    print(f"{'endpoint':<20} {'count':>6} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, values in latencies.items():
+        if values:
+            print(f"{name:<20} {len(values):>6} {percentile(values, 0.5) * 1000:>9.2f} "
+                  f"{percentile(values, 0.99) * 1000:>9.2f} {max(values) * 1000:>9.2f}")
+    for error in errors[:5]:
+        print(f"  {error}")
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _wait_for_port(host: str, port: int, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on {host}:{port} did not start")
+
+def main() -> None:
+    """Main function to run the load test."""
+    parser = argparse.ArgumentParser(description='Load-test the training server.')
+    parser.add_argument('--clients', type=int, default=32, help='concurrent annotators')
+    parser.add_argument('--requests', type=int, default=20, help='load/save rounds per annotator')
+    parser.add_argument('--url', help='test a running server (its labels will be overwritten)')
+    args = parser.parse_args()
+
+    if args.url:
+        url = urlsplit(args.url)
+        asyncio.run(run_load_test(url.hostname, url.port or 80, args.clients, args.requests))
+        return
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.path.join(os.path.dirname(script_dir), 'data')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        print(f"Copying tiles to {temp_dir}...")
+        shutil.copy(os.path.join(data_dir, 'tile_bounds_coords_adj.csv'), temp_dir)
+        shutil.copytree(os.path.join(data_dir, 'building-polygons-labeled'),
+                        os.path.join(temp_dir, 'building-polygons-labeled'))
+
+        port = _free_port()
+        server = subprocess.Popen([sys.executable, os.path.join(script_dir, 'training_server.py'),
+                                   '127.0.0.1', str(port), temp_dir])
+        try:
+            _wait_for_port('127.0.0.1', port)
+            asyncio.run(run_load_test('127.0.0.1', port, args.clients, args.requests))
+        finally:
+            server.terminate()
+            server.wait()
+
+if __name__ == "__main__":
+    main()
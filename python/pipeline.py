@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+pipeline.py
+
+One entry point that rebuilds everything derived in data/, running independent
+stages concurrently.
+
+Run it from this directory with:
+
+    python -m pipeline [--data-dir DIR] [--jobs N] [--force] [--relabel | --replace-labels] [STAGE ...]
+
+The stages form a DAG. A stage is submitted to a process pool as soon as every
+stage it depends on has finished, so on a many-core machine the perimeter,
+stripping and building stages all run at once. Stages that use a process pool
+themselves (tile_perimeter, label_damage, vector_tiles, crater_density) spread
+over the remaining cores.
+
+Every stage is checked against the incremental_build manifest first and is
+skipped when its inputs and outputs are unchanged. --force reruns everything.
+The relabeling stages only run when --relabel is given or when they are named
+explicitly. Like the standalone tools, they leave the source labels alone: the
+merged craters go to all_craters_deduped.json and the crater-based labels to
+the is_damaged_craters property of the building tiles. --replace-labels, which
+implies --relabel, is destructive: it rewrites all_craters.json, the per-tile
+crater files and the is_damaged labels in place.
+
+Listing STAGE names runs only those stages and whatever they depend on. The
+ON_REQUEST_STAGES (vector_tiles) only run when named, since nothing reads their
+output yet. Each stage reports its run time, and a summary table is printed at
+the end.
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, List, Tuple, Any
+
+from build_building_bundle import bundle_from_columns, find_tile_files, merge_columns, write_bundle
+from build_crater_density import build_crater_density
+from build_damage_summary import build_damage_summary
+from build_heatmap_points import heatmap_points_from_columns, write_points
+from build_vector_tiles import build_vector_tiles
+from craters import load_craters
+from dedupe_craters import build_tile_entries, dedupe_craters, write_craters
+from extract_perimeter import create_geojson, extract_perimeter_rings, perimeter_geometry
+from extract_perimeter_2 import create_geojson_from_csv_overall_perimeter_fast
+from incremental_build import BUILD_DIR_NAME, BuildManifest, csv_rows_digest, load_tile_columns, prune_tile_cache
+from label_damage import CRATER_LABEL_PROPERTY, REPLACE_LABEL_PROPERTY, label_damage
+from strip_geojson import strip_geometry_streaming
+from tile_index import load_tile_index
+
+def data_paths(data_dir: str, replace_labels: bool = False) -> Dict[str, str]:
+    """
+    Paths of every file and directory the stages read or write. With
+    replace_labels the merged craters replace all_craters.json.
+    """
+    build_dir = os.path.join(data_dir, BUILD_DIR_NAME)
+    craters = os.path.join(data_dir, 'all_craters.json')
+    return {
+        'build_dir': build_dir,
+        'manifest': os.path.join(build_dir, 'manifest.json'),
+        'tile_cache': os.path.join(build_dir, 'tiles'),
+        'tile_csv': os.path.join(data_dir, 'tile_bounds_coords_adj.csv'),
+        'craters': craters,
+        'deduped_craters': craters if replace_labels else os.path.join(data_dir, 'all_craters_deduped.json'),
+        'buildings_dir': os.path.join(data_dir, 'building-polygons-labeled'),
+        'labels': os.path.join(data_dir, 'buildings_with_labels.geojson'),
+        'dataset_perimeter': os.path.join(data_dir, 'dataset_perimeter.geojson'),
+        'tile_perimeter': os.path.join(data_dir, 'tile_perimeter.geojson'),
+        'stripped_labels': os.path.join(data_dir, 'buildings_with_labels_stripped.geojson'),
+        'bundle': os.path.join(data_dir, 'buildings_bundle.bin'),
+        'bundle_gz': os.path.join(data_dir, 'buildings_bundle.bin.gz'),
+        'heatmap': os.path.join(data_dir, 'damage_heatmap_points.bin'),
+        'damage_summary': os.path.join(data_dir, 'damage_summary.json'),
+        'damage_summary_state': os.path.join(build_dir, 'damage_summary_state.pkl'),
+        'crater_density': os.path.join(data_dir, 'crater_density.json'),
+        'vector_tiles': os.path.join(data_dir, 'vector-tiles'),
+        'vector_tiles_index': os.path.join(data_dir, 'vector-tiles', 'index.json'),
+        'vector_tiles_state': os.path.join(build_dir, 'vector_tiles_state.pkl'),
+    }
+
+def _tile_columns(paths: Dict[str, str]) -> Dict[str, Any]:
+    """Merged building columns, reusing the per-tile cache."""
+    manifest = BuildManifest(paths['manifest'])
+    tile_columns, _ = load_tile_columns(manifest, paths['tile_cache'], find_tile_files(paths['buildings_dir']))
+    return merge_columns(tile_columns)
+
+def replaces_labels(paths: Dict[str, str]) -> bool:
+    """True when the relabel stages rewrite the source craters and labels in place."""
+    return paths['deduped_craters'] == paths['craters']
+
+def stage_dedupe_craters(paths: Dict[str, str]) -> None:
+    """
+    Merge duplicate crater detections into all_craters_deduped.json, or in place
+    into all_craters.json and the per-tile crater files with --replace-labels.
+    """
+    with open(paths['craters'], 'r', encoding='utf-8') as f:
+        tiles = json.load(f)
+    merged = dedupe_craters(load_craters(paths['craters']))
+    tiles_dir = paths['buildings_dir'] if replaces_labels(paths) else None
+    write_craters(build_tile_entries(tiles, merged), paths['deduped_craters'], tiles_dir)
+
+def stage_label_damage(paths: Dict[str, str]) -> None:
+    """
+    Label every building tile from the merged craters, in is_damaged_craters,
+    or in is_damaged with --replace-labels.
+    """
+    label_property = REPLACE_LABEL_PROPERTY if replaces_labels(paths) else CRATER_LABEL_PROPERTY
+    label_damage(paths['buildings_dir'], paths['deduped_craters'], label_property=label_property)
+
+def stage_dataset_perimeter(paths: Dict[str, str]) -> None:
+    """Trace the dataset perimeter from the tile grid."""
+    polygons = extract_perimeter_rings(load_tile_index(paths['tile_csv']).arrays())
+    if not polygons:
+        raise RuntimeError(f"no tiles to trace in {paths['tile_csv']}")
+    create_geojson(perimeter_geometry(polygons), paths['dataset_perimeter'])
+
+def stage_tile_perimeter(paths: Dict[str, str]) -> None:
+    """Union the tile bounds into the tile perimeter."""
+    create_geojson_from_csv_overall_perimeter_fast(paths['tile_csv'], paths['tile_perimeter'])
+
+def stage_stripped_labels(paths: Dict[str, str]) -> None:
+    """Strip geometry from the merged labels file."""
+    if not strip_geometry_streaming(paths['labels'], paths['stripped_labels']):
+        raise RuntimeError(f"could not strip {paths['labels']}")
+
+def stage_building_bundle(paths: Dict[str, str]) -> None:
+    """Encode the binary building bundle for the map."""
+    write_bundle(bundle_from_columns(_tile_columns(paths)), paths['bundle'])
+
+def stage_heatmap_points(paths: Dict[str, str]) -> None:
+    """Precompute the damaged-building heatmap points."""
+    write_points(heatmap_points_from_columns(_tile_columns(paths)), paths['heatmap'])
+
+def stage_damage_summary(paths: Dict[str, str]) -> None:
+    """Update the damage summary cube, recomputing only changed tiles."""
+    manifest = BuildManifest(paths['manifest'])
+    build_damage_summary(paths['buildings_dir'], paths['craters'], paths['damage_summary'],
+                         paths['damage_summary_state'], manifest.digest, paths['tile_csv'])
+
+def stage_crater_density(paths: Dict[str, str]) -> None:
+    """Rasterize the craters into the density grid and its map overlay."""
+    build_crater_density(paths['craters'], paths['tile_csv'], os.path.dirname(paths['crater_density']))
+
+def stage_vector_tiles(paths: Dict[str, str]) -> None:
+    """Update the zoom pyramid of vector tiles, rebuilding only tiles whose sources changed."""
+    manifest = BuildManifest(paths['manifest'])
+    build_vector_tiles(paths['buildings_dir'], paths['craters'], paths['vector_tiles'],
+                       state_file=paths['vector_tiles_state'], digest=manifest.digest, columns=_tile_columns(paths))
+
+# name -> (function, dependencies, input path keys, output path keys, in-place relabel stage)
+# The 'building_tiles' input stands for every file in buildings_dir.
+STAGES: Dict[str, Tuple[Callable[[Dict[str, str]], None], List[str], List[str], List[str], bool]] = {
+    'dedupe_craters': (stage_dedupe_craters, [], ['craters'], ['deduped_craters'], True),
+    'label_damage': (stage_label_damage, ['dedupe_craters'], ['deduped_craters', 'building_tiles'], [], True),
+    'dataset_perimeter': (stage_dataset_perimeter, [], ['tile_csv'], ['dataset_perimeter'], False),
+    'tile_perimeter': (stage_tile_perimeter, [], ['tile_csv'], ['tile_perimeter'], False),
+    'stripped_labels': (stage_stripped_labels, [], ['labels'], ['stripped_labels'], False),
+    'building_bundle': (stage_building_bundle, ['label_damage'], ['building_tiles'], ['bundle', 'bundle_gz'], False),
+    'heatmap_points': (stage_heatmap_points, ['label_damage'], ['building_tiles'], ['heatmap'], False),
+    'damage_summary': (stage_damage_summary, ['label_damage'], ['craters', 'building_tiles', 'tile_csv'],
+                       ['damage_summary'], False),
+    'crater_density': (stage_crater_density, ['dedupe_craters'], ['craters', 'tile_csv'], ['crater_density'], False),
+    'vector_tiles': (stage_vector_tiles, ['label_damage'], ['craters', 'building_tiles'], ['vector_tiles_index'], False),
+}
+
+# Stages whose output nothing in the site reads yet; they run only when named
+ON_REQUEST_STAGES = ('vector_tiles',)
+
+def _run_stage(name: str, paths: Dict[str, str]) -> float:
+    """Run one stage in a worker process and return its duration in seconds."""
+    start = time.perf_counter()
+    STAGES[name][0](paths)
+    return time.perf_counter() - start
+
+def stage_inputs(manifest: BuildManifest, name: str, paths: Dict[str, str]) -> Dict[str, str]:
+    """
+    Content hashes of a stage's inputs, keyed by path. Missing files hash to None.
+    """
+    inputs = {}
+    for key in STAGES[name][2]:
+        if key == 'building_tiles':
+            for _, _, path in find_tile_files(paths['buildings_dir']):
+                inputs[path] = manifest.digest(path)
+        elif key == 'tile_csv':
+            inputs[paths[key]] = csv_rows_digest(paths[key]) if manifest.digest(paths[key]) else None
+        else:
+            inputs[paths[key]] = manifest.digest(paths[key])
+    return inputs
+
+def select_stages(requested: List[str], relabel: bool) -> List[str]:
+    """
+    The stages to run: the requested ones plus their dependencies, or every
+    stage but the ON_REQUEST_STAGES when none are requested. Relabel stages
+    are only added by request.
+    """
+    if not requested:
+        return [name for name, stage in STAGES.items()
+                if (relabel or not stage[4]) and name not in ON_REQUEST_STAGES]
+
+    selected = set()
+    pending = list(requested)
+    while pending:
+        name = pending.pop()
+        if name not in STAGES:
+            raise ValueError(f"Unknown stage '{name}', expected one of: {', '.join(STAGES)}")
+        if name not in selected and (relabel or not STAGES[name][4] or name in requested):
+            selected.add(name)
+            pending.extend(STAGES[name][1])
+    return [name for name in STAGES if name in selected]
+
+def run_pipeline(data_dir: str, requested: List[str] = None, force: bool = False,
+                 relabel: bool = False, max_workers: int = None,
+                 replace_labels: bool = False) -> Dict[str, Tuple[str, float]]:
+    """
+    Run the selected stages in dependency order, concurrently where possible.
+    replace_labels lets the relabel stages overwrite the source craters and
+    labels, and implies relabel. Returns {stage: (status, seconds)}; status is
+    one of rebuilt, up to date, skipped or failed.
+    """
+    relabel = relabel or replace_labels
+    paths = data_paths(data_dir, replace_labels)
+    manifest = BuildManifest(paths['manifest'])
+    selected = select_stages(requested or [], relabel)
+    results: Dict[str, Tuple[str, float]] = {}
+    running: Dict[Any, Tuple[str, Dict[str, str]]] = {}
+
+    def ready(name: str) -> bool:
+        return all(dep in results or dep not in selected for dep in STAGES[name][1])
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        while len(results) < len(selected):
+            for name in selected:
+                if name in results or any(stage == name for stage, _ in running.values()) or not ready(name):
+                    continue
+                if any(results.get(dep, ('',))[0] in ('failed', 'skipped') for dep in STAGES[name][1]):
+                    results[name] = ('skipped', 0.0)
+                    print(f"  {name}: skipped, a dependency did not build")
+                    continue
+
+                # Inputs are hashed only now, after upstream stages have written them
+                inputs = stage_inputs(manifest, name, paths)
+                missing = [path for path, digest in inputs.items() if digest is None]
+                if missing:
+                    results[name] = ('skipped', 0.0)
+                    print(f"  {name}: skipped, missing input {missing[0]}")
+                elif not force and manifest.is_current(name, inputs, [paths[key] for key in STAGES[name][3]]):
+                    results[name] = ('up to date', 0.0)
+                    print(f"  {name}: up to date")
+                else:
+                    print(f"  {name}: started")
+                    running[pool.submit(_run_stage, name, paths)] = (name, inputs)
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, inputs = running.pop(future)
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    results[name] = ('failed', 0.0)
+                    print(f"  {name}: failed: {e}")
+                    continue
+                outputs = [paths[key] for key in STAGES[name][3]]
+                if STAGES[name][4]:
+                    # Relabel stages rewrite their inputs; record them as they are now
+                    inputs = stage_inputs(manifest, name, paths)
+                manifest.record(name, inputs, outputs)
+                manifest.save()
+                results[name] = ('rebuilt', seconds)
+                print(f"  {name}: rebuilt in {seconds:.3f}s")
+
+    if os.path.isdir(paths['tile_cache']):
+        prune_tile_cache(paths['tile_cache'], manifest, find_tile_files(paths['buildings_dir']))
+    manifest.save()
+    return results
+
+def main() -> None:
+    """Main function to run the pipeline."""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(prog='python -m pipeline', description='Rebuild the derived files in data/.')
+    parser.add_argument('stages', nargs='*', help=f"stages to run (default: all), from: {', '.join(STAGES)}")
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(script_dir), 'data'))
+    parser.add_argument('--jobs', type=int, default=None, help='concurrent stages (default: CPU count)')
+    parser.add_argument('--force', action='store_true', help='rebuild stages even when up to date')
+    parser.add_argument('--relabel', action='store_true',
+                        help='also deduplicate craters into all_craters_deduped.json and label buildings '
+                             'in is_damaged_craters')
+    parser.add_argument('--replace-labels', action='store_true',
+                        help='destructive: relabel in place, overwriting all_craters.json, the per-tile '
+                             'crater files and the is_damaged labels')
+    args = parser.parse_args()
+
+    print(f"Running pipeline on {args.data_dir}...")
+    start = time.perf_counter()
+    results = run_pipeline(args.data_dir, args.stages, args.force, args.relabel, args.jobs, args.replace_labels)
+
+    print("\nStage               Status       Time")
+    for name, (status, seconds) in results.items():
+        print(f"{name:<19} {status:<12} {seconds:7.3f}s")
+    print(f"Done in {time.perf_counter() - start:.3f}s!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+spans.py
+
+Lightweight span instrumentation shared by the processing scripts.
+
+A span times one phase of work and records item counts for it:
+
+    with span('extract_perimeter_2.union', tiles=len(geoms)) as s:
+        geom = unary_union(geoms)
+        s.count(vertices=shapely.get_num_coordinates(geom))
+
+Tracing is off unless the SPAN_TRACE environment variable names an output
+file, or enable() is called. While off, span() returns a shared no-op object,
+so an instrumented phase costs one function call and a global lookup.
+
+While on, every finished span is appended to the file as one event:
+    *.jsonl     one JSON object per line: name, parent, depth, pid, start
+                (Unix seconds), duration (seconds), peak_memory, counts
+    otherwise   Chrome trace events ("ph": "X"), loadable in chrome://tracing
+                or Perfetto; the unterminated array form is used so events
+                from several processes can be appended to one file
+
+peak_memory is the highest tracemalloc-traced memory during the span, in
+bytes above the level at its start. tracemalloc slows allocation-heavy code
+by a large factor, so set SPAN_TRACE_MEMORY=0 to record durations only.
+Events are appended with one write each, so pool workers inheriting
+SPAN_TRACE add their spans to the same file.
+
+Usage:
+    SPAN_TRACE=trace.json python extract_perimeter_2.py --fast
+    python spans.py trace.jsonl     # summarize a JSON-lines trace
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Any
+
+TRACE_ENV = 'SPAN_TRACE'
+MEMORY_ENV = 'SPAN_TRACE_MEMORY'
+
+class _NullSpan:
+    """The span returned while tracing is off; every method does nothing."""
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        return None
+
+    def count(self, **counts: int) -> None:
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Span:
+    """One timed phase. Use through span()."""
+
+    def __init__(self, tracer: '_Tracer', name: str, counts: Dict[str, int]):
+        self.tracer = tracer
+        self.name = name
+        self.counts = {key: int(value) for key, value in counts.items()}
+        self.parent = None
+        self.depth = 0
+        self.peak = 0
+
+    def count(self, **counts: int) -> None:
+        """Add to the span's item counts."""
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + int(value)
+
+    def __enter__(self) -> 'Span':
+        stack = self.tracer.stack()
+        if stack:
+            self.parent = stack[-1]
+            self.depth = len(stack)
+        if self.tracer.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # The peak is process-wide; fold it into the parent before resetting it
+            if self.parent is not None:
+                self.parent.peak = max(self.parent.peak, peak)
+            tracemalloc.reset_peak()
+            self.base_memory = current
+        stack.append(self)
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        duration = time.perf_counter() - self.start
+        stack = self.tracer.stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        peak_memory = None
+        if self.tracer.memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            if self.parent is not None:
+                self.parent.peak = max(self.parent.peak, self.peak)
+            peak_memory = max(0, self.peak - self.base_memory)
+        self.tracer.emit(self, duration, peak_memory, failed=exc_info[0] is not None)
+
+class _Tracer:
+    """Destination and settings of an enabled trace."""
+
+    def __init__(self, path: str, memory: bool):
+        self.path = path
+        self.chrome = not path.endswith('.jsonl')
+        self.memory = memory
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stack(self) -> List[Span]:
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def emit(self, span: Span, duration: float, peak_memory: int, failed: bool) -> None:
+        if self.chrome:
+            args: Dict[str, Any] = dict(span.counts)
+            if peak_memory is not None:
+                args['peak_memory'] = peak_memory
+            if failed:
+                args['failed'] = True
+            event = {'name': span.name, 'cat': span.name.split('.')[0], 'ph': 'X',
+                     'ts': round(span.wall_start * 1e6), 'dur': round(duration * 1e6),
+                     'pid': os.getpid(), 'tid': threading.get_ident() % 1000000, 'args': args}
+        else:
+            event = {'name': span.name, 'parent': span.parent.name if span.parent else None,
+                     'depth': span.depth, 'pid': os.getpid(), 'start': round(span.wall_start, 6),
+                     'duration': round(duration, 6), 'peak_memory': peak_memory, 'counts': span.counts}
+            if failed:
+                event['failed'] = True
+        line = json.dumps(event, separators=(',', ':'))
+
+        with self.lock:
+            # Reopened per event, which keeps forked pool workers safe; spans are coarse
+            with open(self.path, 'a', encoding='utf-8') as f:
+                if self.chrome and f.tell() == 0:
+                    f.write('[\n')
+                f.write(line + (',\n' if self.chrome else '\n'))
+
+_tracer: _Tracer = None
+
+def enable(path: str, memory: bool = True) -> None:
+    """Start appending spans to path (JSON lines if it ends in .jsonl, else a Chrome trace)."""
+    global _tracer
+    _tracer = _Tracer(path, memory)
+
+def disable() -> None:
+    """Stop tracing; span() becomes a no-op again."""
+    global _tracer
+    if _tracer is not None and _tracer.memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _tracer = None
+
+def enabled() -> bool:
+    """True while spans are being recorded."""
+    return _tracer is not None
+
+def span(name: str, **counts: int):
+    """
+    Context manager timing one phase. Keyword arguments are initial item
+    counts; more can be added with .count() on the returned span.
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return Span(_tracer, name, counts)
+
+def summarize(path: str) -> List[Dict[str, Any]]:
+    """
+    Total duration, call count, largest peak memory and summed counts per span
+    name in a JSON-lines trace, slowest first.
+    """
+    totals: Dict[str, Dict[str, Any]] = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            total = totals.setdefault(event['name'], {'name': event['name'], 'calls': 0, 'duration': 0.0,
+                                                      'peak_memory': None, 'counts': {}})
+            total['calls'] += 1
+            total['duration'] += event['duration']
+            if event.get('peak_memory') is not None:
+                total['peak_memory'] = max(total['peak_memory'] or 0, event['peak_memory'])
+            for key, value in event.get('counts', {}).items():
+                total['counts'][key] = total['counts'].get(key, 0) + value
+    return sorted(totals.values(), key=lambda total: -total['duration'])
+
+if os.environ.get(TRACE_ENV):
+    enable(os.environ[TRACE_ENV], memory=os.environ.get(MEMORY_ENV, '1') != '0')
+
+def main() -> None:
+    """Print a per-span summary of a JSON-lines trace."""
+    if len(sys.argv) < 2:
+        print(f"Usage: python {os.path.basename(__file__)} TRACE.jsonl")
+        sys.exit(1)
+
+    print(f"{'span':<40} {'calls':>6} {'total s':>10} {'peak MB':>9}  counts")
+    for total in summarize(sys.argv[1]):
+        peak = f"{total['peak_memory'] / 2 ** 20:9.1f}" if total['peak_memory'] is not None else f"{'-':>9}"
+        counts = ', '.join(f"{key}={value}" for key, value in total['counts'].items())
+        print(f"{total['name']:<40} {total['calls']:>6} {total['duration']:10.4f} {peak}  {counts}")
+
+if __name__ == "__main__":
+    main()
@@ -1,87 +1,309 @@
 # Filename: strip_geojson_geometry.py
 
+import contextlib
+import gzip
 import json
 import os
+import sys
+
+from geojson_writer import GeoJSONWriter
+from spans import span
 
 # --- Configuration ---
 # Set the input GeoJSON file path
 input_geojson_path = 'data/buildings_with_labels.geojson'
 # Set the desired output file path
 output_geojson_path = 'data/buildings_with_labels_stripped.geojson'
+# Stream features one at a time instead of loading the whole file (flat memory)
+streaming_mode = True
+# Optional list of property names to keep, e.g. ['id', 'is_damaged']; None keeps all
+keep_properties = None
+# Write gzip-compressed output (also implied by an output path ending in .gz)
+gzip_output = False
 # --- End Configuration ---
 
-def strip_geometry(input_path, output_path):
+# Bytes read from the input per refill in streaming mode
+STREAM_CHUNK_SIZE = 1 << 20
+
+
+class _JsonStreamReader:
+    """
+    Minimal incremental JSON reader over a text file.
+
+    Walks the top-level structure token by token and decodes one complete value
+    at a time with json.JSONDecoder.raw_decode, refilling the buffer from the
+    file only when a value runs past its end.
+    """
+
+    def __init__(self, infile, chunk_size=STREAM_CHUNK_SIZE):
+        self.infile = infile
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Drop consumed text and append the next chunk; returns False at EOF."""
+        if self.eof:
+            return False
+        # Read at least as much as is still pending so a value larger than the
+        # chunk size is retried a logarithmic, not linear, number of times
+        chunk = self.infile.read(max(self.chunk_size, len(self.buffer) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it ('' at EOF)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        """Consume the next non-whitespace character, which must be char."""
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expected '{char}'", self.buffer, self.pos)
+        self.pos += 1
+
+    def value(self):
+        """Decode and consume the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number may continue in the next chunk, so only trust it mid-buffer
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        """Yield the keys of the object starting here, leaving each value unread."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect('}')
+            return
+
+    def items(self):
+        """Yield the elements of the array starting here, one decoded value at a time."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect(']')
+            return
+
+
+def _open_input(path):
+    """Open a GeoJSON file for reading as text, decompressing it if it ends in .gz."""
+    opener = gzip.open if path.endswith('.gz') else open
+    return opener(path, 'rt', encoding='utf-8')
+
+
+def iter_features(path):
+    """
+    Yield the features of a GeoJSON FeatureCollection file one at a time,
+    without loading the whole file. Other top-level members are skipped.
+    Files ending in .gz are decompressed on the fly.
+    """
+    with _open_input(path) as infile:
+        reader = _JsonStreamReader(infile)
+        for key in reader.members():
+            if key == 'features':
+                yield from reader.items()
+            else:
+                reader.value()
+
+
+@contextlib.contextmanager
+def _atomic_writer(output_path, gzip_output=None):
+    """
+    GeoJSONWriter on a temporary file next to output_path, moved into place
+    only when the block completes. On any error the temporary file is removed
+    and output_path is left as it was.
+    """
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    if gzip_output is None:
+        gzip_output = output_path.endswith('.gz')
+    try:
+        with GeoJSONWriter(temp_path, gzip=gzip_output) as writer:
+            yield writer
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _strip_feature(feature, keep_properties=None):
+    """
+    Returns a geometry-free copy of a feature, or None if it is not a Feature.
+    If keep_properties is given, only those property names are kept.
+    """
+    if not isinstance(feature, dict) or feature.get('type') != 'Feature':
+        return None
+    properties = feature.get("properties", {}) # Use .get for safety
+    if keep_properties is not None and isinstance(properties, dict):
+        properties = {key: properties[key] for key in keep_properties if key in properties}
+    return {
+        "type": "Feature",
+        # Include 'id' if it exists at the feature level
+        **({"id": feature["id"]} if "id" in feature else {}),
+        # Always include 'properties'
+        "properties": properties
+    }
+
+def strip_geometry(input_path, output_path, keep_properties=None, gzip_output=None):
     """
     Reads a GeoJSON FeatureCollection, removes the 'geometry' field 
     from each feature, and writes the result to a new file.
 
     Args:
-        input_path (str): Path to the input GeoJSON file.
+        input_path (str): Path to the input GeoJSON file; .gz files are decompressed on the fly.
         output_path (str): Path where the output GeoJSON file will be saved.
+        keep_properties (list, optional): Property names to keep; None keeps all.
+        gzip_output (bool, optional): Compress the output; None compresses when output_path ends in .gz.
+
+    Returns:
+        bool: True if the output was written, False if an error was reported.
     """
     print(f"Reading GeoJSON file: {input_path}")
     
     try:
         # Open and load the input GeoJSON file
-        with open(input_path, 'r', encoding='utf-8') as infile:
+        with span('strip_geojson.read', bytes=os.path.getsize(input_path)), \
+             _open_input(input_path) as infile:
             data = json.load(infile)
 
         # Basic validation: Check if it's a FeatureCollection with features
         if not isinstance(data, dict) or data.get('type') != 'FeatureCollection' or 'features' not in data:
             print("Error: Input file is not a valid GeoJSON FeatureCollection.")
-            return
-
-        # Create the structure for the output GeoJSON
-        output_data = {
-            "type": "FeatureCollection",
-            "features": []
-        }
-        
-        # Optional: Copy other top-level members if they exist (like 'crs' or 'bbox')
-        for key, value in data.items():
-            if key not in ['type', 'features']:
-                output_data[key] = value
+            return False
 
         print(f"Processing {len(data['features'])} features...")
 
         # Iterate through each feature in the original data
-        for feature in data['features']:
-            if not isinstance(feature, dict) or feature.get('type') != 'Feature':
-                print("Warning: Skipping invalid feature structure.")
-                continue
+        features = []
+        with span('strip_geojson.strip', features=len(data['features'])):
+            for feature in data['features']:
+                if not isinstance(feature, dict) or feature.get('type') != 'Feature':
+                    print("Warning: Skipping invalid feature structure.")
+                    continue
 
-            # Create a new feature dictionary, excluding 'geometry'
-            new_feature = {
-                "type": "Feature",
-                # Include 'id' if it exists at the feature level
-                **({"id": feature["id"]} if "id" in feature else {}),
-                # Always include 'properties'
-                "properties": feature.get("properties", {}) # Use .get for safety
-            }
-            # Append the geometry-stripped feature to our output list
-            output_data['features'].append(new_feature)
-
-        # Ensure the output directory exists
-        output_dir = os.path.dirname(output_path)
-        if output_dir: # Check if path includes a directory
-             os.makedirs(output_dir, exist_ok=True) # Create directory if it doesn't exist
+                # Create a new feature dictionary, excluding 'geometry'
+                new_feature = _strip_feature(feature, keep_properties)
+                # Append the geometry-stripped feature to our output list
+                features.append(new_feature)
 
         print(f"Writing processed data to: {output_path}")
-        # Open the output file and write the modified data
-        with open(output_path, 'w', encoding='utf-8') as outfile:
-            # Use separators=(',', ':') for the most compact output
-            # Use indent=2 for readable output (larger file size)
-            json.dump(output_data, outfile, separators=(',', ':')) 
-            # json.dump(output_data, outfile, indent=2) # Alternative for readability
+        # GeoJSONWriter creates the output directory and writes compact JSON
+        with span('strip_geojson.write', features=len(features)), \
+             _atomic_writer(output_path, gzip_output) as writer:
+            writer.write_features(features)
+            # Optional: Copy other top-level members if they exist (like 'crs' or 'bbox')
+            for key, value in data.items():
+                if key not in ['type', 'features']:
+                    writer.write_member(key, value)
+
+        print("Processing complete.")
+        return True
+
+    except FileNotFoundError:
+        print(f"Error: Input file not found at {input_path}")
+    except json.JSONDecodeError:
+        print(f"Error: Could not decode JSON from {input_path}. Check file format.")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+    return False
+
+def strip_geometry_streaming(input_path, output_path, keep_properties=None, gzip_output=None):
+    """
+    Streaming version of strip_geometry with flat memory use.
+
+    Features are parsed one at a time and written straight to the output, so
+    only one feature is held in memory whatever the size of the input. Other
+    top-level members such as 'name', 'crs' or 'bbox' are copied as they appear.
+    Output goes to a temporary file that replaces output_path only once the
+    whole input was read, so a bad input never leaves a truncated output.
+
+    Args:
+        input_path (str): Path to the input GeoJSON file; .gz files are decompressed on the fly.
+        output_path (str): Path where the output GeoJSON file will be saved.
+        keep_properties (list, optional): Property names to keep; None keeps all.
+        gzip_output (bool, optional): Compress the output; None compresses when output_path ends in .gz.
 
+    Returns:
+        bool: True if the output was written, False if an error was reported.
+    """
+    print(f"Streaming GeoJSON file: {input_path}")
+    
+    try:
+        feature_count = 0
+        saw_collection = saw_features = False
+        with span('strip_geojson.stream', bytes=os.path.getsize(input_path)) as stream_span, \
+             _open_input(input_path) as infile, \
+             _atomic_writer(output_path, gzip_output) as writer:
+            reader = _JsonStreamReader(infile)
+
+            for key in reader.members():
+                if key == 'features':
+                    saw_features = True
+                    for feature in reader.items():
+                        new_feature = _strip_feature(feature, keep_properties)
+                        if new_feature is None:
+                            print("Warning: Skipping invalid feature structure.")
+                            continue
+                        writer.write_feature(new_feature)
+                    feature_count = writer.count
+                else:
+                    value = reader.value()
+                    if key == 'type':
+                        saw_collection = value == 'FeatureCollection'
+                        continue
+                    writer.write_member(key, value)
+
+            stream_span.count(features=feature_count)
+
+            # Basic validation: Check if it's a FeatureCollection with features
+            if not (saw_collection and saw_features):
+                raise ValueError("Input file is not a valid GeoJSON FeatureCollection.")
+
+        print(f"Wrote {feature_count} features to: {output_path}")
         print("Processing complete.")
+        return True
 
     except FileNotFoundError:
         print(f"Error: Input file not found at {input_path}")
     except json.JSONDecodeError:
         print(f"Error: Could not decode JSON from {input_path}. Check file format.")
+    except ValueError as e:
+        print(f"Error: {e}")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
+    return False
 
 # --- Main execution ---
 if __name__ == "__main__":
@@ -94,5 +316,12 @@ if __name__ == "__main__":
     # input_geojson_path = os.path.join(script_dir, input_geojson_path)
     # output_geojson_path = os.path.join(script_dir, output_geojson_path)
 
-    strip_geometry(input_geojson_path, output_geojson_path)
+    # The configured paths can be overridden on the command line
+    if len(sys.argv) > 2:
+        input_geojson_path, output_geojson_path = sys.argv[1:3]
+
+    if streaming_mode:
+        strip_geometry_streaming(input_geojson_path, output_geojson_path, keep_properties, gzip_output or None)
+    else:
+        strip_geometry(input_geojson_path, output_geojson_path, keep_properties, gzip_output or None)
 # --- End Main execution ---
\ No newline at end of file
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+tile_index.py
+
+Memory-mapped columnar index of the tile bounds CSV.
+
+The CSV is parsed once and compiled into a binary file next to it
+(tile_bounds_coords_adj.tileidx). Later runs map that file and get NumPy views
+of its columns without parsing anything. The index is recompiled whenever the
+CSV's size or modification time no longer match the ones recorded in it.
+
+File layout (little-endian, every section 8-byte aligned):
+
+    header      magic, version, tile count, CSV size and mtime_ns,
+                (row, col) grid origin and shape, bucket grid origin,
+                cell size and shape
+    columns     row, col (int32), lat_min, lat_max, lon_min, lon_max,
+                lat_center, lon_center (float64), one array per column
+    tile grid   int32 position of each (row, col), -1 where there is no tile
+    buckets     CSR lists of the tiles overlapping each cell of a regular
+                lon/lat grid: int64 offsets, then int32 tile positions
+
+(row, col) -> bounds is one lookup in the tile grid. Point -> tile assignment
+hashes each point to its bucket and tests the few tiles listed there, all
+vectorized, so millions of points (every crater or building centroid) are
+assigned in one pass. Tiles overlap their neighbours slightly; a point inside
+several tiles is assigned to the one whose center is nearest.
+
+Usage:
+    python tile_index.py [tiles.csv] [index file]
+"""
+
+import csv
+import mmap
+import os
+import struct
+import sys
+from typing import Dict, List, Tuple, Any
+
+import numpy as np
+
+INDEX_MAGIC = b"TIDX"
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.tileidx'
+# magic, version, count, csv size, csv mtime_ns,
+# min row, min col, grid rows, grid cols,
+# bucket lon/lat origin, bucket lon/lat size, bucket columns, bucket rows
+HEADER = struct.Struct('<4sIqqqqqqqddddqq')
+INT_COLUMNS = ('row', 'col')
+FLOAT_COLUMNS = ('lat_min', 'lat_max', 'lon_min', 'lon_max', 'lat_center', 'lon_center')
+REQUIRED_COLUMNS = {'row', 'col', 'lat_min', 'lat_max', 'lon_min', 'lon_max'}
+
+def default_index_path(csv_file: str) -> str:
+    """The index file compiled from a CSV: the CSV path with INDEX_SUFFIX."""
+    return os.path.splitext(csv_file)[0] + INDEX_SUFFIX
+
+def _aligned(offset: int) -> int:
+    return (offset + 7) & ~7
+
+def read_csv_columns(csv_file: str) -> Dict[str, np.ndarray]:
+    """
+    Parse the tile CSV into column arrays.
+
+    Rows with missing or non-numeric values or empty bounds are skipped with a
+    warning. Missing center columns are filled with the bounds midpoints.
+    """
+    columns: Dict[str, List[float]] = {name: [] for name in INT_COLUMNS + FLOAT_COLUMNS}
+    with open(csv_file, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        missing = REQUIRED_COLUMNS - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"Missing required columns in {csv_file}: {', '.join(sorted(missing))}")
+        has_centers = {'lat_center', 'lon_center'} <= set(reader.fieldnames)
+
+        for i, record in enumerate(reader):
+            try:
+                values = {name: int(record[name]) for name in INT_COLUMNS}
+                values.update({name: float(record[name]) for name in ('lat_min', 'lat_max', 'lon_min', 'lon_max')})
+                if has_centers:
+                    values['lat_center'] = float(record['lat_center'])
+                    values['lon_center'] = float(record['lon_center'])
+            except (ValueError, TypeError) as e:
+                print(f"Warning: skipping CSV row {i + 1} due to invalid number format: {e}")
+                continue
+            if not (values['lon_min'] < values['lon_max'] and values['lat_min'] < values['lat_max']):
+                print(f"Warning: skipping CSV row {i + 1} with empty bounds")
+                continue
+            if not has_centers:
+                values['lat_center'] = (values['lat_min'] + values['lat_max']) / 2
+                values['lon_center'] = (values['lon_min'] + values['lon_max']) / 2
+            for name, value in values.items():
+                columns[name].append(value)
+
+    arrays = {name: np.asarray(columns[name], dtype=np.int32) for name in INT_COLUMNS}
+    arrays.update({name: np.asarray(columns[name], dtype=np.float64) for name in FLOAT_COLUMNS})
+    return arrays
+
+def build_buckets(columns: Dict[str, np.ndarray]) -> Tuple[Tuple[float, float, float, float, int, int],
+                                                           np.ndarray, np.ndarray]:
+    """
+    Hash every tile into the cells of a regular lon/lat grid it overlaps.
+
+    The cell size is the median tile size, so a tile touches a handful of
+    cells and a cell lists a handful of tiles. Returns the grid (lon origin,
+    lat origin, cell width, cell height, columns, rows) and the CSR offsets
+    and tile positions.
+    """
+    lon_min, lat_min = columns['lon_min'], columns['lat_min']
+    lon_max, lat_max = columns['lon_max'], columns['lat_max']
+    if not len(lon_min):
+        return (0.0, 0.0, 1.0, 1.0, 1, 1), np.zeros(2, dtype=np.int64), np.zeros(0, dtype=np.int32)
+
+    origin_lon, origin_lat = float(lon_min.min()), float(lat_min.min())
+    size_lon = float(np.median(lon_max - lon_min))
+    size_lat = float(np.median(lat_max - lat_min))
+    nx = int((lon_max.max() - origin_lon) // size_lon) + 1
+    ny = int((lat_max.max() - origin_lat) // size_lat) + 1
+
+    x0 = ((lon_min - origin_lon) // size_lon).astype(np.int64)
+    x1 = np.minimum(((lon_max - origin_lon) // size_lon).astype(np.int64), nx - 1)
+    y0 = ((lat_min - origin_lat) // size_lat).astype(np.int64)
+    y1 = np.minimum(((lat_max - origin_lat) // size_lat).astype(np.int64), ny - 1)
+
+    # Expand each tile into the cells of its x0..x1, y0..y1 range
+    widths = x1 - x0 + 1
+    cell_counts = widths * (y1 - y0 + 1)
+    tiles = np.repeat(np.arange(len(lon_min), dtype=np.int32), cell_counts)
+    local = np.arange(len(tiles)) - np.repeat(np.cumsum(cell_counts) - cell_counts, cell_counts)
+    widths = np.repeat(widths, cell_counts)
+    cells = (np.repeat(y0, cell_counts) + local // widths) * nx + np.repeat(x0, cell_counts) + local % widths
+
+    order = np.argsort(cells, kind='stable')
+    offsets = np.zeros(nx * ny + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cells, minlength=nx * ny), out=offsets[1:])
+    return (origin_lon, origin_lat, size_lon, size_lat, nx, ny), offsets, tiles[order]
+
+def compile_tile_index(csv_file: str, index_file: str = None) -> str:
+    """
+    Compile the CSV into an index file and return its path.
+    """
+    index_file = index_file or default_index_path(csv_file)
+    stat = os.stat(csv_file)
+    columns = read_csv_columns(csv_file)
+    count = len(columns['row'])
+
+    rows, cols = columns['row'], columns['col']
+    min_row, min_col = (int(rows.min()), int(cols.min())) if count else (0, 0)
+    grid_shape = (int(rows.max()) - min_row + 1, int(cols.max()) - min_col + 1) if count else (0, 0)
+    grid = np.full(grid_shape, -1, dtype=np.int32)
+    # Later rows win when a (row, col) appears twice, like a dict keyed by (row, col)
+    grid[rows - min_row, cols - min_col] = np.arange(count, dtype=np.int32)
+
+    bucket_grid, offsets, bucket_tiles = build_buckets(columns)
+    header = HEADER.pack(INDEX_MAGIC, INDEX_VERSION, count, stat.st_size, stat.st_mtime_ns,
+                         min_row, min_col, grid_shape[0], grid_shape[1], *bucket_grid)
+
+    sections = [columns[name] for name in INT_COLUMNS + FLOAT_COLUMNS] + [grid.ravel(), offsets, bucket_tiles]
+    temp_file = f"{index_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'wb') as f:
+        f.write(header)
+        for array in sections:
+            f.write(b'\0' * (_aligned(f.tell()) - f.tell()))
+            f.write(np.ascontiguousarray(array).astype(array.dtype.newbyteorder('<'), copy=False).tobytes())
+    os.replace(temp_file, index_file)
+    return index_file
+
+class TileIndex:
+    """
+    Read-only view of a compiled tile index.
+
+    Columns are exposed as NumPy arrays backed by the mapped file: row, col,
+    lat_min, lat_max, lon_min, lon_max, lat_center, lon_center.
+    """
+
+    def __init__(self, index_file: str):
+        self.path = index_file
+        with open(index_file, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, count, self.csv_size, self.csv_mtime_ns, self.min_row, self.min_col,
+         grid_rows, grid_cols, self.bucket_lon, self.bucket_lat, self.bucket_width, self.bucket_height,
+         self.bucket_cols, self.bucket_rows) = HEADER.unpack_from(self._mmap, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"{index_file} is not a version {INDEX_VERSION} tile index")
+
+        offset = HEADER.size
+        def take(dtype: str, length: int) -> np.ndarray:
+            nonlocal offset
+            offset = _aligned(offset)
+            array = np.frombuffer(self._mmap, dtype=dtype, count=length, offset=offset)
+            offset += array.nbytes
+            return array
+
+        for name in INT_COLUMNS:
+            setattr(self, name, take('<i4', count))
+        for name in FLOAT_COLUMNS:
+            setattr(self, name, take('<f8', count))
+        self.grid = take('<i4', grid_rows * grid_cols).reshape(grid_rows, grid_cols)
+        self.bucket_offsets = take('<i8', self.bucket_cols * self.bucket_rows + 1)
+        self.bucket_tiles = take('<i4', int(self.bucket_offsets[-1]))
+
+    def __len__(self) -> int:
+        return len(self.row)
+
+    def is_current(self, csv_file: str) -> bool:
+        """True when the index was compiled from the CSV as it is now."""
+        stat = os.stat(csv_file)
+        return stat.st_size == self.csv_size and stat.st_mtime_ns == self.csv_mtime_ns
+
+    def position(self, row: int, col: int) -> int:
+        """Position of tile (row, col) in the columns, or -1 if there is no such tile."""
+        r, c = row - self.min_row, col - self.min_col
+        if 0 <= r < self.grid.shape[0] and 0 <= c < self.grid.shape[1]:
+            return int(self.grid[r, c])
+        return -1
+
+    def positions(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """Vectorized position(); -1 for (row, col) pairs without a tile."""
+        r = np.asarray(rows, dtype=np.int64) - self.min_row
+        c = np.asarray(cols, dtype=np.int64) - self.min_col
+        inside = (r >= 0) & (r < self.grid.shape[0]) & (c >= 0) & (c < self.grid.shape[1])
+        result = np.full(r.shape, -1, dtype=np.int64)
+        result[inside] = self.grid[r[inside], c[inside]]
+        return result
+
+    def bounds(self, row: int, col: int) -> Dict[str, float]:
+        """Bounds of tile (row, col) keyed like the CSV headers, or None."""
+        i = self.position(row, col)
+        if i < 0:
+            return None
+        return {name: float(getattr(self, name)[i]) for name in ('lat_min', 'lat_max', 'lon_min', 'lon_max')}
+
+    def locate(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        """
+        Position of the tile containing each point, or -1 for points outside
+        every tile. Points inside overlapping tiles go to the nearest center.
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        result = np.full(lat.shape, -1, dtype=np.int64)
+        if not len(self) or not lat.size:
+            return result
+
+        x = np.floor((lon - self.bucket_lon) / self.bucket_width)
+        y = np.floor((lat - self.bucket_lat) / self.bucket_height)
+        valid = (x >= 0) & (x < self.bucket_cols) & (y >= 0) & (y < self.bucket_rows)
+        cells = np.where(valid, y * self.bucket_cols + x, 0).astype(np.int64)
+        starts = self.bucket_offsets[cells]
+        counts = np.where(valid, self.bucket_offsets[cells + 1] - starts, 0)
+
+        # Test the k-th candidate of every point at once, for k up to the fullest bucket
+        best = np.full(lat.shape, np.inf)
+        for k in range(int(counts.max()) if counts.size else 0):
+            has = counts > k
+            tile = self.bucket_tiles[np.where(has, starts + k, 0)]
+            inside = (has & (lat >= self.lat_min[tile]) & (lat <= self.lat_max[tile])
+                      & (lon >= self.lon_min[tile]) & (lon <= self.lon_max[tile]))
+            distance = ((lat - self.lat_center[tile]) / self.bucket_height) ** 2 + \
+                       ((lon - self.lon_center[tile]) / self.bucket_width) ** 2
+            closer = inside & (distance < best)
+            result[closer] = tile[closer]
+            best[closer] = distance[closer]
+        return result
+
+    def locate_tiles(self, lat: np.ndarray, lon: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(row, col) of the tile containing each point; -1, -1 outside every tile."""
+        positions = self.locate(lat, lon)
+        inside = positions >= 0
+        rows = np.where(inside, self.row[np.maximum(positions, 0)], -1)
+        cols = np.where(inside, self.col[np.maximum(positions, 0)], -1)
+        return rows, cols
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """Column arrays keyed like the CSV headers."""
+        return {name: getattr(self, name) for name in INT_COLUMNS + FLOAT_COLUMNS}
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """One dict per tile, the shape extract_perimeter.read_tile_bounds returns."""
+        columns = {name: getattr(self, name).tolist() for name in INT_COLUMNS + FLOAT_COLUMNS}
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+def load_tile_index(csv_file: str, index_file: str = None) -> TileIndex:
+    """
+    Map the index of a tile CSV, compiling it first if it is missing or stale.
+    """
+    index_file = index_file or default_index_path(csv_file)
+    if os.path.exists(index_file):
+        try:
+            index = TileIndex(index_file)
+            if index.is_current(csv_file):
+                return index
+        except (ValueError, struct.error):
+            pass
+    return TileIndex(compile_tile_index(csv_file, index_file))
+
+def main() -> None:
+    """Compile the tile bounds CSV into its index."""
+
+    # Determine file paths
+    if len(sys.argv) > 1:
+        csv_file = sys.argv[1]
+    else:
+        # Default path
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        csv_file = os.path.join(os.path.dirname(script_dir), 'data', 'tile_bounds_coords_adj.csv')
+    index_file = sys.argv[2] if len(sys.argv) > 2 else default_index_path(csv_file)
+
+    print(f"Compiling {csv_file}...")
+    index = TileIndex(compile_tile_index(csv_file, index_file))
+    print(f"Indexed {len(index)} tiles in {index.bucket_cols}x{index.bucket_rows} buckets "
+          f"({os.path.getsize(index_file)} bytes) to {index_file}")
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+tile_store.py
+
+Shared, memory-bounded access to the per-tile building and crater files.
+
+TileStore is keyed on the (row, col) grid of tile_bounds_coords_adj.csv, read
+through tile_index. Tiles are parsed on first use only:
+    buildings   buildings_row_{r}_col_{c}.geojson, as its feature list plus a
+                (lon_min, lat_min, lon_max, lat_max) bbox array per feature
+    craters     craters_row_{r}_col_{c}.json, as its crater list plus lat/lon
+                arrays; tiles without a crater file have no craters
+
+Parsed tiles are kept in an LRU cache bounded by their estimated size in
+memory: the file size times PARSED_SIZE_FACTOR of the kind, since a parsed
+GeoJSON tile takes several times the bytes of its file. Every cache hit checks the file's size and mtime with one
+stat, so tiles rewritten by label_store or label_damage are parsed again.
+Files are loaded on a thread pool, and a tile requested by several threads at
+once is parsed only once.
+
+Bbox and tile-range queries select the tiles from the index arrays and load
+only those, a few at a time in parallel, so a query touches only the tiles it
+intersects and never holds more than a window of them outside the cache.
+Tiles overlap slightly and buildings on a seam are listed in both tiles, so
+building queries return each id once, from the first tile in (row, col) order.
+
+Usage:
+    python tile_store.py [lat_min lon_min lat_max lon_max]
+"""
+
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple, Any
+
+import numpy as np
+
+from build_building_bundle import iter_polygons
+from tile_index import load_tile_index
+
+# Memory budget of the parsed tiles, not of the files they came from
+CACHE_BYTES = 256 * 1024 * 1024
+# Bytes of memory a parsed tile takes per byte of its file, rounded up from
+# the largest ratios measured on the data tiles (about 5.7 and 1.5)
+PARSED_SIZE_FACTOR = {'buildings': 6, 'craters': 2}
+LOAD_THREADS = 8
+KINDS = ('buildings', 'craters')
+
+def feature_bboxes(features: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    (lon_min, lat_min, lon_max, lat_max) of every feature, NaN for features
+    without Polygon or MultiPolygon geometry.
+    """
+    counts = []
+    coords: List[List[float]] = []
+    for feature in features:
+        points = [point[:2] for polygon in iter_polygons(feature.get('geometry')) for ring in polygon for point in ring]
+        coords.extend(points)
+        counts.append(len(points))
+    bboxes = np.full((len(features), 4), np.nan)
+    counts = np.asarray(counts, dtype=np.int64)
+    present = counts > 0
+    if present.any():
+        points = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        starts = (np.cumsum(counts) - counts)[present]
+        bboxes[present, :2] = np.minimum.reduceat(points, starts)
+        bboxes[present, 2:] = np.maximum.reduceat(points, starts)
+    return bboxes
+
+def parse_buildings(path: str) -> Dict[str, Any]:
+    """Parse a building tile into its features and their bboxes."""
+    with open(path, 'r', encoding='utf-8') as f:
+        features = json.load(f).get('features', [])
+    return {'features': features, 'bbox': feature_bboxes(features)}
+
+def parse_craters(path: str) -> Dict[str, Any]:
+    """Parse a crater tile into its craters and their lat/lon arrays."""
+    with open(path, 'r', encoding='utf-8') as f:
+        craters = json.load(f).get('craters', [])
+    return {
+        'craters': craters,
+        'lat': np.asarray([crater['lat'] for crater in craters], dtype=np.float64),
+        'lon': np.asarray([crater['lng'] for crater in craters], dtype=np.float64),
+    }
+
+EMPTY_TILES = {
+    'buildings': {'features': [], 'bbox': np.zeros((0, 4))},
+    'craters': {'craters': [], 'lat': np.zeros(0), 'lon': np.zeros(0)},
+}
+PARSERS = {'buildings': parse_buildings, 'craters': parse_craters}
+
+class TileStore:
+    """
+    Lazily loaded, LRU-cached building and crater tiles with bbox queries.
+    """
+
+    def __init__(self, data_dir: str, buildings_dir: str = None, tile_csv: str = None,
+                 cache_bytes: int = CACHE_BYTES, max_workers: int = LOAD_THREADS):
+        self.buildings_dir = buildings_dir or os.path.join(data_dir, 'building-polygons-labeled')
+        self.index = load_tile_index(tile_csv or os.path.join(data_dir, 'tile_bounds_coords_adj.csv'))
+        self.max_workers = max_workers
+        self.cache_bytes = cache_bytes
+        self.size = 0
+        # (kind, row, col) -> (file size, mtime_ns, parsed tile, estimated bytes in memory)
+        self.entries: "OrderedDict[Tuple[str, int, int], Tuple[int, int, Dict[str, Any], int]]" = OrderedDict()
+        self.loading: Dict[Tuple[str, int, int], Future] = {}
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, kind: str, row: int, col: int) -> str:
+        if kind == 'buildings':
+            return os.path.join(self.buildings_dir, f'buildings_row_{row}_col_{col}.geojson')
+        return os.path.join(self.buildings_dir, f'craters_row_{row}_col_{col}.json')
+
+    def tiles(self) -> List[Tuple[int, int]]:
+        """Every (row, col) of the grid, sorted."""
+        return sorted(zip(self.index.row.tolist(), self.index.col.tolist()))
+
+    def tiles_in_bbox(self, lat_min: float, lon_min: float, lat_max: float, lon_max: float) -> List[Tuple[int, int]]:
+        """The (row, col) of every tile whose bounds intersect the bbox, sorted."""
+        index = self.index
+        hit = ((index.lat_min <= lat_max) & (index.lat_max >= lat_min)
+               & (index.lon_min <= lon_max) & (index.lon_max >= lon_min))
+        return sorted(zip(index.row[hit].tolist(), index.col[hit].tolist()))
+
+    def tiles_in_range(self, row_min: int, row_max: int, col_min: int, col_max: int) -> List[Tuple[int, int]]:
+        """The (row, col) of every tile with row and col in the inclusive ranges, sorted."""
+        index = self.index
+        hit = (index.row >= row_min) & (index.row <= row_max) & (index.col >= col_min) & (index.col <= col_max)
+        return sorted(zip(index.row[hit].tolist(), index.col[hit].tolist()))
+
+    def _load(self, key: Tuple[str, int, int], path: str, signature: Tuple[int, int]) -> Dict[str, Any]:
+        try:
+            tile = PARSERS[key[0]](path)
+            with self.lock:
+                self._put(key, signature, tile)
+            return tile
+        finally:
+            with self.lock:
+                self.loading.pop(key, None)
+
+    def _put(self, key: Tuple[str, int, int], signature: Tuple[int, int], tile: Dict[str, Any]) -> None:
+        self._discard(key)
+        estimate = signature[0] * PARSED_SIZE_FACTOR[key[0]]
+        self.entries[key] = signature + (tile, estimate)
+        self.size += estimate
+        while self.size > self.cache_bytes and len(self.entries) > 1:
+            _, (_, _, _, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def _discard(self, key: Tuple[str, int, int]) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[3]
+
+    def submit(self, kind: str, row: int, col: int) -> Future:
+        """
+        Start loading a tile on the thread pool, unless it is cached and its
+        file unchanged. Returns a future of the parsed tile.
+        """
+        key = (kind, row, col)
+        path = self.path(kind, row, col)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            future: Future = Future()
+            future.set_result(EMPTY_TILES[kind])
+            return future
+        signature = (stat.st_size, stat.st_mtime_ns)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[:2] == signature:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                future = Future()
+                future.set_result(entry[2])
+                return future
+            if key not in self.loading:
+                self.misses += 1
+                self.loading[key] = self.pool.submit(self._load, key, path, signature)
+            return self.loading[key]
+
+    def get(self, kind: str, row: int, col: int) -> Dict[str, Any]:
+        """The parsed tile, loading it if needed."""
+        return self.submit(kind, row, col).result()
+
+    def buildings(self, row: int, col: int) -> List[Dict[str, Any]]:
+        """The building features of a tile."""
+        return self.get('buildings', row, col)['features']
+
+    def craters(self, row: int, col: int) -> List[Dict[str, Any]]:
+        """The craters of a tile."""
+        return self.get('craters', row, col)['craters']
+
+    def iter_tiles(self, kind: str, keys: List[Tuple[int, int]]) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+        """
+        Yield (row, col, tile) for the given tiles in order, loading up to
+        max_workers ahead of the one being yielded.
+        """
+        pending = deque()
+        keys = iter(keys)
+        for row, col in keys:
+            pending.append((row, col, self.submit(kind, row, col)))
+            if len(pending) >= self.max_workers:
+                break
+        while pending:
+            row, col, future = pending.popleft()
+            for next_row, next_col in keys:
+                pending.append((next_row, next_col, self.submit(kind, next_row, next_col)))
+                break
+            yield row, col, future.result()
+
+    def buildings_in_tiles(self, keys: List[Tuple[int, int]], bbox: Tuple[float, float, float, float] = None
+                           ) -> List[Dict[str, Any]]:
+        """
+        Building features of the given tiles, each id once. With a bbox of
+        (lat_min, lon_min, lat_max, lon_max), only features whose own bbox
+        intersects it are returned.
+        """
+        features = []
+        seen = set()
+        for _, _, tile in self.iter_tiles('buildings', keys):
+            selected = range(len(tile['features']))
+            if bbox is not None:
+                lat_min, lon_min, lat_max, lon_max = bbox
+                boxes = tile['bbox']
+                hit = ((boxes[:, 0] <= lon_max) & (boxes[:, 2] >= lon_min)
+                       & (boxes[:, 1] <= lat_max) & (boxes[:, 3] >= lat_min))
+                selected = np.flatnonzero(hit).tolist()
+            for i in selected:
+                feature = tile['features'][i]
+                building_id = (feature.get('properties') or {}).get('id', feature.get('id'))
+                if building_id is not None:
+                    if building_id in seen:
+                        continue
+                    seen.add(building_id)
+                features.append(feature)
+        return features
+
+    def craters_in_tiles(self, keys: List[Tuple[int, int]], bbox: Tuple[float, float, float, float] = None
+                         ) -> List[Dict[str, Any]]:
+        """Craters of the given tiles, only those centered in the bbox if one is given."""
+        craters = []
+        for _, _, tile in self.iter_tiles('craters', keys):
+            if bbox is None:
+                craters.extend(tile['craters'])
+                continue
+            lat_min, lon_min, lat_max, lon_max = bbox
+            hit = (tile['lat'] >= lat_min) & (tile['lat'] <= lat_max) & (tile['lon'] >= lon_min) & (tile['lon'] <= lon_max)
+            craters.extend(tile['craters'][i] for i in np.flatnonzero(hit).tolist())
+        return craters
+
+    def buildings_in_bbox(self, lat_min: float, lon_min: float, lat_max: float, lon_max: float) -> List[Dict[str, Any]]:
+        """Building features whose bbox intersects the given one, each id once."""
+        bbox = (lat_min, lon_min, lat_max, lon_max)
+        return self.buildings_in_tiles(self.tiles_in_bbox(*bbox), bbox)
+
+    def craters_in_bbox(self, lat_min: float, lon_min: float, lat_max: float, lon_max: float) -> List[Dict[str, Any]]:
+        """Craters centered in the given bbox."""
+        bbox = (lat_min, lon_min, lat_max, lon_max)
+        return self.craters_in_tiles(self.tiles_in_bbox(*bbox), bbox)
+
+    def buildings_in_range(self, row_min: int, row_max: int, col_min: int, col_max: int) -> List[Dict[str, Any]]:
+        """Building features of the tiles in the inclusive row and col ranges, each id once."""
+        return self.buildings_in_tiles(self.tiles_in_range(row_min, row_max, col_min, col_max))
+
+    def craters_in_range(self, row_min: int, row_max: int, col_min: int, col_max: int) -> List[Dict[str, Any]]:
+        """Craters of the tiles in the inclusive row and col ranges."""
+        return self.craters_in_tiles(self.tiles_in_range(row_min, row_max, col_min, col_max))
+
+    def invalidate(self, row: int = None, col: int = None) -> None:
+        """Drop one tile (both kinds) from the cache, or every tile without arguments."""
+        with self.lock:
+            if row is None:
+                self.entries.clear()
+                self.size = 0
+                return
+            for kind in KINDS:
+                self._discard((kind, row, col))
+
+    def close(self) -> None:
+        """Stop the loader threads."""
+        self.pool.shutdown(wait=True)
+
+    def __enter__(self) -> 'TileStore':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+def main() -> None:
+    """Query the buildings and craters in a bbox, or the whole grid."""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.path.join(os.path.dirname(script_dir), 'data')
+
+    with TileStore(data_dir) as store:
+        if len(sys.argv) > 4:
+            bbox = [float(value) for value in sys.argv[1:5]]
+        else:
+            index = store.index
+            bbox = [float(index.lat_min.min()), float(index.lon_min.min()),
+                    float(index.lat_max.max()), float(index.lon_max.max())]
+        print(f"Querying lat {bbox[0]:.6f}..{bbox[2]:.6f}, lon {bbox[1]:.6f}..{bbox[3]:.6f}...")
+        tiles = store.tiles_in_bbox(*bbox)
+        buildings = store.buildings_in_bbox(*bbox)
+        craters = store.craters_in_bbox(*bbox)
+        print(f"{len(tiles)} tiles: {len(buildings)} buildings, {len(craters)} craters.")
+        print(f"Cache: {len(store.entries)} tiles, {store.size / 2 ** 20:.1f} MB, "
+              f"{store.hits} hits, {store.misses} misses.")
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
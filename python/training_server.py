@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+training_server.py
+
+Local asyncio backend for templates/train_images_direct_local.html.
+
+Endpoints:
+    GET  /                      the training page
+    GET  /get_random_tile       {row, col, bounds, image_url, buildings}
+    GET  /tile_image/R_C.webp   the tile image
+    POST /save_training_data    {row, col, buildingStates, craters} -> {message, saved_craters}
+    GET  /static/...            Leaflet assets from assets/
+
+Tiles come from tile_bounds_coords_adj.csv, images from
+images/tiles/cropped_row_R_col_C.webp and buildings from
+data/building-polygons-labeled/buildings_row_R_col_C.geojson. Only tiles that
+have both an image and a building file are served.
+
+Encoded images and building GeoJSON are kept in an LRU cache bounded by
+CACHE_BYTES. A background task keeps the next PREFETCH_DEPTH random tiles
+loaded, so /get_random_tile normally answers from memory. All disk reads and
+writes run in a thread pool, so a slow disk never stalls the event loop, and
+concurrent loads of one tile share a single read.
+
+Saves are appended to the label_store log and acknowledged once fsynced;
+served building GeoJSON overlays the newest logged labels, and background
+compaction folds them into is_damaged_labeled of the tile files and into
+craters_row_R_col_C.json. Unlike the original tool, no training image crops
+are written, because no imaging library is required here.
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple, Any
+from urllib.parse import urlsplit
+
+from extract_perimeter import read_tile_bounds
+from label_store import LabelStore
+
+HOST = '127.0.0.1'
+PORT = 5000
+# Upper bound on cached image and GeoJSON bytes
+CACHE_BYTES = 256 * 1024 * 1024
+# Random tiles kept loaded ahead of requests
+PREFETCH_DEPTH = 8
+DISK_THREADS = 8
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.css': 'text/css',
+    '.js': 'application/javascript',
+    '.json': 'application/json',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+}
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+class LRUCache:
+    """
+    Least-recently-used cache of bytes values, bounded by their total size.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: "OrderedDict[Any, bytes]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any) -> bytes:
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Any, value: bytes) -> None:
+        self.discard(key)
+        self.entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def discard(self, key: Any) -> None:
+        value = self.entries.pop(key, None)
+        if value is not None:
+            self.size -= len(value)
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+class TrainingServer:
+    """
+    Tile catalog, cache, prefetcher and request handlers.
+    """
+
+    def __init__(self, repo_dir: str, data_dir: str = None, images_dir: str = None,
+                 cache_bytes: int = CACHE_BYTES, prefetch_depth: int = PREFETCH_DEPTH):
+        self.repo_dir = repo_dir
+        data_dir = data_dir or os.path.join(repo_dir, 'data')
+        self.buildings_dir = os.path.join(data_dir, 'building-polygons-labeled')
+        self.images_dir = images_dir or os.path.join(repo_dir, 'images', 'tiles')
+        self.template = os.path.join(repo_dir, 'templates', 'train_images_direct_local.html')
+        self.static_dirs = {
+            'css': [os.path.join(repo_dir, 'assets', 'css'), os.path.join(repo_dir, 'css')],
+            'js': [os.path.join(repo_dir, 'assets', 'js', 'lib'), os.path.join(repo_dir, 'assets', 'js')],
+            'images': [os.path.join(repo_dir, 'assets', 'images')],
+        }
+
+        self.tiles: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        for tile in read_tile_bounds(os.path.join(data_dir, 'tile_bounds_coords_adj.csv')):
+            key = (tile['row'], tile['col'])
+            if os.path.exists(self.image_path(*key)) and os.path.exists(self.buildings_path(*key)):
+                self.tiles[key] = tile
+        self.tile_keys = sorted(self.tiles)
+
+        self.cache = LRUCache(cache_bytes)
+        self.prefetch_depth = prefetch_depth
+        self.prefetched: asyncio.Queue = None
+        self.loading: Dict[Any, asyncio.Future] = {}
+        bounds = {key: {name: tile[name] for name in ('lat_min', 'lat_max', 'lon_min', 'lon_max')}
+                  for key, tile in self.tiles.items()}
+        self.labels = LabelStore(self.buildings_dir, bounds)
+        self.disk = ThreadPoolExecutor(max_workers=DISK_THREADS)
+
+    def image_path(self, row: int, col: int) -> str:
+        return os.path.join(self.images_dir, f'cropped_row_{row}_col_{col}.webp')
+
+    def buildings_path(self, row: int, col: int) -> str:
+        return os.path.join(self.buildings_dir, f'buildings_row_{row}_col_{col}.geojson')
+
+    def craters_path(self, row: int, col: int) -> str:
+        return os.path.join(self.buildings_dir, f'craters_row_{row}_col_{col}.json')
+
+    async def run_on_disk(self, function, *args):
+        """Run blocking file work in the disk thread pool."""
+        return await asyncio.get_running_loop().run_in_executor(self.disk, function, *args)
+
+    async def cached(self, key: Tuple, source: Any, load=_read_bytes) -> bytes:
+        """
+        Return the cached bytes for key, running load(*source) (or reading the
+        file at source) once no matter how many requests ask at the same time.
+        """
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+        if key in self.loading:
+            return await asyncio.shield(self.loading[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self.loading[key] = future
+        try:
+            args = source if isinstance(source, tuple) else (source,)
+            value = await self.run_on_disk(load, *args)
+            self.cache.put(key, value)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Waiters re-raise it; don't warn when there are none
+            raise
+        finally:
+            del self.loading[key]
+
+    async def tile_payload(self, row: int, col: int) -> Tuple[bytes, bytes]:
+        """The encoded image and building GeoJSON of a tile."""
+        return await asyncio.gather(
+            self.cached(('image', row, col), self.image_path(row, col)),
+            self.cached(('buildings', row, col), (row, col), self._encode_buildings),
+        )
+
+    async def prefetch_loop(self) -> None:
+        """Keep the next random tiles loaded ahead of requests."""
+        while True:
+            row, col = random.choice(self.tile_keys)
+            try:
+                await self.tile_payload(row, col)
+            except OSError as e:
+                print(f"Prefetch of tile {row}, {col} failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            await self.prefetched.put((row, col))
+
+    async def get_random_tile(self) -> Tuple[int, bytes, str]:
+        if not self.tile_keys:
+            return _json_response({'error': 'No tiles with both an image and buildings were found.'})
+        try:
+            row, col = self.prefetched.get_nowait()
+        except asyncio.QueueEmpty:
+            row, col = random.choice(self.tile_keys)
+        _, buildings = await self.tile_payload(row, col)
+
+        tile = self.tiles[(row, col)]
+        head = json.dumps({
+            'row': row,
+            'col': col,
+            'bounds': [[tile['lat_min'], tile['lon_min']], [tile['lat_max'], tile['lon_max']]],
+            'image_url': f'/tile_image/{row}_{col}.webp',
+        })
+        # Splice the cached GeoJSON bytes in rather than decoding and re-encoding them
+        body = head[:-1].encode('utf-8') + b', "buildings": ' + buildings + b'}'
+        return 200, body, CONTENT_TYPES['.json']
+
+    async def save_training_data(self, body: bytes) -> Tuple[int, bytes, str]:
+        try:
+            request = json.loads(body)
+            row, col = int(request['row']), int(request['col'])
+        except (ValueError, KeyError, TypeError):
+            return _json_response({'error': 'Expected JSON with row, col, buildingStates and craters.'}, 400)
+        if (row, col) not in self.tiles:
+            return _json_response({'error': f'Unknown tile row {row}, col {col}.'}, 404)
+
+        states = request.get('buildingStates') or {}
+        craters = request.get('craters')
+        # Returns once the record is fsynced; the tile file is updated by compaction
+        await self.run_on_disk(self.labels.append, row, col, states, craters)
+        # A read that raced the append may still be filling the cache; drop its result too
+        key = ('buildings', row, col)
+        if key in self.loading:
+            await asyncio.wait([self.loading[key]])
+        self.cache.discard(key)
+
+        damaged = sum(1 for state in states.values() if state == 'damaged')
+        message = f"Saved {damaged} damaged of {len(states)} buildings for tile row {row}, col {col}"
+        response: Dict[str, Any] = {'message': message}
+        if craters is not None:
+            response['message'] += f" and {len(craters)} craters"
+            response['saved_craters'] = craters
+        return _json_response(response)
+
+    def _encode_buildings(self, row: int, col: int) -> bytes:
+        """Read a building file, overlay the newest logged labels and encode it compactly."""
+        with open(self.buildings_path(row, col), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.labels.apply_labels(data, self.labels.tile_labels(row, col))
+        return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+    async def static_file(self, path: str) -> Tuple[int, bytes, str]:
+        parts = path.strip('/').split('/')
+        if len(parts) != 3 or parts[1] not in self.static_dirs or parts[2] in ('', '.', '..'):
+            return 404, b'Not found', 'text/plain'
+        for directory in self.static_dirs[parts[1]]:
+            file_path = os.path.join(directory, parts[2])
+            if os.path.isfile(file_path):
+                body = await self.cached(('static', file_path), file_path)
+                return 200, body, CONTENT_TYPES.get(os.path.splitext(file_path)[1], 'application/octet-stream')
+        return 404, b'Not found', 'text/plain'
+
+    async def route(self, method: str, target: str, body: bytes) -> Tuple[int, bytes, str]:
+        """Dispatch one request to its handler."""
+        path = urlsplit(target).path
+        if path == '/save_training_data':
+            if method != 'POST':
+                return 405, b'Use POST', 'text/plain'
+            return await self.save_training_data(body)
+        if method not in ('GET', 'HEAD'):
+            return 405, b'Use GET', 'text/plain'
+        if path == '/get_random_tile':
+            return await self.get_random_tile()
+        if path.startswith('/tile_image/') and path.endswith('.webp'):
+            try:
+                row, col = (int(part) for part in path[len('/tile_image/'):-len('.webp')].split('_'))
+            except ValueError:
+                return 404, b'Not found', 'text/plain'
+            if (row, col) not in self.tiles:
+                return 404, b'Not found', 'text/plain'
+            image, _ = await self.tile_payload(row, col)
+            return 200, image, CONTENT_TYPES['.webp']
+        if path in ('/', '/train'):
+            return 200, await self.cached(('static', self.template), self.template), CONTENT_TYPES['.html']
+        if path.startswith('/static/'):
+            return await self.static_file(path)
+        return 404, b'Not found', 'text/plain'
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve HTTP/1.1 requests on one keep-alive connection."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await _send(writer, 400, b'Bad request line', 'text/plain', False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0) or 0)
+                if length > MAX_BODY_BYTES:
+                    await _send(writer, 413, b'Request body too large', 'text/plain', False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and version.upper() != 'HTTP/1.0')
+
+                try:
+                    status, payload, content_type = await self.route(method.upper(), target, body)
+                except Exception as e:
+                    status, payload, content_type = _json_response({'error': str(e)}, 500)
+                if method.upper() == 'HEAD':
+                    payload = b''
+                await _send(writer, status, payload, content_type, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = HOST, port: int = PORT, ready: asyncio.Event = None) -> None:
+        """Start the prefetcher and serve until cancelled."""
+        self.prefetched = asyncio.Queue(maxsize=self.prefetch_depth)
+        prefetcher = asyncio.create_task(self.prefetch_loop()) if self.tile_keys else None
+        self.labels.start_compactor()
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=1024)
+        print(f"Serving {len(self.tile_keys)} tiles on http://{host}:{port}/")
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if prefetcher:
+                prefetcher.cancel()
+            self.disk.shutdown(wait=True)
+            self.labels.close()
+
+def _json_response(data: Dict[str, Any], status: int = 200) -> Tuple[int, bytes, str]:
+    return status, json.dumps(data).encode('utf-8'), CONTENT_TYPES['.json']
+
+async def _send(writer: asyncio.StreamWriter, status: int, body: bytes, content_type: str, keep_alive: bool) -> None:
+    head = (
+        f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        f"Cache-Control: no-store\r\n\r\n"
+    )
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+
+def main() -> None:
+    """Main function to run the server."""
+
+    # Optional host, port and data directory
+    host = sys.argv[1] if len(sys.argv) > 1 else HOST
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else PORT
+    data_dir = sys.argv[3] if len(sys.argv) > 3 else None
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    server = TrainingServer(os.path.dirname(script_dir), data_dir)
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        print("Stopped.")
+
+if __name__ == "__main__":
+    main()